@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite on synthetic tracks with a known tempo
+
+Generates click and drum-pattern WAV files at known BPMs, lengths, sample
+rates and bit depths, runs the detector on them and reports per-stage timing
+(decode, trim, DWT, filter, ACF, peak pick), throughput, peak memory and the
+error against the ground-truth tempo as JSON. Two result files can be
+compared to flag regressions.
+
+Usage:
+    python benchmark.py run [--preset quick|full] [--output bench.json] [--tracks DIR] [--precision float32]
+    python benchmark.py compare baseline.json bench.json [--tolerance 0.1]
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+
+import numpy
+
+from bpm_detection.bpm_detection import ALGORITHM_VERSION, PRECISIONS, iter_windows
+from bpm_detection.profiling import Profile
+
+# (style, bpm, length in seconds, sample rate, bits per sample)
+PRESETS = {
+    "quick": [
+        ("click", 128, 10, 44100, 16),
+        ("drum", 100, 60, 44100, 16),
+        ("drum", 128, 60, 48000, 24),
+        ("click", 90, 60, 22050, 16),
+        ("drum", 174, 60, 44100, 32),
+        ("drum", 140, 300, 44100, 16),
+    ],
+}
+PRESETS["full"] = PRESETS["quick"] + [
+    ("drum", 124, 1800, 44100, 16),
+    ("drum", 128, 3600, 48000, 24),
+    ("drum", 120, 7200, 44100, 16),
+]
+
+STAGES = ["decode", "trim", "dwt", "filter", "acf", "peak"]
+
+# A detected tempo further than this from the ground truth is an error
+TOLERANCE_BPM = 1.0
+
+# Between runs of the same ALGORITHM_VERSION (e.g. float64 and float32) the
+# detected tempo may not move by more than this
+DRIFT_BPM = 0.05
+
+# Tracks are synthesised and written in chunks of this many seconds
+CHUNK_SECONDS = 10
+
+WINDOW_SECONDS = 3
+
+
+def _events(style, fs):
+    """Sound events of a style as (beat offset within a bar, waveform) pairs"""
+    rng = numpy.random.default_rng(0)
+
+    def decay(seconds, tau):
+        return numpy.exp(-numpy.arange(int(seconds * fs)) / (tau * fs))
+
+    if style == "click":
+        click = rng.standard_normal(int(0.03 * fs)) * decay(0.03, 0.005)
+        return [(beat, click) for beat in range(4)]
+
+    # Kick on every beat, snare on 2 and 4, closed hi-hat on the off-beats
+    t = numpy.arange(int(0.25 * fs)) / fs
+    kick = numpy.sin(2 * numpy.pi * (45 * t + 40 * 0.03 * (1 - numpy.exp(-t / 0.03)))) * decay(0.25, 0.06)
+    snare = 0.6 * rng.standard_normal(int(0.15 * fs)) * decay(0.15, 0.04)
+    hihat = 0.25 * numpy.diff(rng.standard_normal(int(0.04 * fs) + 1)) * decay(0.04, 0.01)
+    return ([(beat, kick) for beat in range(4)] + [(beat, snare) for beat in (1, 3)]
+            + [(beat + 0.5, hihat) for beat in range(4)])
+
+
+def write_track(filename, style, bpm, length, fs, bits):
+    """Synthesise a track with a steady tempo and write it as PCM WAV, chunk by chunk"""
+    events = _events(style, fs)
+    longest = max(len(wave_form) for _, wave_form in events)
+    beat = 60.0 / bpm
+    rng = numpy.random.default_rng(bpm)
+    total = int(length * fs)
+    scale = 2 ** (bits - 1) - 1
+
+    with wave.open(filename, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(bits // 8)
+        wf.setframerate(fs)
+
+        for first in range(0, total, CHUNK_SECONDS * fs):
+            last = min(first + CHUNK_SECONDS * fs, total)
+            chunk = 0.01 * rng.standard_normal(last - first)
+
+            # Every event that overlaps this chunk, including ones starting before it
+            first_bar = max(0, math.floor((first - longest) / fs / (4 * beat)))
+            for bar in range(first_bar, math.ceil(last / fs / (4 * beat)) + 1):
+                for offset, wave_form in events:
+                    start = int(round((bar * 4 + offset) * beat * fs)) - first
+                    lo, hi = max(start, 0), min(start + len(wave_form), len(chunk))
+                    if lo < hi:
+                        chunk[lo:hi] += wave_form[lo - start : hi - start]
+
+            samples = numpy.clip(chunk * 0.5, -1, 1) * scale
+            if bits == 16:
+                raw = samples.astype("<i2").tobytes()
+            elif bits == 24:
+                raw = samples.astype("<i4").view(numpy.uint8).reshape(-1, 4)[:, :3].tobytes()
+            else:
+                raw = samples.astype("<i4").tobytes()
+            wf.writeframes(raw)
+
+
+def stage_timings(filename, precision="float64"):
+    """Seconds spent in every stage when analysing a file window by window"""
+    profile = Profile()
+    for _ in iter_windows(filename, WINDOW_SECONDS, profile=profile, dtype=precision):
+        pass
+    return {stage: profile.stages.get(stage, {"seconds": 0.0})["seconds"] for stage in STAGES}
+
+
+def peak_memory(filename, precision="float64"):
+    """Peak bytes allocated while analysing a file (a separate run, as tracing slows it down)"""
+    tracemalloc.start()
+    try:
+        for _ in iter_windows(filename, WINDOW_SECONDS, dtype=precision):
+            pass
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_case(filename, style, bpm, length, fs, bits, precision="float64"):
+    """Benchmark one track: an end-to-end run, a traced run for memory and a per-stage run"""
+    start = time.perf_counter()
+    bpms = [window_bpm for _, window_bpm, _ in iter_windows(filename, WINDOW_SECONDS, dtype=precision)]
+    total = time.perf_counter() - start
+    peak = peak_memory(filename, precision)
+
+    detected = float(numpy.median(bpms)) if bpms else None
+    error = abs(detected - bpm) if detected is not None else None
+    return {
+        "name": os.path.splitext(os.path.basename(filename))[0],
+        "style": style,
+        "bpm": bpm,
+        "length_s": length,
+        "fs": fs,
+        "bits": bits,
+        "total_s": round(total, 4),
+        "realtime_factor": round(length / total, 1),
+        "samples_per_s": round(length * fs / total),
+        "peak_mb": round(peak / 2 ** 20, 1),
+        "stages_s": {stage: round(seconds, 4) for stage, seconds in stage_timings(filename, precision).items()},
+        "detected_bpm": None if detected is None else round(detected, 2),
+        "error_bpm": None if error is None else round(error, 2),
+        "ok": error is not None and error < TOLERANCE_BPM,
+    }
+
+
+def run(preset, tracks_dir, progress=True, precision="float64"):
+    """Generate the tracks of a preset (reusing existing ones) and benchmark each"""
+    import scipy
+
+    # Warm up, so the first case does not pay for imports and FFT planning
+    warm_up = numpy.random.default_rng(0).standard_normal(WINDOW_SECONDS * 8000)
+    list(iter_windows(warm_up, WINDOW_SECONDS, fs=8000, dtype=precision))
+
+    cases = []
+    for style, bpm, length, fs, bits in PRESETS[preset]:
+        filename = os.path.join(tracks_dir, f"{style}_{bpm}bpm_{length}s_{fs}hz_{bits}bit.wav")
+        if not os.path.exists(filename):
+            write_track(filename, style, bpm, length, fs, bits)
+        cases.append(run_case(filename, style, bpm, length, fs, bits, precision))
+        if progress:
+            case = cases[-1]
+            print(f"{case['name']:<40} {case['total_s']:>8.2f} s {case['realtime_factor']:>7.1f}x realtime "
+                  f"{case['peak_mb']:>7.1f} MB  bpm {case['detected_bpm']} ({'ok' if case['ok'] else 'WRONG'})",
+                  file=sys.stderr)
+
+    return {
+        "meta": {
+            "preset": preset,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "algorithm_version": ALGORITHM_VERSION,
+            "precision": precision,
+            "python": platform.python_version(),
+            "numpy": numpy.__version__,
+            "scipy": scipy.__version__,
+            "platform": platform.platform(),
+        },
+        "cases": cases,
+    }
+
+
+def compare(baseline, current, tolerance=0.1):
+    """
+    Regressions of a benchmark run against a baseline run
+
+    A case regresses when it got more than `tolerance` (relative) slower or
+    hungrier for memory, or when its tempo is no longer within
+    TOLERANCE_BPM of the ground truth. Runs of the same ALGORITHM_VERSION,
+    such as a float32 run against a float64 baseline, must also agree on
+    every detected tempo to within DRIFT_BPM.
+
+    Returns:
+        (report lines, list of regression descriptions)
+    """
+    old_cases = {case["name"]: case for case in baseline["cases"]}
+    same_version = baseline.get("meta", {}).get("algorithm_version") == current.get("meta", {}).get("algorithm_version")
+    lines = [f"{'case':<40} {'time':>16} {'memory':>16} {'bpm error':>14}"]
+    regressions = []
+
+    for case in current["cases"]:
+        old = old_cases.get(case["name"])
+        if old is None:
+            lines.append(f"{case['name']:<40} (not in baseline)")
+            continue
+
+        time_ratio = case["total_s"] / max(old["total_s"], 1e-9)
+        memory_ratio = case["peak_mb"] / max(old["peak_mb"], 0.1)
+        lines.append(f"{case['name']:<40} {old['total_s']:>6.2f} -> {case['total_s']:<6.2f} "
+                     f"{old['peak_mb']:>6.1f} -> {case['peak_mb']:<6.1f} "
+                     f"{old['error_bpm']} -> {case['error_bpm']}")
+
+        if time_ratio > 1 + tolerance:
+            slowest = max(STAGES, key=lambda stage: case["stages_s"][stage] - old["stages_s"].get(stage, 0))
+            regressions.append(f"{case['name']}: {time_ratio:.2f}x slower (mostly {slowest})")
+        if memory_ratio > 1 + tolerance and case["peak_mb"] - old["peak_mb"] > 1:
+            regressions.append(f"{case['name']}: peak memory {memory_ratio:.2f}x")
+        if old["ok"] and not case["ok"]:
+            regressions.append(f"{case['name']}: detected {case['detected_bpm']} instead of {case['bpm']} BPM")
+        elif same_version and None not in (old["detected_bpm"], case["detected_bpm"]) \
+                and abs(case["detected_bpm"] - old["detected_bpm"]) > DRIFT_BPM:
+            regressions.append(f"{case['name']}: detected {case['detected_bpm']} instead of {old['detected_bpm']} BPM "
+                               f"of the baseline")
+
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark BPM detection on synthetic tracks with a known tempo.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Generate tracks and benchmark them")
+    run_parser.add_argument("--preset", choices=list(PRESETS), default="quick",
+                            help="quick: 10 s to 5 min; full: adds 30 min to 2 h tracks [quick]")
+    run_parser.add_argument("--output", default="-", help="JSON result file; '-' writes to stdout [-]")
+    run_parser.add_argument("--tracks", default=None,
+                            help="Directory for the generated tracks, reused between runs [temporary]")
+    run_parser.add_argument("--precision", choices=PRECISIONS, default="float64",
+                            help="Floating point type of the analysis [float64]")
+
+    compare_parser = commands.add_parser("compare", help="Flag regressions between two result files")
+    compare_parser.add_argument("baseline", help="Result file of the reference run")
+    compare_parser.add_argument("current", help="Result file of the run to check")
+    compare_parser.add_argument("--tolerance", type=float, default=0.1,
+                                help="Allowed relative slow-down or memory growth [0.1]")
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        lines, regressions = compare(baseline, current, args.tolerance)
+        print("\n".join(lines))
+        for regression in regressions:
+            print("REGRESSION:", regression)
+        return 1 if regressions else 0
+
+    if args.tracks:
+        os.makedirs(args.tracks, exist_ok=True)
+        results = run(args.preset, args.tracks, precision=args.precision)
+    else:
+        with tempfile.TemporaryDirectory() as tracks_dir:
+            results = run(args.preset, tracks_dir, precision=args.precision)
+
+    text = json.dumps(results, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
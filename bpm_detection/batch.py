@@ -0,0 +1,412 @@
+"""
+Batch BPM analysis of whole music libraries
+
+Walks a directory tree (or glob pattern) and fans the audio files out across a
+pool of worker processes, so the interpreter start-up and scipy/pywt import
+cost is paid once per worker instead of once per file. Results are streamed
+to CSV or JSONL as files finish. With a ResultCache, files that were analysed
+before with the same parameters are answered from the cache without being
+decoded.
+
+Usage:
+    python bpm_detection/bpm_detection.py batch <dir|glob> [--workers N] [--output results.csv]
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import glob
+import io
+import json
+import os
+import sys
+import time
+
+import numpy
+
+try:
+    from .bpm_detection import (ANALYSIS_SECONDS, BPM_RANGE, CHANNEL_MODES, CONFIDENCE_THRESHOLD, DECODERS,
+                                ENVELOPE_OCTAVE_RANGE, LEVELS, PRECISIONS, detect_adaptive, detect_windows,
+                                envelope_tempo_curve, parse_start, read_audio, resample, resolve_section,
+                                tempo_confidence)
+    from .cache import DEFAULT_CACHE_PATH, DEFAULT_ENVELOPE_DIR, EnvelopeStore, ResultCache, analysis_params
+    from .profiling import Profile, print_profile, stage
+except ImportError:
+    from bpm_detection import (ANALYSIS_SECONDS, BPM_RANGE, CHANNEL_MODES, CONFIDENCE_THRESHOLD, DECODERS,
+                               ENVELOPE_OCTAVE_RANGE, LEVELS, PRECISIONS, detect_adaptive, detect_windows,
+                               envelope_tempo_curve, parse_start, read_audio, resample, resolve_section,
+                               tempo_confidence)
+    from cache import DEFAULT_CACHE_PATH, DEFAULT_ENVELOPE_DIR, EnvelopeStore, ResultCache, analysis_params
+    from profiling import Profile, print_profile, stage
+
+AUDIO_EXTENSIONS = (".wav", ".mp3")
+
+RESULT_FIELDS = ["path", "bpm", "confidence", "duration", "windows", "status", "error"]
+
+
+def find_audio_files(target):
+    """All audio files below a directory, or matching a glob pattern, sorted"""
+    if os.path.isdir(target):
+        paths = []
+        for dirpath, _, filenames in os.walk(target):
+            paths.extend(os.path.join(dirpath, name) for name in filenames)
+    else:
+        paths = glob.glob(target, recursive=True)
+
+    return sorted(path for path in paths
+                  if os.path.isfile(path) and os.path.splitext(path)[1].lower() in AUDIO_EXTENSIONS)
+
+
+def analyse_file(path, window=3, hop=None, backend=None, start=None, duration=None, rate=None, profile=None,
+                 channels="mid", adaptive=None, precision="float64", envelope_cache=None, bpm_range=BPM_RANGE,
+                 octave_range=ENVELOPE_OCTAVE_RANGE):
+    """
+    Median BPM over all windows of one file (runs in a worker process)
+
+    Only the section given by start ("auto" skips the intro) and duration
+    is decoded, and it is resampled to rate first if that is lower than the
+    file's sample rate.
+
+    Args:
+        profile: None, or "time"/"memory" to profile the stages (with
+            allocation tracing for "memory")
+        channels: How multichannel audio is analysed (see CHANNEL_MODES)
+        adaptive: None to analyse every window, or a confidence threshold
+            at which detect_adaptive stops decoding the file
+        precision: Floating point type of the analysis (see PRECISIONS)
+        envelope_cache: Directory of an EnvelopeStore; the tempo is then
+            estimated from the file's stored onset envelope (computed and
+            stored first if missing), as for a tempo curve
+        bpm_range, octave_range: Tempo range and octave rule of the
+            envelope_cache analysis (see envelope_bpm)
+
+    Returns:
+        Result row as a dict with the RESULT_FIELDS keys plus the per-window
+        BPMs under "window_bpms" (not in adaptive mode), and the
+        Profile.as_dict() under "profile" when profiling
+    """
+    profiler = Profile(trace_allocations=profile == "memory") if profile else None
+    # The readers report problems by printing; keep that out of the output
+    # stream and use it as the error message instead
+    messages = io.StringIO()
+    with contextlib.redirect_stdout(messages):
+        start, duration = resolve_section(path, start, duration, backend)
+
+    if envelope_cache is not None:
+        with contextlib.redirect_stdout(messages):
+            store = EnvelopeStore(envelope_cache)
+            envelope, fs, offset = store.envelope(path, backend=backend, start=start, duration=duration, rate=rate,
+                                                  channels=channels, profile=profiler, dtype=precision)
+            if envelope is None:
+                raise ValueError(messages.getvalue().strip() or "could not decode audio")
+            _, bpms, ratios = envelope_tempo_curve(envelope, fs, window, hop or window, offset, profile=profiler,
+                                                   dtype=precision, bpm_range=bpm_range, octave_range=octave_range,
+                                                   return_peak_ratios=True)
+        duration = len(envelope) * 2 ** LEVELS / fs
+
+    elif adaptive is not None:
+        with contextlib.redirect_stdout(messages):
+            result = detect_adaptive(path, window, hop, backend=backend, start=start, duration=duration, rate=rate,
+                                     profile=profiler, channels=channels, threshold=adaptive, dtype=precision)
+            if result is None:
+                raise ValueError(messages.getvalue().strip() or "could not decode audio")
+        row = adaptive_row(path, result)
+        if profiler:
+            row["profile"] = profiler.as_dict()
+        return row
+
+    else:
+        with contextlib.redirect_stdout(messages):
+            samps, fs = read_audio(path, lazy=True, backend=backend, start=start, duration=duration,
+                                   profile=profiler, channels=channels)
+            if samps is None or fs is None:
+                raise ValueError(messages.getvalue().strip() or "could not decode audio")
+            if rate and rate < fs:
+                with stage(profiler, "resample", len(samps)):
+                    samps, fs = resample(samps, fs, rate), rate
+            _, bpms, ratios = detect_windows(samps, fs, window, hop, profile=profiler, return_peak_ratios=True,
+                                             dtype=precision)
+        duration = len(samps) / fs
+
+    row = windows_row(path, bpms, ratios, duration)
+    if profiler:
+        row["profile"] = profiler.as_dict()
+    return row
+
+
+def windows_row(path, bpms, ratios, duration):
+    """Result row for per-window BPMs (NaN without one) and their peak_to_median ratios"""
+    _, confidence = tempo_confidence(bpms, ratios)
+    bpms = bpms[~numpy.isnan(bpms)]
+    return {
+        "path": path,
+        "bpm": round(float(numpy.median(bpms)), 2) if len(bpms) else None,
+        "confidence": round(confidence, 3),
+        "duration": round(duration, 3),
+        "windows": len(bpms),
+        "status": "ok" if len(bpms) else "no_bpm",
+        "error": None,
+        "window_bpms": [round(float(bpm), 2) for bpm in bpms],
+    }
+
+
+def error_row(path, error):
+    """Result row for a file whose analysis raised error"""
+    return {"path": path, "bpm": None, "confidence": None, "duration": None, "windows": 0,
+            "status": "error", "error": str(error) or type(error).__name__}
+
+
+def adaptive_row(path, result):
+    """Result row for the TempoResult of detect_adaptive"""
+    return {
+        "path": path,
+        "bpm": None if result.bpm is None else round(result.bpm, 2),
+        "confidence": round(result.confidence, 3),
+        "duration": round(result.seconds, 3),
+        "windows": result.windows,
+        "status": "ok" if result.bpm is not None else "no_bpm",
+        "error": None,
+    }
+
+
+class ResultWriter:
+    """Writes result rows as CSV or JSONL, flushing after every row"""
+
+    def __init__(self, stream, fmt="csv"):
+        self.stream = stream
+        self.fmt = fmt
+        if fmt == "csv":
+            self._csv = csv.DictWriter(stream, fieldnames=RESULT_FIELDS, extrasaction="ignore")
+            self._csv.writeheader()
+
+    def write(self, row):
+        if self.fmt == "csv":
+            self._csv.writerow(row)
+        else:
+            self.stream.write(json.dumps({key: row.get(key) for key in RESULT_FIELDS}) + "\n")
+        self.stream.flush()
+
+
+class Throughput:
+    """Aggregate progress counters for a batch run"""
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.cached = 0
+        self.audio_seconds = 0.0
+        self.start = time.perf_counter()
+
+    def add(self, row, cached=False):
+        self.done += 1
+        self.cached += cached
+        if row["status"] == "error":
+            self.failed += 1
+        self.audio_seconds += row["duration"] or 0.0
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        return (f"{self.done}/{self.total} files ({self.failed} failed, {self.cached} cached) in {elapsed:.1f} s: "
+                f"{self.done / elapsed:.2f} files/s, {self.audio_seconds / 3600 / elapsed:.3f} audio-hours/s")
+
+
+def run_batch(paths, writer, workers=None, window=3, hop=None, retries=1, progress=None, cache=None,
+              backend=None, start=None, duration=None, rate=None, profile=None, channels="mid", adaptive=None,
+              precision="float64", envelope_cache=None, bpm_range=BPM_RANGE,
+              octave_range=ENVELOPE_OCTAVE_RANGE):
+    """
+    Analyse files in a process pool and write each result as soon as it is ready
+
+    At most a few tasks per worker are in flight at any time, so very large
+    libraries do not queue up hundreds of thousands of futures. Files that
+    fail are retried up to `retries` times and then written with status
+    "error". A crashed worker breaks the pool; it is replaced and the
+    affected files count as a failed attempt.
+
+    Args:
+        paths: Audio files to analyse
+        writer: ResultWriter for the rows
+        workers: Number of worker processes [os.cpu_count()]
+        window: Window length in seconds
+        hop: Distance between window starts in seconds [window]
+        retries: Extra attempts for files that fail
+        progress: Optional callable receiving the Throughput after every file
+        cache: Optional ResultCache consulted before and updated after
+            analysing a file
+        backend: Decoder backend name [first installed one per file type]
+        start: Start of the analysed section in seconds, or "auto"
+        duration: Length of the analysed section in seconds [to the end]
+        rate: Internal sample rate to resample to before analysis [full rate]
+        profile: Optional Profile; the stage timings of every analysed file
+            (not of cached ones) are added to it
+        channels: How multichannel audio is analysed (see CHANNEL_MODES)
+        adaptive: Confidence threshold at which each file's analysis stops
+            early (see detect_adaptive); None analyses every window
+        precision: Floating point type of the analysis (see PRECISIONS)
+        envelope_cache, bpm_range, octave_range: Estimate the tempo from
+            onset envelopes kept in this EnvelopeStore directory, with this
+            tempo range and octave rule (see analyse_file)
+
+    Returns:
+        Throughput with the final counters
+    """
+    workers = workers or os.cpu_count() or 1
+    stats = Throughput(len(paths))
+    params = analysis_params(window, hop, start, duration, rate, channels, adaptive, precision,
+                             "windows" if envelope_cache is None else "envelope", bpm_range, octave_range)
+    profiling = None if profile is None else "memory" if profile.trace_allocations else "time"
+    pending = list(reversed(paths))
+    attempts = {}
+    running = {}
+
+    def finish(row, cached=False):
+        writer.write(row)
+        stats.add(row, cached)
+        if progress:
+            progress(stats)
+
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    try:
+        while pending or running:
+            while pending and len(running) < workers * 4:
+                path = pending.pop()
+                cached = None
+                if cache is not None and path not in attempts:
+                    # Missing or unreadable files are reported by the analysis
+                    with contextlib.suppress(OSError):
+                        cached = cache.get(path, params)
+                if cached is not None:
+                    finish(dict(cached, path=path), cached=True)
+                    continue
+                running[executor.submit(analyse_file, path, window, hop, backend, start, duration, rate,
+                                        profiling, channels, adaptive, precision, envelope_cache, bpm_range,
+                                        octave_range)] = path
+
+            if not running:
+                break
+
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            pool_broken = False
+            for future in finished:
+                path = running.pop(future)
+                try:
+                    row = future.result()
+                except Exception as e:
+                    pool_broken = pool_broken or isinstance(e, concurrent.futures.process.BrokenProcessPool)
+                    attempts[path] = attempts.get(path, 0) + 1
+                    if attempts[path] <= retries:
+                        pending.append(path)
+                        continue
+                    row = error_row(path, e)
+                else:
+                    if profile is not None:
+                        profile.merge(row.pop("profile"))
+                    if cache is not None:
+                        with contextlib.suppress(OSError):
+                            cache.put(path, params, {key: value for key, value in row.items() if key != "path"})
+
+                finish(row)
+
+            if pool_broken:
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="bpm_detection.py batch",
+        description="Determine the Beats Per Minute of every .wav/.mp3 file in a directory tree or glob.",
+    )
+    parser.add_argument("target", help="Directory to scan recursively, or a glob pattern such as 'music/**/*.mp3'")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes [CPU count]")
+    parser.add_argument("--window", type=float, default=3, help="Size of the analysis window in seconds [3]")
+    parser.add_argument("--hop", type=float, default=None, help="Distance between window starts in seconds [window]")
+    parser.add_argument("--start", type=parse_start, default=None,
+                        help="Only analyse from this many seconds into each file, or 'auto' to skip the intro [0]")
+    parser.add_argument("--duration", type=float, default=None,
+                        help=f"Only decode and analyse this many seconds [whole file; {ANALYSIS_SECONDS} with --start auto]")
+    parser.add_argument("--rate", type=int, default=None,
+                        help="Internal sample rate (Hz) the audio is resampled to before analysis, e.g. 11025 [full rate]")
+    parser.add_argument("--backend", choices=list(DECODERS), default=None,
+                        help="Decoder used to read the audio files [first installed one per file type]")
+    parser.add_argument("--channels", choices=CHANNEL_MODES, default="mid",
+                        help="How multichannel audio is analysed: mid, left, right, or per-channel envelopes summed [mid]")
+    parser.add_argument("--precision", choices=PRECISIONS, default="float64",
+                        help="Floating point type of the analysis; float32 halves its memory use [float64]")
+    parser.add_argument("--adaptive", nargs="?", type=float, const=CONFIDENCE_THRESHOLD, default=None,
+                        metavar="THRESHOLD",
+                        help="Stop decoding each file once its windows agree on a tempo with this confidence (0-1) "
+                             f"[{CONFIDENCE_THRESHOLD}]")
+    parser.add_argument("--envelope-cache", nargs="?", const=DEFAULT_ENVELOPE_DIR, default=None, metavar="DIR",
+                        help="Estimate the tempo from onset envelopes kept in this store, so later runs with another "
+                             f"--window, --hop, --bpm-range or --octave-range skip decoding [{DEFAULT_ENVELOPE_DIR}]")
+    parser.add_argument("--bpm-range", nargs=2, type=float, default=BPM_RANGE, metavar=("LOW", "HIGH"),
+                        help=f"Tempo range searched, with --envelope-cache [{BPM_RANGE[0]} {BPM_RANGE[1]}]")
+    parser.add_argument("--octave-range", nargs=2, type=float, default=ENVELOPE_OCTAVE_RANGE, metavar=("LOW", "HIGH"),
+                        help="Double tempos below LOW and halve those above HIGH, with --envelope-cache "
+                             f"[{ENVELOPE_OCTAVE_RANGE[0]} {ENVELOPE_OCTAVE_RANGE[1]}]")
+    parser.add_argument("--no-octave", action="store_true",
+                        help="Report tempos without octave correction, with --envelope-cache")
+    parser.add_argument("--retries", type=int, default=1, help="How often a file that fails is retried before it is skipped [1]")
+    parser.add_argument("--output", default="-", help="Result file; '-' writes to stdout [-]")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default=None,
+                        help="Result format [jsonl for *.jsonl outputs, csv otherwise]")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH,
+                        help=f"SQLite file caching results of unchanged files [{DEFAULT_CACHE_PATH}]")
+    parser.add_argument("--no-cache", action="store_true", help="Analyse every file even if a cached result exists")
+    parser.add_argument("--profile", nargs="?", const="table", choices=["table", "json"], default=None,
+                        help="Print the time spent in every stage, summed over all analysed files, to stderr")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="With --profile, also record the peak memory allocated in every stage")
+    args = parser.parse_args(argv)
+    if args.envelope_cache is None and (tuple(args.bpm_range) != BPM_RANGE
+                                        or tuple(args.octave_range) != ENVELOPE_OCTAVE_RANGE or args.no_octave):
+        parser.error("--bpm-range, --octave-range and --no-octave need --envelope-cache")
+    if args.envelope_cache is not None and args.adaptive is not None:
+        parser.error("--adaptive cannot be combined with --envelope-cache")
+
+    fmt = args.format or ("jsonl" if args.output.lower().endswith(".jsonl") else "csv")
+    paths = find_audio_files(args.target)
+    if not paths:
+        print(f"No audio files found for {args.target}", file=sys.stderr)
+        return 1
+
+    def show_progress(stats):
+        if sys.stderr.isatty():
+            print("\r" + stats.summary(), end="", file=sys.stderr, flush=True)
+
+    if args.output == "-":
+        stream = contextlib.nullcontext(sys.stdout)
+    else:
+        stream = open(args.output, "w", newline="", encoding="utf-8")
+
+    cache_context = contextlib.nullcontext() if args.no_cache else ResultCache(args.cache)
+    profile = Profile(trace_allocations=args.profile_memory) if args.profile or args.profile_memory else None
+
+    with stream as out, cache_context as cache:
+        stats = run_batch(paths, ResultWriter(out, fmt), workers=args.workers, window=args.window,
+                          hop=args.hop, retries=args.retries, progress=show_progress, cache=cache,
+                          backend=args.backend, start=args.start, duration=args.duration, rate=args.rate,
+                          profile=profile, channels=args.channels, adaptive=args.adaptive,
+                          precision=args.precision, envelope_cache=args.envelope_cache,
+                          bpm_range=tuple(args.bpm_range),
+                          octave_range=None if args.no_octave else tuple(args.octave_range))
+    if args.envelope_cache is not None:
+        EnvelopeStore(args.envelope_cache).evict()
+
+    if sys.stderr.isatty():
+        print(file=sys.stderr)
+    print(stats.summary(), file=sys.stderr)
+    if profile:
+        print_profile(profile, args.profile)
+    return 0 if stats.failed == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
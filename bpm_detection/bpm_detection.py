@@ -18,237 +18,1946 @@
 # Boston, MA 02110-1301, USA.
 
 import argparse
-import array
+import collections
+import csv
+import importlib
+import importlib.util
+import json
 import math
-import wave
 import os
+import struct
+import subprocess
+import sys
 import warnings
 
-import matplotlib.pyplot as plt
 import numpy
-import pywt
-from scipy import signal
+
+try:
+    from .profiling import Profile, print_profile, profiled_blocks, stage
+except ImportError:
+    from profiling import Profile, print_profile, profiled_blocks, stage
 
 # Suppress all warnings for clean output
 warnings.filterwarnings("ignore")
 
-try:
-    from pydub import AudioSegment
-    PYDUB_AVAILABLE = True
-except ImportError:
-    PYDUB_AVAILABLE = False
+# scipy, pywt and pydub are slow to import and only needed once audio is
+# actually analysed or decoded, so they are imported inside the functions
+# that use them; matplotlib is only loaded for --verbose plots
+PYDUB_AVAILABLE = importlib.util.find_spec("pydub") is not None
+
+# Number of frames decoded per block when streaming audio
+BLOCK_FRAMES = 65536
+
+# Wavelet front end and tempo search range used by bpm_detector
+WAVELET = "db4"
+LEVELS = 4
+BPM_RANGE = (40, 200)
+
+# Octave correction: BPMs below the first bound are doubled, above the
+# second halved
+OCTAVE_RANGE = (70, 180)
+
+# Octave correction of the envelope-based estimates (envelope_bpm, tempo
+# curves, --envelope-cache), whose BPMs are real tempos. bpm_detector's
+# OCTAVE_RANGE applies to its doubled lag scale (see _lag_range); folding
+# into one octave gives the same tempos on real scale
+ENVELOPE_OCTAVE_RANGE = (90, 180)
+
+# How multichannel audio is analysed: the average of all channels, only the
+# first or second channel, or every channel on its own with the onset
+# envelopes summed before the autocorrelation
+CHANNEL_MODES = ("mid", "left", "right", "per-channel")
+
+# Seconds of audio bpm_detector analyses, and where the "auto" section starts
+ANALYSIS_SECONDS = 45
+AUTO_INTRO_FRACTION = 0.2
+
+# Adaptive analysis stops once at least MIN_CONFIDENT_WINDOWS windows reach
+# this tempo_confidence; windows within AGREEMENT_TOLERANCE (relative) of the
+# median BPM count as agreeing
+CONFIDENCE_THRESHOLD = 0.7
+MIN_CONFIDENT_WINDOWS = 3
+AGREEMENT_TOLERANCE = 0.02
+
+# Bump whenever a change alters the BPMs produced, so cached results are
+# invalidated
+ALGORITHM_VERSION = 3
+
+# Floating point types the analysis can run in. float32 halves the memory
+# traffic of the DWT, envelope and autocorrelation; float64 is the reference
+PRECISIONS = ("float64", "float32")
+
+# Envelope low-pass y[n] = (1 - alpha) x[n] + alpha y[n-1] applied to every
+# rectified wavelet band, as in Tzanetakis' wavelet beat histogram; 0 gives
+# the unsmoothed envelope of ALGORITHM_VERSION 1
+SMOOTHING_ALPHA = 0.99
+
+# ALGORITHM_VERSION 1 "smoothed" with lfilter([0.01], [1 - 0.99]), which has
+# no memory and is just this scaling
+_IDENTITY_GAIN = 0.01 / (1 - 0.99)
+
+# Half length of the resampling filter in multiples of the larger of the
+# up/down factors (resample_poly's default is 10)
+RESAMPLE_HALF_LEN = 3
+
+
+# NumPy dtypes for the little-endian integer PCM sample widths found in WAV files
+# (24-bit has no native dtype and is widened in pcm_to_array)
+_PCM_DTYPES = {1: numpy.uint8, 2: numpy.dtype("<i2"), 4: numpy.dtype("<i4")}
+_FLOAT_DTYPES = {4: numpy.dtype("<f4"), 8: numpy.dtype("<f8")}
+
+# WAVE format tags
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def _analysis_dtype(dtype):
+    """numpy dtype for a precision name or type, which must be one of PRECISIONS"""
+    dtype = numpy.dtype(dtype)
+    if dtype.name not in PRECISIONS:
+        raise ValueError(f"unsupported precision {dtype.name}, expected one of {', '.join(PRECISIONS)}")
+    return dtype
+
+
+def pcm_to_array(raw, sampwidth, is_float=False):
+    """
+    Interpret raw little-endian PCM bytes as a NumPy array, zero-copy where possible
+
+    Args:
+        raw: Interleaved samples; the length must be a multiple of sampwidth
+        sampwidth: Bytes per sample (1, 2, 3 or 4; 4 or 8 for floats)
+        is_float: IEEE float samples instead of integers
+
+    Returns:
+        Integer samples at their original scale (8-bit is made signed, 24-bit
+        is widened to int32), or float samples, in interleaved order
+    """
+    if is_float:
+        if sampwidth not in _FLOAT_DTYPES:
+            raise ValueError(f"Unsupported float sample width: {sampwidth} bytes")
+        return numpy.frombuffer(raw, dtype=_FLOAT_DTYPES[sampwidth])
+
+    if sampwidth == 3:
+        # Place each 3-byte sample in the top bytes of an int32 and shift back
+        # down so the sign is extended
+        triplets = numpy.frombuffer(raw, dtype=numpy.uint8).reshape(-1, 3)
+        widened = numpy.zeros((len(triplets), 4), dtype=numpy.uint8)
+        widened[:, 1:] = triplets
+        samps = widened.view("<i4").ravel()
+        samps >>= 8
+        return samps
+
+    if sampwidth not in _PCM_DTYPES:
+        raise ValueError(f"Unsupported sample width: {sampwidth} bytes")
+
+    samps = numpy.frombuffer(raw, dtype=_PCM_DTYPES[sampwidth])
+    if sampwidth == 1:
+        # 8-bit WAV data is unsigned with a 128 offset
+        samps = samps.astype(numpy.int16) - 128
+    return samps
+
+
+def _mix_frames(frames, channels="mid"):
+    """
+    Analysed samples of a (frames, channels) array for a CHANNEL_MODES mode
+
+    "mid", "left" and "right" give one float32 sample per frame, built from
+    strided views of the channel columns with a single output buffer (mid
+    accumulates the channels into it in place). "per-channel" returns the
+    frames unchanged; a single channel is always returned as a 1-D view.
+    """
+    if channels not in CHANNEL_MODES:
+        raise ValueError(f"Unknown channel mode: {channels}. Available: {', '.join(CHANNEL_MODES)}")
+
+    nchannels = frames.shape[1]
+    if nchannels == 1:
+        return frames[:, 0]
+    if channels == "per-channel":
+        return frames
+
+    mono = numpy.empty(len(frames), dtype=numpy.float32)
+    if channels != "mid":
+        # Mono sources have only a "left" channel
+        column = min(0 if channels == "left" else 1, nchannels - 1)
+        numpy.copyto(mono, frames[:, column], casting="unsafe")
+        return mono
+
+    numpy.copyto(mono, frames[:, 0], casting="unsafe")
+    for channel in range(1, nchannels):
+        numpy.add(mono, frames[:, channel], out=mono, casting="unsafe")
+    mono /= nchannels
+    return mono
+
+
+def downmix(samps, nchannels, channels="mid"):
+    """
+    Analysed samples of interleaved samples, such as those from pcm_to_array
+
+    Args:
+        samps: Interleaved samples of nchannels channels
+        nchannels: Number of channels
+        channels: CHANNEL_MODES mode; see _mix_frames
+
+    Returns:
+        Mono float32 samples, or (frames, channels) frames for "per-channel";
+        mono input is returned unchanged
+    """
+    if nchannels == 1:
+        return samps
+    return _mix_frames(samps.reshape(-1, nchannels), channels)
+
+
+# Stream layout described by a WAV header
+WavFormat = collections.namedtuple(
+    "WavFormat", ["nchannels", "fs", "sampwidth", "block_align", "is_float", "data_offset", "data_size"]
+)
+
+
+def _read_wav_header(f):
+    """
+    Parse a RIFF/RF64 WAVE header up to the start of the data chunk
+
+    Only reads forward, so it works on pipes as well as files. Afterwards f is
+    positioned at the first sample.
+
+    Returns:
+        WavFormat; data_size is the size claimed by the header
+    """
+    header = f.read(12)
+    if len(header) < 12:
+        raise ValueError("not a RIFF/RF64 WAVE file")
+    riff_id, _, wave_id = struct.unpack("<4sI4s", header)
+    if riff_id not in (b"RIFF", b"RF64") or wave_id != b"WAVE":
+        raise ValueError("not a RIFF/RF64 WAVE file")
+    offset = 12
+
+    fmt = None
+    ds64_data_size = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise ValueError("no data chunk")
+        chunk_id, chunk_size = struct.unpack("<4sI", header)
+        offset += 8
+
+        if chunk_id == b"data":
+            if chunk_size == 0xFFFFFFFF and ds64_data_size is not None:
+                chunk_size = ds64_data_size
+            break
+
+        body = f.read(chunk_size + (chunk_size & 1))
+        offset += len(body)
+        if chunk_id == b"fmt ":
+            fmt = body[:chunk_size]
+        elif chunk_id == b"ds64":
+            # RF64 stores the real 64-bit data size here
+            ds64_data_size = struct.unpack("<Q", body[8:16])[0]
+
+    if fmt is None:
+        raise ValueError("no fmt chunk")
+
+    format_tag, nchannels, fs, _, block_align, _ = struct.unpack("<HHIIHH", fmt[:16])
+    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        # The sub-format GUID starts with the actual format tag
+        format_tag = struct.unpack("<H", fmt[24:26])[0]
+    if format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+        raise ValueError(f"unsupported WAVE format: 0x{format_tag:04x}")
+
+    return WavFormat(
+        nchannels=nchannels,
+        fs=fs,
+        sampwidth=block_align // nchannels,
+        block_align=block_align,
+        is_float=format_tag == WAVE_FORMAT_IEEE_FLOAT,
+        data_offset=offset,
+        data_size=chunk_size,
+    )
+
+
+class WavFile:
+    """
+    Memory-mapped WAV file (RIFF or RF64) that decodes samples lazily
+
+    Only the header is parsed up front. Slicing a WavFile with frame indices
+    returns a mono NumPy array for just those frames, so memory use is bounded
+    by the slice size rather than the file size.
+
+    Args:
+        filename: Path to the WAV file
+        channels: CHANNEL_MODES mode applied to the frames of every slice
+    """
+
+    def __init__(self, filename, channels="mid"):
+        self.filename = filename
+        self.channels = channels
+
+        with open(filename, "rb") as f:
+            wav_format = _read_wav_header(f)
+
+        self.fs = wav_format.fs
+        self.nchannels = wav_format.nchannels
+        self.sampwidth = wav_format.sampwidth
+        self.block_align = wav_format.block_align
+        self.is_float = wav_format.is_float
+
+        # Streamed or truncated files may claim more data than is present
+        data_offset = wav_format.data_offset
+        data_size = min(wav_format.data_size, os.path.getsize(filename) - data_offset)
+        self.nframes = data_size // self.block_align
+        self._raw = numpy.memmap(filename, dtype=numpy.uint8, mode="r",
+                                 offset=data_offset, shape=(self.nframes * self.block_align,))
+
+    def __len__(self):
+        return self.nframes
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError("WavFile only supports slicing by frame range")
+        start, stop, step = key.indices(self.nframes)
+        if step != 1:
+            raise ValueError("WavFile slices must be contiguous")
+        stop = max(start, stop)
+
+        if self.nchannels == 1 or self.channels == "per-channel" or stop - start <= BLOCK_FRAMES:
+            return self._decode(start, stop)
+
+        # Long mixed-down slices are decoded block by block into the output,
+        # so no full-length integer or interleaved temporaries are created
+        mono = numpy.empty(stop - start, dtype=numpy.float32)
+        for pos in range(start, stop, BLOCK_FRAMES):
+            end = min(pos + BLOCK_FRAMES, stop)
+            mono[pos - start : end - start] = self._decode(pos, end)
+        return mono
+
+    def _decode(self, start, stop):
+        raw = self._raw[start * self.block_align : stop * self.block_align]
+        samps = pcm_to_array(raw, self.sampwidth, self.is_float)
+        return downmix(samps, self.nchannels, self.channels)
+
+
+def read_wav(filename, lazy=False, channels="mid"):
+    """
+    Read a WAV file as mono samples
+
+    Args:
+        filename: Path to the WAV file
+        lazy: Return the memory-mapped WavFile itself instead of decoding
+            every frame, so callers can slice out windows on demand
+        channels: How multichannel audio is analysed (see CHANNEL_MODES)
+
+    Returns:
+        (samples, sample rate)
+    """
+    try:
+        wav = WavFile(filename, channels)
+    except (IOError, ValueError, struct.error) as e:
+        print(f"{filename}: {e}")
+        return None, None
+
+    assert wav.nframes > 0
+    assert wav.fs > 0
+
+    if lazy:
+        return wav, wav.fs
+    return wav[:], wav.fs
+
+
+def _frame_range(fs, nframes, start=0, duration=None):
+    """First and end frame of the section starting at start seconds"""
+    first = min(int(round((start or 0) * fs)), nframes)
+    last = nframes if duration is None else min(first + int(round(duration * fs)), nframes)
+    return first, last
+
+
+def _limit_blocks(blocks, nsamples):
+    """Pass blocks through until nsamples have been yielded, then stop the source"""
+    try:
+        for block in blocks:
+            if nsamples is not None:
+                block = block[:nsamples]
+                nsamples -= len(block)
+            if len(block):
+                yield block
+            if nsamples == 0:
+                break
+    finally:
+        # Lets decoders release their file or subprocess right away
+        if hasattr(blocks, "close"):
+            blocks.close()
+
+
+def _collect_blocks(blocks, nframes):
+    """
+    Decoded blocks joined into one buffer allocated up front for nframes
+
+    Unlike concatenating a list of blocks this never holds the blocks and
+    the joined copy at the same time. The buffer grows if the source yields
+    more than nframes (for instance when a header underestimates the length).
+    """
+    samps = None
+    pos = 0
+    for block in blocks:
+        if samps is None:
+            samps = numpy.empty((max(nframes, len(block)),) + block.shape[1:], dtype=block.dtype)
+        elif pos + len(block) > len(samps):
+            grown = numpy.empty((max(2 * len(samps), pos + len(block)),) + samps.shape[1:], dtype=samps.dtype)
+            grown[:pos] = samps[:pos]
+            samps = grown
+        samps[pos : pos + len(block)] = block
+        pos += len(block)
+
+    if samps is None:
+        return numpy.empty(0, dtype=numpy.float32)
+    return samps[:pos]
+
+
+def _wav_read(filename, start=0, duration=None, channels="mid"):
+    wav = WavFile(filename, channels)
+    first, last = _frame_range(wav.fs, wav.nframes, start, duration)
+    if (first, last) == (0, wav.nframes):
+        return wav, wav.fs
+    # Only the frames of the section are touched
+    return wav[first:last], wav.fs
+
+
+def _wav_stream(filename, block_frames, start=0, duration=None, channels="mid"):
+    wav = WavFile(filename, channels)
+    first, last = _frame_range(wav.fs, wav.nframes, start, duration)
+    blocks = (wav[pos : min(pos + block_frames, last)] for pos in range(first, last, block_frames))
+    return blocks, wav.fs
+
+
+def _wav_length(filename):
+    wav = WavFile(filename)
+    return wav.nframes / wav.fs
+
+
+def _miniaudio_read(filename, start=0, duration=None, channels="mid"):
+    import miniaudio
+
+    # Streamed into one buffer: decode_file would first hold every channel
+    info = miniaudio.get_file_info(filename)
+    first, last = _frame_range(info.sample_rate, info.num_frames, start, duration)
+    blocks, fs = _miniaudio_stream(filename, BLOCK_FRAMES, start, duration, channels)
+    return _collect_blocks(blocks, last - first), fs
+
+
+def _miniaudio_stream(filename, block_frames, start=0, duration=None, channels="mid"):
+    import miniaudio
+
+    info = miniaudio.get_file_info(filename)
+    first, last = _frame_range(info.sample_rate, info.num_frames, start, duration)
+    chunks = miniaudio.stream_file(filename, output_format=miniaudio.SampleFormat.FLOAT32,
+                                   nchannels=info.nchannels, sample_rate=info.sample_rate,
+                                   frames_to_read=block_frames, seek_frame=first)
+    blocks = (downmix(numpy.frombuffer(chunk, dtype=numpy.float32), info.nchannels, channels) for chunk in chunks)
+    # Decoding stops as soon as the section is complete
+    return _limit_blocks(blocks, last - first), info.sample_rate
+
+
+def _miniaudio_length(filename):
+    import miniaudio
+
+    return miniaudio.get_file_info(filename).duration
+
+
+def _soundfile_available():
+    if importlib.util.find_spec("soundfile") is None:
+        return False
+    import soundfile
+
+    # libsndfile only decodes MP3 from version 1.1 on
+    return "MP3" in soundfile.available_formats()
+
+
+def _soundfile_read(filename, start=0, duration=None, channels="mid"):
+    import soundfile
+
+    # Read block by block into one buffer instead of all channels at once
+    info = soundfile.info(filename)
+    first, last = _frame_range(info.samplerate, info.frames, start, duration)
+    blocks, fs = _soundfile_stream(filename, BLOCK_FRAMES, start, duration, channels)
+    return _collect_blocks(blocks, last - first), fs
+
+
+def _soundfile_stream(filename, block_frames, start=0, duration=None, channels="mid"):
+    import soundfile
+
+    info = soundfile.info(filename)
+    first, last = _frame_range(info.samplerate, info.frames, start, duration)
+    blocks = (_mix_frames(block, channels)
+              for block in soundfile.blocks(filename, blocksize=block_frames, start=first, stop=last,
+                                            dtype="float32", always_2d=True))
+    return blocks, info.samplerate
+
+
+def _soundfile_length(filename):
+    import soundfile
+
+    return soundfile.info(filename).duration
+
+
+def _pydub_read(filename, start=0, duration=None, channels="mid"):
+    from pydub import AudioSegment
+
+    # ffmpeg seeks to the section and stops after it
+    audio = AudioSegment.from_file(filename, start_second=start or None, duration=duration)
+
+    # View the decoded PCM buffer as a typed array; pydub stores signed samples
+    dtype = {1: numpy.int8, 2: numpy.dtype("<i2"), 4: numpy.dtype("<i4")}[audio.sample_width]
+    samps = numpy.frombuffer(audio.raw_data, dtype=dtype)
+
+    # If stereo, convert to mono by taking the mean of the channels
+    return downmix(samps, audio.channels, channels), audio.frame_rate
+
+
+def _iter_pipe_blocks(proc, wav_format, block_frames, channels="mid"):
+    """Yield mono blocks from the WAV stream an ffmpeg process writes to stdout"""
+    try:
+        while True:
+            raw = proc.stdout.read(block_frames * wav_format.block_align)
+            raw = raw[: len(raw) - len(raw) % wav_format.block_align]
+            if not raw:
+                break
+            samps = pcm_to_array(raw, wav_format.sampwidth, wav_format.is_float)
+            yield downmix(samps, wav_format.nchannels, channels)
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def _pydub_stream(filename, block_frames, start=0, duration=None, channels="mid"):
+    """Decode incrementally through an ffmpeg pipe, using pydub's ffmpeg"""
+    from pydub import AudioSegment
+
+    section = []
+    if start:
+        section += ["-ss", str(start)]
+    if duration is not None:
+        section += ["-t", str(duration)]
+
+    # ffmpeg writes a WAV header first, which tells us how to read the rest
+    proc = subprocess.Popen(
+        [AudioSegment.converter, "-nostdin", "-v", "quiet"] + section + ["-i", filename,
+         "-f", "wav", "-acodec", "pcm_s16le", "-"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wav_format = _read_wav_header(proc.stdout)
+    except Exception:
+        proc.kill()
+        proc.wait()
+        raise
+    return _iter_pipe_blocks(proc, wav_format, block_frames, channels), wav_format.fs
+
+
+def _pydub_length(filename):
+    from pydub.utils import mediainfo
+
+    return float(mediainfo(filename)["duration"])
+
+
+# A decoder backend. All functions raise on failure and return mono samples:
+#   read(filename, start, duration, channels) -> (samples, fs) decodes the whole section
+#   stream(filename, block_frames, start, duration, channels) -> (blocks, fs) decodes it incrementally
+#   length(filename) -> duration of the file in seconds
+# start and duration are in seconds; duration None means up to the end.
+# channels is a CHANNEL_MODES mode, passed only when it is not "mid"; with
+# "per-channel" the samples are (frames, channels) arrays instead (see
+# _mix_frames and downmix).
+Decoder = collections.namedtuple("Decoder", ["name", "extensions", "available", "read", "stream", "length"])
+
+# Registered backends in order of preference
+DECODERS = {}
+
+
+def register_decoder(name, extensions, read, stream, length=None, available=lambda: True):
+    """Add a decoder backend; earlier registrations are preferred"""
+    DECODERS[name] = Decoder(name, tuple(extensions), available, read, stream, length)
+
+
+# WAV is handled in-process by the memory-mapped reader; MP3 prefers the
+# in-process decoders and falls back to pydub, which needs an ffmpeg binary
+register_decoder("wav", [".wav"], _wav_read, _wav_stream, _wav_length)
+register_decoder("miniaudio", [".mp3"], _miniaudio_read, _miniaudio_stream, _miniaudio_length,
+                 available=lambda: importlib.util.find_spec("miniaudio") is not None)
+register_decoder("soundfile", [".mp3"], _soundfile_read, _soundfile_stream, _soundfile_length,
+                 available=_soundfile_available)
+register_decoder("pydub", [".mp3"], _pydub_read, _pydub_stream, _pydub_length,
+                 available=lambda: PYDUB_AVAILABLE)
+
+
+def warm_up():
+    """
+    Import the analysis libraries and the installed decoders now
+
+    For long-running processes (servers, GUI workers) whose first file
+    should not wait for these imports, which take about a second.
+    """
+    import pywt  # noqa: F401
+    import scipy.fft  # noqa: F401
+    import scipy.signal  # noqa: F401
+
+    with warnings.catch_warnings():
+        # pydub warns at import time when ffmpeg is missing
+        warnings.simplefilter("ignore")
+        for module in ("miniaudio", "soundfile", "pydub"):
+            if importlib.util.find_spec(module) is not None:
+                importlib.import_module(module)
+
+
+def _decoders_for(filename, backend=None):
+    """Decoders to try for a file, most preferred first"""
+    ext = os.path.splitext(filename)[1].lower()
+
+    if backend is not None:
+        if backend not in DECODERS:
+            raise ValueError(f"Unknown decoder backend: {backend}. Available: {', '.join(DECODERS)}")
+        decoder = DECODERS[backend]
+        if not decoder.available():
+            raise ValueError(f"Decoder backend {backend} is not installed")
+        return [decoder]
+
+    candidates = [decoder for decoder in DECODERS.values() if ext in decoder.extensions]
+    if not candidates:
+        raise ValueError(f"Unsupported file format: {ext}. Supported formats: .wav, .mp3")
+
+    decoders = [decoder for decoder in candidates if decoder.available()]
+    if not decoders:
+        raise ValueError(f"No decoder available for {ext} files. Install one of: "
+                         + ", ".join(decoder.name for decoder in candidates))
+    return decoders
+
+
+def auto_start(length, duration=ANALYSIS_SECONDS):
+    """
+    Start of the analysed section when skipping the intro automatically
+
+    Starts AUTO_INTRO_FRACTION into the track (intros and breakdowns rarely
+    carry a steady beat), but early enough that duration seconds remain.
+    """
+    return max(0.0, min(length * AUTO_INTRO_FRACTION, length - duration))
+
+
+def resolve_section(filename, start, duration=None, backend=None):
+    """
+    Numeric (start, duration) of the analysed section
+
+    start "auto" is worked out from the file length with auto_start and then
+    implies a duration of ANALYSIS_SECONDS unless one is given.
+    """
+    if start != "auto":
+        return start or 0, duration
+
+    if duration is None:
+        duration = ANALYSIS_SECONDS
+    length = audio_length(filename, backend)
+    return (0 if length is None else auto_start(length, duration)), duration
+
+
+def audio_length(filename, backend=None):
+    """Length of an audio file in seconds from its header, or None if no decoder can tell"""
+    try:
+        decoders = _decoders_for(filename, backend)
+    except ValueError:
+        return None
+    for decoder in decoders:
+        if decoder.length is None:
+            continue
+        try:
+            return decoder.length(filename)
+        except Exception:
+            continue
+    return None
+
+
+def _decode(filename, backend, method, *args, start=None, duration=None, channels="mid"):
+    """
+    Call read or stream on the first decoder that succeeds
+
+    start may be "auto" to skip the intro (see auto_start). Prints the errors
+    and returns (None, None) when no decoder succeeds.
+    """
+    if channels not in CHANNEL_MODES:
+        raise ValueError(f"Unknown channel mode: {channels}. Available: {', '.join(CHANNEL_MODES)}")
+
+    try:
+        decoders = _decoders_for(filename, backend)
+    except ValueError as e:
+        print(e)
+        return None, None
+
+    if start == "auto" and duration is None:
+        duration = ANALYSIS_SECONDS
+
+    # Decoders registered before channel modes existed only know "mid"
+    mode = {} if channels == "mid" else {"channels": channels}
+
+    errors = []
+    for decoder in decoders:
+        try:
+            section_start = start
+            if start == "auto":
+                section_start = auto_start(decoder.length(filename), duration) if decoder.length else 0
+            return getattr(decoder, method)(filename, *args, start=section_start or 0, duration=duration,
+                                            **mode)
+        except Exception as e:
+            errors.append(f"{decoder.name}: {e}")
+
+    print(f"Error reading audio file {filename}: " + "; ".join(errors))
+    return None, None
+
+
+def read_mp3(filename, backend=None):
+    """Read MP3 file and convert to audio data"""
+    return _decode(filename, backend, "read")
+
+
+def read_audio(filename, lazy=False, backend=None, start=None, duration=None, profile=None, channels="mid"):
+    """Read audio file (WAV or MP3) based on file extension
+
+    The file is decoded by the first available backend in DECODERS that
+    handles its extension, or by the named backend. Only the section from
+    start (seconds, or "auto" to skip the intro) lasting duration seconds is
+    decoded; by default the whole file, or ANALYSIS_SECONDS with "auto".
+
+    Multichannel audio is mixed down according to channels (see
+    CHANNEL_MODES) while decoding, so at most one float32 mono buffer is
+    held for the track; "per-channel" returns (frames, channels) arrays in
+    the decoded sample type.
+
+    With lazy=True WAV files are returned as a memory-mapped WavFile that
+    decodes frames only when sliced; other formats are always fully decoded.
+    The decoding time is recorded as the "decode" stage of profile.
+    """
+    with stage(profile, "decode") as record:
+        samps, fs = _decode(filename, backend, "read", start=start, duration=duration, channels=channels)
+        if not lazy and isinstance(samps, WavFile):
+            samps = samps[:]
+        # A lazy WavFile is only decoded when sliced, which counts there
+        record.samples = len(samps) if samps is not None and not isinstance(samps, WavFile) else 0
+    return samps, fs
+
+
+def _iter_slices(samps, block_frames):
+    """Yield consecutive blocks of an array or WavFile"""
+    for start in range(0, len(samps), block_frames):
+        yield samps[start : start + block_frames]
+
+
+def stream_audio(filename, block_frames=BLOCK_FRAMES, backend=None, start=None, duration=None, profile=None,
+                 channels="mid"):
+    """
+    Decode an audio file (WAV or MP3) block by block
+
+    Args:
+        filename: Path to the audio file
+        block_frames: Number of frames per yielded block
+        backend: Name of the decoder backend; the first available one for
+            the file's extension by default
+        start: Start of the decoded section in seconds, or "auto" to skip
+            the intro
+        duration: Length of the decoded section in seconds [to the end]
+        profile: Optional Profile; the time spent producing the blocks is
+            recorded as its "decode" stage
+        channels: How multichannel audio is analysed (see CHANNEL_MODES)
+
+    Returns:
+        (generator of mono sample blocks, or of (frames, channels) blocks
+        with "per-channel", sample rate)
+    """
+    with stage(profile, "decode"):
+        blocks, fs = _decode(filename, backend, "stream", block_frames, start=start, duration=duration,
+                             channels=channels)
+    if blocks is None:
+        return None, None
+    return profiled_blocks(blocks, profile), fs
+
+
+def resample_blocks(blocks, fs, target_fs):
+    """
+    Polyphase resampling of a stream of blocks to target_fs
+
+    Each block is resampled with scipy.signal.resample_poly together with
+    enough neighbouring input to cover the anti-aliasing filter, so the
+    output equals resample_poly with the same filter applied to the whole
+    signal at once while only a block plus the filter length is held in
+    memory. The filter is shorter than resample_poly's default: the tempo
+    lives in the onset envelope, which does not need a steep cutoff.
+
+    Blocks may be mono or (frames, channels) arrays.
+
+    Yields:
+        float32 blocks at target_fs
+    """
+    from scipy import signal
+
+    g = math.gcd(int(fs), int(target_fs))
+    up, down = int(target_fs) // g, int(fs) // g
+
+    half_len = RESAMPLE_HALF_LEN * max(up, down)
+    fir = signal.firwin(2 * half_len + 1, 1.0 / max(up, down), window=("kaiser", 5.0)).astype(numpy.float32)
+
+    def run(x):
+        # resample_poly scales the filter in place
+        return signal.resample_poly(x, up, down, window=fir.copy(), axis=0)
+
+    # The filter spans half_len upsampled samples each side; as input
+    # context rounded up to a multiple of down
+    context = -(-(half_len // up + 1) // down) * down
+    first = context * up // down
+
+    buf = None
+    consumed = 0  # Input samples already resampled
+    produced = 0  # Output samples already yielded
+
+    for block in blocks:
+        block = numpy.asarray(block, dtype=numpy.float32)
+        if buf is None:
+            # Zeros before the signal reproduce resample_poly's edge handling
+            buf = numpy.zeros((context,) + block.shape[1:], dtype=numpy.float32)
+        buf = numpy.concatenate((buf, block))
+
+        # Inputs that already have their full right-hand context
+        ready = (len(buf) - 2 * context) // down * down
+        if ready <= 0:
+            continue
+
+        yield run(buf[: ready + 2 * context])[first : first + ready * up // down]
+
+        consumed += ready
+        produced += ready * up // down
+        buf = buf[ready:]
+
+    if buf is None:
+        return
+
+    # Flush the rest with zeros after the end of the signal
+    remaining = len(buf) - context
+    total = -(-(consumed + remaining) * up // down)
+    if total > produced:
+        out = run(numpy.concatenate((buf, numpy.zeros((context + down,) + buf.shape[1:], dtype=numpy.float32))))
+        yield out[first : first + total - produced]
+
+
+def resample(samps, fs, target_fs):
+    """Resample a whole track (array or WavFile) to target_fs block by block"""
+    blocks = resample_blocks(_iter_slices(samps, BLOCK_FRAMES), fs, target_fs)
+    return _collect_blocks(blocks, -(-len(samps) * int(target_fs) // int(fs)))
+
+
+# print an error when no data can be found
+def no_audio_data():
+    print("No audio data for sample, skipping...")
+    return None, None
+
+
+def _magnitude(data):
+    """Absolute values of samples; integers are widened first, since abs(-32768) wraps around in int16"""
+    data = numpy.asarray(data)
+    if data.dtype.kind in "iu":
+        return numpy.abs(data, dtype=numpy.float32 if data.itemsize <= 2 else numpy.float64)
+    return numpy.abs(data)
+
+
+# simple peak detection
+def peak_detect(data):
+    max_val = numpy.amax(_magnitude(data))
+    peak_ndx = numpy.where(data == max_val)
+    if len(peak_ndx[0]) == 0:  # if nothing found then the max must be negative
+        peak_ndx = numpy.where(data == -max_val)
+    return peak_ndx
+
+
+def _silence_bounds(data, fs, threshold_percent=0.01, min_silence_duration=0.1):
+    """
+    Start and end index of the audible part along the last axis
+
+    A sample is audible when its magnitude exceeds threshold_percent of the
+    peak; min_silence_duration / 2 of lead-in and lead-out is kept on either
+    side. Rows that are entirely silent keep their full length.
+
+    Returns:
+        (starts, ends) as integers for 1-D data, arrays for 2-D data
+    """
+    data = numpy.asarray(data)
+    n = data.shape[-1]
+    magnitude = _magnitude(data)
+    loud = magnitude > magnitude.max(axis=-1, keepdims=True) * threshold_percent
+    margin = int(min_silence_duration * fs) // 2
+
+    any_loud = loud.any(axis=-1)
+    starts = numpy.where(any_loud, numpy.maximum(0, loud.argmax(axis=-1) - margin), 0)
+    last_loud = n - 1 - loud[..., ::-1].argmax(axis=-1)
+    ends = numpy.where(any_loud, numpy.minimum(n, last_loud + 1 + margin), n)
+
+    if data.ndim == 1:
+        return int(starts), int(ends)
+    return starts, ends
+
+
+def trim_initial_silence(data, fs, threshold_percent=0.01, min_silence_duration=0.1, trailing=False,
+                         return_offset=False):
+    """
+    Trim initial silence from audio data
+    
+    Args:
+        data: Audio samples, or (frames, channels) frames, which are
+            trimmed where the loudest channel is silent
+        fs: Sample rate
+        threshold_percent: Percentage of max amplitude to consider as silence
+        min_silence_duration: Minimum duration of silence to trim (seconds)
+        trailing: Also trim silence at the end
+        return_offset: Also return the index of the first kept sample
+    
+    Returns:
+        Trimmed audio data, or (trimmed data, offset) with return_offset
+    """
+    start, end = 0, len(data)
+    if len(data) > 0:
+        level = _magnitude(data).max(axis=1) if numpy.ndim(data) == 2 else data
+        start, end = _silence_bounds(level, fs, threshold_percent, min_silence_duration)
+    trimmed = data[start : end if trailing else len(data)]
+    return (trimmed, start) if return_offset else trimmed
+
+
+# Relative cost weights used to choose between FFT and direct autocorrelation;
+# measured on NumPy/SciPy with pocketfft, only the ratio matters
+_ACF_FFT_COST = 10.0
+_ACF_LAG_OVERHEAD = 8000
+
+
+def autocorrelate(x, max_lag, min_lag=0):
+    """
+    Autocorrelation along the last axis for lags below max_lag
+
+    Gives the same values as the first max_lag entries of the second half of
+    numpy.correlate(x, x, "full"), without computing the lags that are never
+    looked at. Depending on the size this uses a zero-padded rFFT (just long
+    enough to avoid wrap-around for the wanted lags) or direct dot products
+    over min_lag..max_lag only, whichever is cheaper.
+
+    Args:
+        x: 1-D signal or 2-D array of signals (one per row)
+        max_lag: First lag not computed
+        min_lag: First lag needed; with the direct strategy lags below it are
+            left at zero
+
+    Returns:
+        Array whose last axis is indexed by lag
+    """
+    from scipy import fft
+
+    x = numpy.asarray(x)
+    n = x.shape[-1]
+    rows = x.size // n if n else 0
+    max_lag = min(max_lag, n)
+    min_lag = min(max(min_lag, 0), max_lag)
+
+    nfft = fft.next_fast_len(n + max_lag, real=True)
+    direct_cost = (max_lag - min_lag) * (rows * n + _ACF_LAG_OVERHEAD)
+    fft_cost = _ACF_FFT_COST * rows * nfft * math.log2(max(nfft, 2))
+
+    if direct_cost < fft_cost:
+        # float32 signals stay float32, as they do through the rFFT
+        correl = numpy.zeros(x.shape[:-1] + (max_lag,), dtype=numpy.float32 if x.dtype == numpy.float32 else None)
+        for lag in range(min_lag, max_lag):
+            if x.ndim == 1:
+                correl[lag] = numpy.dot(x[: n - lag], x[lag:])
+            else:
+                correl[..., lag] = numpy.einsum("...i,...i->...", x[..., : n - lag], x[..., lag:])
+        return correl
+
+    spectrum = fft.rfft(x, nfft, axis=-1)
+    power = spectrum.real ** 2 + spectrum.imag ** 2
+    return fft.irfft(power, nfft, axis=-1)[..., :max_lag]
+
+
+def fold_octave(bpms, octave_range=OCTAVE_RANGE):
+    """
+    Proper octave detection for accurate BPM: double BPMs below
+    octave_range[0] (likely half tempo) and halve those above
+    octave_range[1] (likely double tempo); None leaves them as they are
+    """
+    if octave_range is None:
+        return bpms
+    low, high = octave_range
+    return numpy.where(bpms < low, bpms * 2, numpy.where(bpms > high, bpms / 2, bpms))
+
+
+def peak_to_median(correl, min_lag, max_lag):
+    """
+    Height of the autocorrelation peak relative to the typical lag
+
+    The maximum of correl over min_lag..max_lag divided by the median
+    magnitude over the same lags, along the last axis: about 1 when no lag
+    stands out, well above 5 for a steady, unambiguous beat.
+    """
+    lags = correl[..., min_lag:max_lag]
+    median = numpy.median(numpy.abs(lags), axis=-1)
+    peak = lags.max(axis=-1)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        return numpy.where(median > 0, peak / median, numpy.inf)
+
+
+def tempo_confidence(bpms, peak_ratios, tolerance=AGREEMENT_TOLERANCE):
+    """
+    Combined BPM of several windows and how far it can be trusted
+
+    The confidence is the fraction of windows whose BPM lies within
+    tolerance of the median BPM, times 1 - 1 / (median peak_to_median of
+    those windows). It is 0 when the windows disagree or have no clear
+    peak, and approaches 1 when they all find the same sharp peak.
+
+    Args:
+        bpms: BPM of every window (NaN for windows without one)
+        peak_ratios: peak_to_median of every window
+        tolerance: Relative BPM difference still counted as agreement
+
+    Returns:
+        (median bpm, confidence between 0 and 1), or (None, 0.0) without
+        any BPM
+    """
+    bpms = numpy.asarray(bpms, dtype=numpy.float64)
+    peak_ratios = numpy.asarray(peak_ratios, dtype=numpy.float64)
+    found = ~numpy.isnan(bpms)
+    if not found.any():
+        return None, 0.0
+
+    bpm = float(numpy.median(bpms[found]))
+    agreeing = found & (numpy.abs(bpms - bpm) <= tolerance * bpm)
+    if not agreeing.any():
+        # The median falls between windows that all disagree
+        return bpm, 0.0
+    ratio = numpy.median(peak_ratios[agreeing])
+    confidence = agreeing.sum() / len(bpms) * max(0.0, 1 - 1 / ratio)
+    return bpm, float(confidence)
+
+
+def _lag_range(fs, levels=LEVELS, bpm_range=BPM_RANGE, envelope_rate=False):
+    """
+    Decimation and autocorrelation lags of the envelope of a levels-deep DWT
+
+    The BPM of a lag is 60 / lag * fs / max_decimation. bpm_detector counts
+    lags at fs / 2**(levels - 1), half the envelope's actual rate of
+    fs / 2**levels, so its BPMs (and bpm_range) are twice the tempo of the
+    lag until the octave rule folds them; that is kept for its results to
+    stay the same. envelope_rate=True counts lags at the envelope rate, so
+    that bpm_range and the BPMs are real tempos.
+
+    Returns:
+        (max_decimation, min_lag, max_lag); max_lag is not yet capped to
+        the envelope length
+    """
+    max_decimation = 2 ** levels if envelope_rate else 2 ** (levels - 1)
+    min_lag = max(1, int(60.0 / bpm_range[1] * (fs / max_decimation)))
+    max_lag = int(60.0 / bpm_range[0] * (fs / max_decimation))
+    return max_decimation, min_lag, max_lag
+
+
+def _add_envelope(cD_sum, band, decimation, alpha, scratch=None, rectified=None):
+    """
+    Envelope stage of one wavelet band, fused into as few passes as possible
+
+    Rectifies the band, smooths it with the one-pole low-pass
+    y[n] = (1 - alpha) x[n] + alpha y[n-1], decimates it to the envelope
+    rate, subtracts its mean and adds it to cD_sum, along the last axis.
+
+    Only the decimated samples of the smoothed band are computed: unrolling
+    the recursion over one decimation step gives
+    y[n] = alpha**decimation y[n - decimation] + sum_k (1 - alpha) alpha**k x[n - k],
+    so each kept sample is a weighted sum of one row of the rectified band
+    reshaped to (-1, decimation), followed by a one-pole filter at the
+    envelope rate. With alpha=0 there is no smoothing and the result is the
+    (identity) lfilter of ALGORITHM_VERSION 1, bit for bit.
+
+    With both buffers given, the only array allocated is the output of that
+    envelope-rate lfilter (the decimated length, not the band length);
+    without them the rectified band and the weighted sums are allocated too.
+
+    Args:
+        cD_sum: Envelope sum, updated in place
+        band: Detail or approximation coefficients (not modified); the
+            envelope is computed in their floating point type
+        decimation: Step that brings the band to the envelope rate
+        alpha: Smoothing coefficient, 0 to turn smoothing off
+        scratch: Optional buffer for the weighted sums or the unsmoothed
+            envelope of a 1-D band, at least as long as the decimated band
+        rectified: Optional buffer for the rectified 1-D band when
+            smoothing, at least decimation - 1 samples longer than the band
+    """
+    if alpha:
+        from scipy import signal
+
+        # Rectify behind decimation - 1 zeros, so that row j of the reshaped
+        # buffer ends with the sample that becomes envelope sample j
+        length = band.shape[-1]
+        rows = -(-length // decimation)
+        if rectified is None:
+            rectified = numpy.empty(band.shape[:-1] + (length + decimation - 1,), dtype=band.dtype)
+        else:
+            rectified = rectified[: length + decimation - 1]
+        rectified[..., : decimation - 1] = 0
+        numpy.abs(band, out=rectified[..., decimation - 1 :])
+        blocks = rectified[..., : rows * decimation].reshape(band.shape[:-1] + (rows, decimation))
+
+        weights = ((1 - alpha) * alpha ** numpy.arange(decimation - 1, -1, -1)).astype(band.dtype)
+        feedback = numpy.array([1.0, -alpha ** decimation], dtype=band.dtype)
+        sums = numpy.matmul(blocks, weights, out=None if scratch is None else scratch[:rows])
+        envelope = signal.lfilter(feedback[:1], feedback, sums, axis=-1)
+    else:
+        band = band[..., ::decimation]
+        envelope = numpy.empty(band.shape, band.dtype) if scratch is None else scratch[: band.shape[-1]]
+        numpy.multiply(band, _IDENTITY_GAIN, out=envelope)
+        numpy.abs(envelope, out=envelope)
+
+    envelope -= numpy.mean(envelope, axis=-1, keepdims=True)
+    actual_len = min(envelope.shape[-1], cD_sum.shape[-1])
+    cD_sum[..., :actual_len] += envelope[..., :actual_len]
+
+
+def bpm_detector(data, fs, verbose=True, profile=None, alpha=SMOOTHING_ALPHA, dtype=numpy.float64):
+    """
+    BPM of mono samples, analysing at most the first ANALYSIS_SECONDS
+
+    Args:
+        data: Mono samples, or (frames, channels) frames whose channel
+            envelopes are summed
+        fs: Sample rate
+        verbose: Print the BPM
+        profile: Optional Profile recording the time of every stage
+        alpha: Envelope smoothing coefficient, 0 for the unsmoothed envelope
+            of ALGORITHM_VERSION 1
+        dtype: Floating point type of the analysis (see PRECISIONS)
+
+    Returns:
+        (bpm, correlation), or (None, None) if there is no usable audio
+    """
+    detector = BPMDetector(fs, len(data) / fs, alpha=alpha, dtype=dtype)
+    bpm = detector.detect(data, profile)
+    if bpm is None:
+        return no_audio_data()
+
+    if verbose:
+        print(f"{bpm:.2f}")
+
+    return bpm, detector.correl
+
+
+class BPMDetector:
+    """
+    bpm_detector for many windows of one sample rate, with the setup done once
+
+    The wavelet, lag range and buffers are prepared in the constructor, and
+    detect() reuses the buffers for every window instead of allocating
+    fresh envelope and sum arrays.
+
+    Args:
+        fs: Sample rate of the windows
+        window: Expected window length in seconds; longer windows still
+            work but grow the buffers
+        levels: Number of DWT levels
+        wavelet: PyWavelets wavelet name
+        bpm_range: (lowest, highest) BPM searched for
+        alpha: Envelope smoothing coefficient, 0 for the unsmoothed envelope
+            of ALGORITHM_VERSION 1
+        dtype: Floating point type the samples are converted to and the
+            DWT, envelope and autocorrelation run in (see PRECISIONS)
+    """
+
+    def __init__(self, fs, window=3, levels=LEVELS, wavelet=WAVELET, bpm_range=BPM_RANGE, alpha=SMOOTHING_ALPHA,
+                 dtype=numpy.float64):
+        import pywt
+        import scipy.fft  # noqa: F401 (used by autocorrelate)
+
+        self._dwt = pywt.dwt
+        self._coeff_len = pywt.dwt_coeff_len
+        self.fs = fs
+        self.levels = levels
+        self.wavelet = pywt.Wavelet(wavelet)
+        self.bpm_range = bpm_range
+        self.alpha = alpha
+        self.dtype = _analysis_dtype(dtype)
+
+        self.max_decimation, self.min_lag, self.max_lag = _lag_range(fs, levels, bpm_range)
+
+        # Correlation and its peak_to_median of the last window that had a BPM
+        self.correl = None
+        self.peak_ratio = None
+        self._allocate(int(min(window, ANALYSIS_SECONDS) * fs))
+
+    def _allocate(self, nsamples):
+        self._capacity = nsamples
+        self._data = numpy.empty(nsamples, self.dtype)
+        sum_len = self._sum_len(nsamples)
+        self._sum = numpy.empty(sum_len, self.dtype)
+        self._band = numpy.empty(sum_len, self.dtype)
+        # Rectified first detail band, the longest band smoothed
+        self._rectified = numpy.empty(self._coeff_len(nsamples, self.wavelet.dec_len, "symmetric")
+                                      + self.max_decimation - 1, self.dtype)
+
+    def _sum_len(self, nsamples):
+        """Length of the envelope sum: the first detail band brought to the envelope rate"""
+        return int(self._coeff_len(nsamples, self.wavelet.dec_len, "symmetric") / self.max_decimation + 1)
 
+    def detect(self, data, profile=None):
+        """
+        BPM of one window of samples, or None if it has no usable audio
 
-def read_wav(filename):
-    # open file, get metadata for audio
-    try:
-        wf = wave.open(filename, "rb")
-    except IOError as e:
-        print(e)
-        return
+        Args:
+            data: Mono samples (any numeric dtype), or (frames, channels)
+                frames whose channels are analysed separately, with their
+                onset envelopes summed before the autocorrelation
+            profile: Optional Profile recording the time of every stage
+        """
+        with stage(profile, "trim", len(data)):
+            # Trim initial silence to avoid BPM calculation issues
+            data = trim_initial_silence(data, self.fs)
 
-    # typ = choose_type( wf.getsampwidth() ) # TODO: implement choose_type
-    nsamps = wf.getnframes()
-    assert nsamps > 0
+            # Use first 45 seconds for more accurate detection
+            data = data[: int(self.fs * ANALYSIS_SECONDS)]
+            if len(data) > self._capacity:
+                self._allocate(len(data))
+            buf = self._data[: len(data)]
+            if numpy.ndim(data) == 1:
+                numpy.copyto(buf, data)
 
-    fs = wf.getframerate()
-    assert fs > 0
+        if len(data) < 1000:  # Ensure we have enough data
+            return None
 
-    # Read entire file and make into an array
-    samps = list(array.array("i", wf.readframes(nsamps)))
+        cD_sum = self._sum[: self._sum_len(len(data))]
+        cD_sum[:] = 0
+        if numpy.ndim(data) == 1:
+            audible = self._add_channel(cD_sum, buf, profile)
+        else:
+            audible = False
+            for channel in data.T:
+                with stage(profile, "trim", len(data)):
+                    # The strided channel is converted straight into the reused buffer
+                    numpy.copyto(buf, channel)
+                audible |= self._add_channel(cD_sum, buf, profile)
 
-    try:
-        assert nsamps == len(samps)
-    except AssertionError:
-        # Silent fail - no output for clean BPM-only result
-        pass
+        if not audible:
+            return None
 
-    return samps, fs
+        max_lag = min(len(cD_sum), self.max_lag)
+        if max_lag <= self.min_lag:
+            return None
 
+        # ACF - only the lags that can hold the peak are computed
+        with stage(profile, "acf", len(cD_sum)):
+            correl = autocorrelate(cD_sum, max_lag, self.min_lag)
 
-def read_mp3(filename):
-    """Read MP3 file and convert to audio data"""
-    if not PYDUB_AVAILABLE:
-        print("Error: pydub is required for MP3 support. Install with: pip install pydub")
-        return None, None
-    
-    try:
-        # Load MP3 file
-        audio = AudioSegment.from_mp3(filename)
-        
-        # Convert to numpy array
-        # pydub uses 16-bit signed integers, so we need to convert to int32
-        samps = numpy.array(audio.get_array_of_samples(), dtype=numpy.int32)
-        
-        # If stereo, convert to mono by taking the mean of left and right channels
-        if audio.channels == 2:
-            samps = samps.reshape((-1, 2)).mean(axis=1).astype(numpy.int32)
-        
-        # Get sample rate
-        fs = audio.frame_rate
-        
-        return samps.tolist(), fs
-        
-    except Exception as e:
-        print(f"Error reading MP3 file {filename}: {e}")
-        return None, None
+        with stage(profile, "peak", max_lag - self.min_lag):
+            peak_ndx = numpy.argmax(correl[self.min_lag : max_lag]) + self.min_lag
+            bpm = fold_octave(60.0 / peak_ndx * (self.fs / self.max_decimation))
+            self.peak_ratio = float(peak_to_median(correl, self.min_lag, max_lag))
 
+        self.correl = correl
+        return float(bpm)
 
-def read_audio(filename):
-    """Read audio file (WAV or MP3) based on file extension"""
-    ext = os.path.splitext(filename)[1].lower()
-    
-    if ext == '.wav':
-        return read_wav(filename)
-    elif ext == '.mp3':
-        return read_mp3(filename)
-    else:
-        print(f"Unsupported file format: {ext}. Supported formats: .wav, .mp3")
-        return None, None
+    def _add_channel(self, cD_sum, data, profile):
+        """Add the onset envelope of one channel to cD_sum; False if the channel is silent"""
+        cA = data
+        for loop in range(self.levels):
+            with stage(profile, "dwt", len(cA)):
+                cA, cD = self._dwt(cA, self.wavelet)
 
+            with stage(profile, "filter", len(cD)):
+                self._add_envelope(cD_sum, cD, 2 ** (self.levels - loop - 1))
 
-# print an error when no data can be found
-def no_audio_data():
-    print("No audio data for sample, skipping...")
-    return None, None
+        if not cA.any():
+            return False
 
+        # Adding in the approximate data as well...
+        with stage(profile, "filter", len(cA)):
+            self._add_envelope(cD_sum, cA, 1)
+        return True
 
-# simple peak detection
-def peak_detect(data):
-    max_val = numpy.amax(abs(data))
-    peak_ndx = numpy.where(data == max_val)
-    if len(peak_ndx[0]) == 0:  # if nothing found then the max must be negative
-        peak_ndx = numpy.where(data == -max_val)
-    return peak_ndx
+    def _add_envelope(self, cD_sum, band, decimation):
+        decimated_len = -(-len(band) // decimation)
+        if decimated_len > len(self._band):
+            self._band = numpy.empty(decimated_len, self.dtype)
+        if len(band) + decimation - 1 > len(self._rectified):
+            self._rectified = numpy.empty(len(band) + decimation - 1, self.dtype)
+        _add_envelope(cD_sum, band, decimation, self.alpha, self._band, self._rectified)
 
 
-def trim_initial_silence(data, fs, threshold_percent=0.01, min_silence_duration=0.1):
+def bpm_detector_batch(windows, fs, profile=None, alpha=SMOOTHING_ALPHA, return_peak_ratios=False,
+                       dtype=numpy.float64):
     """
-    Trim initial silence from audio data
-    
+    Estimate the BPM of many equally long windows in one vectorized pass
+
+    The wavelet decomposition, envelope filtering, decimation and
+    autocorrelation run along the last axis of a 2-D array instead of once per
+    window, giving the same BPMs as calling bpm_detector on every row.
+
     Args:
-        data: Audio samples
+        windows: 2-D array with one window of mono samples per row, or a
+            3-D (windows, frames, channels) array whose channels are
+            analysed separately and combined as in BPMDetector.detect
         fs: Sample rate
-        threshold_percent: Percentage of max amplitude to consider as silence
-        min_silence_duration: Minimum duration of silence to trim (seconds)
-    
+        profile: Optional Profile recording the time of every stage
+        alpha: Envelope smoothing coefficient, 0 for the unsmoothed envelope
+            of ALGORITHM_VERSION 1
+        return_peak_ratios: Also return the peak_to_median of every window
+        dtype: Floating point type of the analysis (see PRECISIONS)
+
     Returns:
-        Trimmed audio data
+        Array with one BPM per window, NaN where no BPM could be determined,
+        and with return_peak_ratios an array of their peak_to_median (NaN
+        without a BPM)
     """
-    if len(data) == 0:
-        return data
-    
-    # Calculate threshold based on max amplitude
-    max_amplitude = max(abs(max(data)), abs(min(data)))
-    if max_amplitude == 0:
-        return data
-    
-    threshold = max_amplitude * threshold_percent
-    
-    # Find first non-silent sample
-    min_samples = int(min_silence_duration * fs)
-    
-    for i in range(len(data)):
-        if abs(data[i]) > threshold:
-            # Ensure we don't trim too aggressively
-            start_idx = max(0, i - min_samples // 2)
-            return data[start_idx:]
-    
-    # If all data is silent, return original
-    return data
+    windows = numpy.asarray(windows, dtype=_analysis_dtype(dtype))
+    if windows.ndim not in (2, 3):
+        raise ValueError("windows must be a 2-D array, or 3-D with the channels last")
 
+    bpms = numpy.full(len(windows), numpy.nan)
+    ratios = numpy.full(len(windows), numpy.nan)
+    if windows.size == 0:
+        return (bpms, ratios) if return_peak_ratios else bpms
 
-def bpm_detector(data, fs, verbose=True):
-    # Trim initial silence to avoid BPM calculation issues
-    data = trim_initial_silence(data, fs)
-    
-    if len(data) < 1000:  # Ensure we have enough data
-        return no_audio_data()
-    
-    # Use first 45 seconds for more accurate detection
-    max_samples = min(len(data), fs * 45)
-    data = data[:max_samples]
-    
-    cA = []
-    cD = []
-    correl = []
-    cD_sum = []
-    levels = 4
-    max_decimation = 2 ** (levels - 1)
-    min_ndx = math.floor(60.0 / 220 * (fs / max_decimation))
-    max_ndx = math.floor(60.0 / 40 * (fs / max_decimation))
+    # Silence trimming shortens some windows; rows trimmed by the same amount
+    # still share a length and are processed together
+    with stage(profile, "trim", windows.size):
+        level = numpy.abs(windows).max(axis=2) if windows.ndim == 3 else windows
+        starts, _ = _silence_bounds(level, fs)
+    for start in numpy.unique(starts):
+        rows = numpy.flatnonzero(starts == start)
+        data = windows[rows, start:]
+        if data.shape[1] < 1000:  # Ensure we have enough data
+            continue
+
+        # Use first 45 seconds for more accurate detection
+        data = data[:, : int(fs * ANALYSIS_SECONDS)]
+        if data.ndim == 3:
+            # Every channel becomes a row of its own, grouped by window
+            data = data.transpose(0, 2, 1)
+        bpms[rows], ratios[rows] = _bpm_detector_rows(data, fs, profile, alpha)
+
+    return (bpms, ratios) if return_peak_ratios else bpms
+
+
+def detect_windows(samps, fs, window_s=3, hop_s=None, batch_size=32, profile=None, return_peak_ratios=False,
+                   dtype=numpy.float64):
+    """
+    BPM of every full window of a track, computed with bpm_detector_batch
+
+    Windows are stacked batch_size at a time so memory stays bounded for long
+    tracks.
+
+    Args:
+        samps: Mono samples, or (frames, channels) frames whose channel
+            envelopes are summed (array or WavFile)
+        fs: Sample rate
+        window_s: Window length in seconds
+        hop_s: Distance between window starts in seconds; defaults to window_s
+        batch_size: Number of windows analysed per vectorized pass
+        profile: Optional Profile recording the time of every stage; reading
+            the windows of a lazily opened WAV counts as "decode"
+        return_peak_ratios: Also return the peak_to_median of every window
+        dtype: Floating point type of the analysis (see PRECISIONS)
+
+    Returns:
+        (window start times in seconds, bpms) as arrays; bpms are NaN where
+        no BPM could be determined. With return_peak_ratios the windows'
+        peak_to_median ratios follow as a third array.
+    """
+    window_samps = int(window_s * fs)
+    hop_samps = int((hop_s if hop_s is not None else window_s) * fs)
+    if window_samps <= 0 or hop_samps <= 0:
+        raise ValueError("window and hop must be positive")
+
+    starts = numpy.arange(0, len(samps) - window_samps + 1, hop_samps)
+    bpms = numpy.full(len(starts), numpy.nan)
+    ratios = numpy.full(len(starts), numpy.nan)
+    for first in range(0, len(starts), batch_size):
+        batch_starts = starts[first : first + batch_size]
+        with stage(profile, "decode", len(batch_starts) * window_samps):
+            windows = numpy.stack([samps[start : start + window_samps] for start in batch_starts])
+        rows = slice(first, first + len(batch_starts))
+        bpms[rows], ratios[rows] = bpm_detector_batch(windows, fs, profile, return_peak_ratios=True, dtype=dtype)
+
+    if return_peak_ratios:
+        return starts / fs, bpms, ratios
+    return starts / fs, bpms
+
+
+def _bpm_detector_rows(data, fs, profile=None, alpha=SMOOTHING_ALPHA, levels=LEVELS, wavelet=WAVELET,
+                       bpm_range=BPM_RANGE):
+    """
+    bpm_detector's analysis applied along the rows of a 2-D array
+
+    A 3-D (windows, channels, samples) array gives one BPM per window from
+    the sum of its channels' envelopes. levels, wavelet and bpm_range are as
+    for BPMDetector.
+
+    Returns:
+        (bpms, peak_to_median ratios), NaN for silent rows
+    """
+    import pywt
+
+    max_decimation, min_lag, max_lag = _lag_range(fs, levels, bpm_range)
 
     for loop in range(0, levels):
-        cD = []
         # 1) DWT
-        if loop == 0:
-            [cA, cD] = pywt.dwt(data, "db4")
-            cD_minlen = int(len(cD) / max_decimation + 1)
-            cD_sum = numpy.zeros(cD_minlen)
+        with stage(profile, "dwt", data.size if loop == 0 else cA.size):
+            if loop == 0:
+                cA, cD = pywt.dwt(data, wavelet, axis=-1)
+                cD_minlen = int(cD.shape[-1] / max_decimation + 1)
+                cD_sum = numpy.zeros(data.shape[:-1] + (cD_minlen,), data.dtype)
+            else:
+                cA, cD = pywt.dwt(cA, wavelet, axis=-1)
+
+        with stage(profile, "filter", cD.size):
+            _add_envelope(cD_sum, cD, 2 ** (levels - loop - 1), alpha)
+
+    silent = ~cA.reshape(len(cA), -1).any(axis=1)
+
+    # Adding in the approximate data as well...
+    with stage(profile, "filter", cA.size):
+        _add_envelope(cD_sum, cA, 1, alpha)
+        if cD_sum.ndim == 3:
+            # Combine the channels of every window
+            cD_sum = cD_sum.sum(axis=1)
+
+    # Find peaks in reasonable BPM range
+    max_lag = min(cD_sum.shape[1], max_lag)
+    if max_lag <= min_lag:
+        return numpy.full(len(data), numpy.nan), numpy.full(len(data), numpy.nan)
+
+    # ACF of every row at once
+    with stage(profile, "acf", cD_sum.size):
+        correl = autocorrelate(cD_sum, max_lag, min_lag)
+
+    with stage(profile, "peak", len(data) * (max_lag - min_lag)):
+        peak_ndx = numpy.argmax(correl[:, min_lag:max_lag], axis=1) + min_lag
+        bpms = 60.0 / peak_ndx * (fs / max_decimation)
+
+        bpms = fold_octave(bpms)
+        bpms[silent] = numpy.nan
+        ratios = numpy.where(silent, numpy.nan, peak_to_median(correl, min_lag, max_lag))
+    return bpms, ratios
+
+
+def source_blocks(source, fs=None, backend=None, start=None, duration=None, rate=None, profile=None,
+                  channels="mid"):
+    """
+    Mono blocks of the analysed section of a file or in-memory track
+
+    This is the input stage shared by iter_windows, detect_adaptive and
+    track_envelope. Files and (frames, channels) arrays are mixed down
+    according to channels; with "per-channel" the blocks keep their channels.
+
+    Args:
+        source: Path to an audio file, or an array/WavFile of mono samples
+            or of (frames, channels) frames
+        fs: Sample rate, required when source is not a filename
+        backend: Decoder backend used when source is a filename
+        start: Only use from this many seconds into the source, or "auto"
+            to skip the intro
+        duration: Only use this many seconds [to the end]
+        rate: Internal sample rate to resample to [full rate]
+        profile: Optional Profile recording the decode and resample stages
+        channels: How multichannel audio is analysed (see CHANNEL_MODES)
+
+    Returns:
+        (blocks, fs, offset): the blocks at the analysis rate, that rate and
+        the start of the section in seconds; blocks is None if the file
+        could not be decoded
+    """
+    if isinstance(source, (str, os.PathLike)):
+        source = os.fspath(source)
+        start, duration = resolve_section(source, start, duration, backend)
+        blocks, fs = stream_audio(source, backend=backend, start=start, duration=duration, profile=profile,
+                                  channels=channels)
+        if blocks is None:
+            return None, None, start or 0
+    else:
+        if fs is None:
+            raise ValueError("fs is required when source is not a filename")
+        if start == "auto":
+            duration = duration if duration is not None else ANALYSIS_SECONDS
+            start = auto_start(len(source) / fs, duration)
+        first, last = _frame_range(fs, len(source), start, duration)
+        blocks = (source[pos : min(pos + BLOCK_FRAMES, last)] for pos in range(first, last, BLOCK_FRAMES))
+        # WavFile slices are already mixed down by the WavFile's own channel mode
+        if not isinstance(source, WavFile) and numpy.ndim(source) == 2:
+            blocks = (_mix_frames(block, channels) for block in blocks)
+        blocks = profiled_blocks(blocks, profile)
+
+    if rate and rate < fs:
+        blocks = profiled_blocks(resample_blocks(blocks, fs, rate), profile, "resample")
+        fs = rate
+    return blocks, fs, start or 0
+
+
+def iter_windows(source, window_s=3, hop_s=None, fs=None, verbose=False, backend=None,
+                 start=None, duration=None, rate=None, profile=None, channels="mid", dtype=numpy.float64):
+    """
+    Estimate the BPM of consecutive windows while the audio is still decoding
+
+    Args:
+        source: Path to an audio file, or an array/WavFile of mono samples
+            or of (frames, channels) frames
+        window_s: Window length in seconds
+        hop_s: Distance between window starts in seconds; defaults to
+            window_s (no overlap), smaller values give overlapping windows
+        fs: Sample rate, required when source is not a filename
+        verbose: Print the BPM of every window
+        backend: Decoder backend used when source is a filename
+        start: Only analyse from this many seconds into the source, or
+            "auto" to skip the intro of a file
+        duration: Only analyse this many seconds [to the end]
+        rate: Internal sample rate; audio at a higher rate is resampled to it
+            once, before windowing, which makes the analysis proportionally
+            cheaper [full rate]
+        profile: Optional Profile recording the time of every stage
+        channels: How multichannel audio is analysed (see CHANNEL_MODES)
+        dtype: Floating point type of the analysis (see PRECISIONS)
+
+    Yields:
+        (window start time in seconds from the start of the source, bpm,
+        correl) for each window where a BPM could be determined
+    """
+    blocks, fs, offset = source_blocks(source, fs, backend, start, duration, rate, profile, channels)
+    if blocks is None:
+        return
+
+    for time, bpm, detector in window_detections(blocks, fs, offset, window_s, hop_s, profile, dtype):
+        if bpm is None:
+            no_audio_data()
         else:
-            [cA, cD] = pywt.dwt(cA, "db4")
+            if verbose:
+                print(f"{bpm:.2f}")
+            yield time, bpm, detector.correl
 
-        # 2) Filter
-        cD = signal.lfilter([0.01], [1 - 0.99], cD)
 
-        # 4) Subtract out the mean.
+def window_detections(blocks, fs, offset=0, window_s=3, hop_s=None, profile=None, dtype=numpy.float64):
+    """
+    Run a BPMDetector over consecutive windows of a block stream
 
-        # 5) Decimate for reconstruction later.
-        decimation_factor = 2 ** (levels - loop - 1)
-        cD = abs(cD[::decimation_factor])
-        cD = cD - numpy.mean(cD)
+    The windowing behind iter_windows and detect_adaptive, for callers that
+    produce the blocks themselves, e.g. to report decoding progress by
+    wrapping stream_audio's blocks, or to stop early by no longer iterating.
+    Blocks are only pulled from the stream as the windows need them.
 
-        # 6) Recombine the signal before ACF
-        # Ensure consistent array sizes
-        actual_len = min(len(cD), cD_minlen)
-        cD_sum[:actual_len] += cD[:actual_len]
+    Args:
+        blocks: Iterable of mono sample arrays (or (frames, channels) frames)
+            at fs, as from stream_audio or source_blocks
+        fs: Sample rate of the blocks
+        offset: Time in seconds of the first sample, added to every start time
+        window_s: Window length in seconds
+        hop_s: Distance between window starts in seconds [window_s]
+        profile: Optional Profile recording the time of every stage
+        dtype: Floating point type of the analysis (see PRECISIONS)
 
-    if [b for b in cA if b != 0.0] == []:
-        return no_audio_data()
+    Yields:
+        (window start time in seconds, bpm or None, the detector holding the
+        window's correl and peak_ratio)
+    """
+    window_samps = int(window_s * fs)
+    hop_samps = int((hop_s if hop_s is not None else window_s) * fs)
+    if window_samps <= 0 or hop_samps <= 0:
+        raise ValueError("window and hop must be positive")
 
-    # Adding in the approximate data as well...
-    cA = signal.lfilter([0.01], [1 - 0.99], cA)
-    cA = abs(cA)
-    cA = cA - numpy.mean(cA)
-    actual_len = min(len(cA), cD_minlen)
-    cD_sum[:actual_len] += cA[:actual_len]
-
-    # ACF - use smaller correlation window for performance
-    correl = numpy.correlate(cD_sum, cD_sum, "full")
-    
-    # Limit correlation calculation for performance
-    correl = correl[len(correl)//2:]  # Only use second half
-    
-    # Find peaks in reasonable BPM range
-    min_lag = max(1, int(60.0 / 200 * (fs / max_decimation)))  # 200 BPM max
-    max_lag = min(len(correl), int(60.0 / 40 * (fs / max_decimation)))   # 40 BPM min
-    
+    detector = BPMDetector(fs, window_s, dtype=dtype)
+
+    # Only the not yet consumed tail of the decoded audio is kept, so memory
+    # stays at about one window plus one block
+    buf = None
+    buf_start = 0  # Sample index of buf[0]
+    skip = 0  # Samples still to drop when the hop is longer than the window
+
+    for block in blocks:
+        if skip:
+            dropped = min(skip, len(block))
+            block = block[dropped:]
+            skip -= dropped
+            buf_start += dropped
+        buf = block if buf is None else numpy.concatenate((buf, block))
+
+        while len(buf) >= window_samps:
+            bpm = detector.detect(buf[:window_samps], profile)
+            yield offset + buf_start / fs, bpm, detector
+
+            advance = min(hop_samps, len(buf))
+            skip = hop_samps - advance
+            buf = buf[advance:]
+            buf_start += advance
+
+
+TempoResult = collections.namedtuple("TempoResult", ["bpm", "confidence", "windows", "seconds"])
+
+
+def detect_adaptive(source, window_s=3, hop_s=None, fs=None, backend=None, start=None, duration=None, rate=None,
+                    profile=None, channels="mid", threshold=CONFIDENCE_THRESHOLD, min_windows=MIN_CONFIDENT_WINDOWS,
+                    dtype=numpy.float64):
+    """
+    BPM of a track from as few windows as it takes to be confident
+
+    Windows are analysed in order while the audio decodes, as in
+    iter_windows, so the analysed span grows one hop at a time. Once at
+    least min_windows windows give a tempo_confidence of threshold or more,
+    decoding and analysis stop; otherwise the whole source is analysed.
+
+    Args:
+        source, window_s, hop_s, fs, backend, start, duration, rate, profile,
+        channels, dtype: As for iter_windows
+        threshold: Confidence (0 to 1) at which to stop; None never stops
+            early but still reports the confidence
+        min_windows: Number of windows analysed before stopping is considered
+
+    Returns:
+        TempoResult(bpm, confidence, windows analysed, seconds of audio
+        analysed) with bpm None if no window had one, or None if the source
+        could not be decoded
+    """
+    blocks, fs, offset = source_blocks(source, fs, backend, start, duration, rate, profile, channels)
+    if blocks is None:
+        return None
+
+    bpms, ratios = [], []
+    end = offset
+    detections = window_detections(blocks, fs, offset, window_s, hop_s, profile, dtype)
+    try:
+        for time, bpm, detector in detections:
+            end = time + window_s
+            bpms.append(numpy.nan if bpm is None else bpm)
+            ratios.append(numpy.nan if bpm is None else detector.peak_ratio)
+            if threshold is not None and len(bpms) >= min_windows:
+                if tempo_confidence(bpms, ratios)[1] >= threshold:
+                    break
+    finally:
+        # Stops the decoder as well
+        detections.close()
+
+    bpm, confidence = tempo_confidence(bpms, ratios)
+    return TempoResult(bpm, confidence, len(bpms), end - offset)
+
+
+class WaveletEnvelope:
+    """
+    Streaming version of bpm_detector's wavelet onset envelope
+
+    Every DWT level is a pair of FIR filters whose state carries over from
+    block to block, and the downsampling phase continues across blocks, so
+    the envelope does not depend on how the audio is cut into blocks and
+    each sample is filtered exactly once. The detail bands and the final
+    approximation are rectified, smoothed (the smoothing state carries over
+    too), brought to fs / 2**LEVELS and summed; per-band mean removal is
+    left to envelope_bpm, which removes the mean of the sum.
+
+    Args:
+        alpha: Envelope smoothing coefficient, 0 for the unsmoothed envelope
+            of ALGORITHM_VERSION 1
+        dtype: Floating point type of the filters and the envelope (see
+            PRECISIONS)
+    """
+
+    def __init__(self, alpha=SMOOTHING_ALPHA, dtype=numpy.float64):
+        import pywt
+        from scipy import signal
+
+        self._lfilter = signal.lfilter
+        self.alpha = alpha
+        self.dtype = _analysis_dtype(dtype)
+        wavelet = pywt.Wavelet(WAVELET)
+        # Coefficients of the input's type keep lfilter from upcasting
+        self._dec_lo = numpy.asarray(wavelet.dec_lo, self.dtype)
+        self._dec_hi = numpy.asarray(wavelet.dec_hi, self.dtype)
+        self._fir = numpy.ones(1, self.dtype)
+        self._smoothing = (numpy.array([1 - alpha], self.dtype), numpy.array([1, -alpha], self.dtype))
+        self.reset()
+
+    def reset(self):
+        """Forget all audio seen so far"""
+        taps = len(self._dec_lo) - 1
+        self._zi = [(numpy.zeros(taps, self.dtype), numpy.zeros(taps, self.dtype)) for _ in range(LEVELS)]
+        # Samples seen at the input of each DWT level, for the downsampling phase
+        self._level_seen = [0] * LEVELS
+        # Detail samples produced by each level, for the decimation phase
+        self._detail_seen = [0] * LEVELS
+        # Smoothing filter state of every band
+        self._smooth_zi = [numpy.zeros(1, self.dtype) for _ in range(LEVELS + 1)]
+        # Envelope samples of every band not yet summed with the other bands
+        self._pending = [numpy.empty(0, self.dtype) for _ in range(LEVELS + 1)]
+
+    def process(self, block):
+        """Envelope samples (of the dtype, at fs / 2**LEVELS) completed by a block of mono samples"""
+        approx = numpy.asarray(block, dtype=self.dtype)
+        for level in range(LEVELS):
+            zi_lo, zi_hi = self._zi[level]
+            lo, zi_lo = self._lfilter(self._dec_lo, self._fir, approx, zi=zi_lo)
+            hi, zi_hi = self._lfilter(self._dec_hi, self._fir, approx, zi=zi_hi)
+            self._zi[level] = (zi_lo, zi_hi)
+
+            # Keep every second output, continuing the phase of the previous block
+            phase = (1 - self._level_seen[level]) % 2
+            self._level_seen[level] += len(approx)
+            approx, detail = lo[phase::2], hi[phase::2]
+
+            # Bring the rectified detail band down to the envelope rate
+            decimation_factor = 2 ** (LEVELS - level - 1)
+            offset = -self._detail_seen[level] % decimation_factor
+            self._detail_seen[level] += len(detail)
+            detail = self._smooth(level, detail)
+            self._append_band(level, detail[offset::decimation_factor])
+
+        self._append_band(LEVELS, self._smooth(LEVELS, approx))
+
+        # Sum the bands as far as all of them have produced samples
+        ready = min(len(band) for band in self._pending)
+        envelope = sum(band[:ready] for band in self._pending)
+        self._pending = [band[ready:] for band in self._pending]
+        return envelope
+
+    def _smooth(self, band, samples):
+        """Rectified and smoothed samples of a band, continuing its filter state"""
+        rectified = numpy.abs(samples)
+        if not self.alpha:
+            return rectified
+        smoothed, self._smooth_zi[band] = self._lfilter(*self._smoothing, rectified, zi=self._smooth_zi[band])
+        return smoothed
+
+    def _append_band(self, band, samples):
+        self._pending[band] = numpy.concatenate((self._pending[band], samples))
+
+
+def envelope_bpm(envelope, fs, dtype=numpy.float64, bpm_range=BPM_RANGE, octave_range=ENVELOPE_OCTAVE_RANGE,
+                 return_peak_ratios=False):
+    """
+    BPM of onset envelopes as produced by WaveletEnvelope
+
+    Lags are converted to BPM at the envelope's sample rate, so bpm_range,
+    octave_range and the result are all real tempos (unlike bpm_detector's
+    lag scale, see _lag_range).
+
+    Args:
+        envelope: One envelope, or a 2-D array with one per row
+        fs: Sample rate of the audio the envelope was computed from
+        dtype: Floating point type of the autocorrelation (see PRECISIONS)
+        bpm_range: (lowest, highest) BPM searched for
+        octave_range: Bounds for fold_octave, or None for no octave correction
+        return_peak_ratios: Also return the peak_to_median of every envelope
+
+    Returns:
+        BPM as a float, or an array with one per row; NaN where no BPM could
+        be determined. With return_peak_ratios a (bpms, peak ratios) pair.
+    """
+    envelope = numpy.asarray(envelope, dtype=_analysis_dtype(dtype))
+    envelope = envelope - envelope.mean(axis=-1, keepdims=True)
+
+    max_decimation, min_lag, max_lag = _lag_range(fs, LEVELS, bpm_range, envelope_rate=True)
+    max_lag = min(envelope.shape[-1], max_lag)
     if max_lag <= min_lag:
-        return no_audio_data()
-    
-    # Find the peak in the correlation
-    peak_range = correl[min_lag:max_lag]
-    if len(peak_range) == 0:
-        return no_audio_data()
-    
-    peak_ndx = numpy.argmax(peak_range)
-    peak_ndx_adjusted = peak_ndx + min_lag
-    
-    bpm = 60.0 / peak_ndx_adjusted * (fs / max_decimation)
-    
-    # Proper octave detection for accurate BPM
-    if bpm < 70:  # If very low, likely half tempo
-        bpm *= 2
-    elif bpm > 180:  # If very high, likely double tempo
-        bpm /= 2
-    
-    if verbose:
-        print(f"{bpm:.2f}")
-    
-    return bpm, correl
+        bpms = numpy.full(envelope.shape[:-1], numpy.nan)
+        ratios = bpms.copy()
+    else:
+        correl = autocorrelate(envelope, max_lag, min_lag)
+        peak_ndx = numpy.argmax(correl[..., min_lag:max_lag], axis=-1) + min_lag
+        bpms = fold_octave(60.0 / peak_ndx * (fs / max_decimation), octave_range)
+        audible = envelope.any(axis=-1)
+        bpms = numpy.where(audible, bpms, numpy.nan)
+        ratios = numpy.where(audible, peak_to_median(correl, min_lag, max_lag), numpy.nan)
+
+    if envelope.ndim == 1:
+        bpms, ratios = float(bpms), float(ratios)
+    return (bpms, ratios) if return_peak_ratios else bpms
+
+
+def track_envelope(source, fs=None, backend=None, start=None, duration=None, rate=None, profile=None,
+                   channels="mid", dtype=numpy.float64):
+    """
+    Onset envelope of a whole track, computed while the audio decodes
+
+    This is the expensive, tempo-independent part of tempo_curve: decoding,
+    the wavelet transform and the envelope stage. Its result can be stored
+    (see cache.EnvelopeStore) and evaluated with different windows, BPM
+    ranges or octave rules by envelope_tempo_curve.
+
+    Args:
+        source, fs, backend, start, duration, rate, profile, channels, dtype:
+            As for tempo_curve
+
+    Returns:
+        (float32 envelope at fs / 2**LEVELS, sample rate of the analysed
+        audio, start of the envelope in seconds from the start of the
+        source), or (None, None, offset) if the source could not be decoded
+    """
+    blocks, fs, offset = source_blocks(source, fs, backend, start, duration, rate, profile, channels)
+    if blocks is None:
+        return None, None, offset
+
+    wavelet_envelopes = []
+    parts = []
+    for block in blocks:
+        with stage(profile, "envelope", len(block)):
+            columns = block.T if block.ndim == 2 else [block]
+            if not wavelet_envelopes:
+                wavelet_envelopes = [WaveletEnvelope(dtype=dtype) for _ in columns]
+            envelope = sum(wavelet_envelope.process(column) for wavelet_envelope, column in zip(wavelet_envelopes, columns))
+            parts.append(envelope.astype(numpy.float32))
+    return numpy.concatenate(parts or [numpy.empty(0, dtype=numpy.float32)]), fs, offset
+
+
+def envelope_tempo_curve(envelope, fs, window_s=8, hop_s=1, offset=0, batch_size=256, profile=None,
+                         dtype=numpy.float64, bpm_range=BPM_RANGE, octave_range=ENVELOPE_OCTAVE_RANGE,
+                         return_peak_ratios=False):
+    """
+    Tempo over time from a track_envelope
+
+    Each window only costs an autocorrelation over its part of the
+    envelope, so overlapping windows are cheap.
+
+    Args:
+        envelope: Onset envelope of the track
+        fs: Sample rate of the audio the envelope was computed from
+        window_s: Window length in seconds
+        hop_s: Distance between window starts in seconds
+        offset: Start time of the envelope, added to the window times
+        batch_size: Number of windows autocorrelated per vectorized pass
+        profile: Optional Profile recording the time of every stage
+        dtype, bpm_range, octave_range: As for envelope_bpm
+        return_peak_ratios: Also return the peak_to_median of every window
+
+    Returns:
+        (window start times in seconds, bpms) as arrays; bpms are NaN where
+        no BPM could be determined. With return_peak_ratios the windows'
+        peak_to_median ratios follow as a third array.
+    """
+    envelope_fs = fs / 2 ** LEVELS
+    window = int(window_s * envelope_fs)
+    if window <= 0 or hop_s <= 0:
+        raise ValueError("window and hop must be positive")
+
+    # Window starts are rounded to the nearest envelope sample, so the
+    # reported times do not drift when the hop is not a whole number of them
+    times = numpy.arange(0, (len(envelope) - window) / envelope_fs + 1e-9, hop_s) if len(envelope) >= window \
+        else numpy.empty(0)
+    starts = numpy.minimum(numpy.round(times * envelope_fs).astype(int), len(envelope) - window)
+    bpms = numpy.full(len(starts), numpy.nan)
+    ratios = numpy.full(len(starts), numpy.nan)
+    if len(starts):
+        windows = numpy.lib.stride_tricks.sliding_window_view(envelope, window)
+        for first in range(0, len(starts), batch_size):
+            rows = slice(first, first + batch_size)
+            with stage(profile, "acf", len(starts[rows]) * window):
+                bpms[rows], ratios[rows] = envelope_bpm(windows[starts[rows]], fs, dtype, bpm_range, octave_range,
+                                                        return_peak_ratios=True)
+
+    if return_peak_ratios:
+        return offset + times, bpms, ratios
+    return offset + times, bpms
+
+
+def tempo_curve(source, window_s=8, hop_s=1, fs=None, backend=None, start=None, duration=None, rate=None,
+                batch_size=256, profile=None, channels="mid", dtype=numpy.float64):
+    """
+    Tempo over time from one onset envelope shared by all windows
+
+    The wavelet envelope of the whole section is computed once while the
+    audio is decoded (track_envelope); each window then only costs an
+    autocorrelation over its part of the envelope (envelope_tempo_curve).
+
+    Args:
+        source: Path to an audio file, or an array/WavFile of mono samples
+            or of (frames, channels) frames
+        window_s: Window length in seconds
+        hop_s: Distance between window starts in seconds
+        fs: Sample rate, required when source is not a filename
+        backend: Decoder backend used when source is a filename
+        start: Only analyse from this many seconds into the source, or
+            "auto" to skip the intro of a file
+        duration: Only analyse this many seconds [to the end]
+        rate: Internal sample rate to resample to first [full rate]
+        batch_size: Number of windows autocorrelated per vectorized pass
+        profile: Optional Profile recording the time of every stage
+        channels: How multichannel audio is analysed (see CHANNEL_MODES);
+            with "per-channel" every channel gets its own envelope and the
+            envelopes are summed
+        dtype: Floating point type of the envelope and autocorrelation (see
+            PRECISIONS); the shared envelope is stored as float32 either way
+
+    Returns:
+        (window start times in seconds from the start of the source, bpms)
+        as arrays; bpms are NaN where no BPM could be determined
+    """
+    envelope, fs, offset = track_envelope(source, fs, backend, start, duration, rate, profile, channels, dtype)
+    if envelope is None:
+        return numpy.empty(0), numpy.empty(0)
+    return envelope_tempo_curve(envelope, fs, window_s, hop_s, offset, batch_size, profile, dtype)
+
+
+def write_tempo_curve(filename, times, bpms):
+    """
+    Save a tempo curve as CSV, JSON or NumPy .npy, chosen by the extension
+
+    CSV and JSON have one time/bpm record per window (bpm empty or null
+    where there is none); .npy holds a (n, 2) array of time and bpm. '-'
+    writes CSV to stdout.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == ".npy":
+        numpy.save(filename, numpy.column_stack((times, bpms)))
+        return
+
+    rows = [(round(float(time), 3), None if numpy.isnan(bpm) else round(float(bpm), 2))
+            for time, bpm in zip(times, bpms)]
+    stream = sys.stdout if filename == "-" else open(filename, "w", encoding="utf-8", newline="")
+    try:
+        if ext == ".json":
+            json.dump([{"time": time, "bpm": bpm} for time, bpm in rows], stream, indent=1)
+            stream.write("\n")
+        else:
+            writer = csv.writer(stream)
+            writer.writerow(["time", "bpm"])
+            writer.writerows((time, "" if bpm is None else bpm) for time, bpm in rows)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+
+
+def parse_start(value):
+    """argparse type for --start: seconds, or 'auto' to skip the intro"""
+    return value if value == "auto" else float(value)
 
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["batch"]:
+        # Library scan: bpm_detection.py batch <dir|glob> [options]
+        try:
+            from .batch import main as batch_main
+        except ImportError:
+            from batch import main as batch_main
+        sys.exit(batch_main(sys.argv[2:]))
+
+    if sys.argv[1:2] == ["live"]:
+        # Real-time tracking: bpm_detection.py live [pcm source] [options]
+        try:
+            from .live import main as live_main
+        except ImportError:
+            from live import main as live_main
+        sys.exit(live_main(sys.argv[2:]))
+
+    if sys.argv[1:2] == ["serve"]:
+        # Analysis daemon with warm workers: bpm_detection.py serve [options]
+        try:
+            from .server import main as serve_main
+        except ImportError:
+            from server import main as serve_main
+        sys.exit(serve_main(sys.argv[2:]))
+
+    if sys.argv[1:2] == ["client"]:
+        # Requests to a running daemon: bpm_detection.py client <files...> [options]
+        try:
+            from .client import main as client_main
+        except ImportError:
+            from client import main as client_main
+        sys.exit(client_main(sys.argv[2:]))
+
     parser = argparse.ArgumentParser(description="Process .wav or .mp3 file to determine the Beats Per Minute.")
     parser.add_argument("audio_file", help="Audio file for processing (.wav or .mp3)")
     parser.add_argument(
@@ -257,6 +1966,110 @@ if __name__ == "__main__":
         default=3,
         help="Size of the the window (seconds) that will be scanned to determine the bpm. Typically less than 10 seconds. [3]",
     )
+    parser.add_argument(
+        "--hop",
+        type=float,
+        default=None,
+        help="Distance (seconds) between the starts of consecutive windows. Smaller than --window for overlapping windows. [window]",
+    )
+    parser.add_argument(
+        "--start",
+        type=parse_start,
+        default=None,
+        help="Only analyse from this many seconds into the file, or 'auto' to skip the intro. [0]",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=None,
+        help=f"Only decode and analyse this many seconds. [whole file; {ANALYSIS_SECONDS} with --start auto]",
+    )
+    parser.add_argument(
+        "--rate",
+        type=int,
+        default=None,
+        help="Internal sample rate (Hz) the audio is resampled to before analysis, e.g. 11025 for about 4x less work. [full rate]",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=list(DECODERS),
+        default=None,
+        help="Decoder used to read the audio file. [first installed one for the file type]",
+    )
+    parser.add_argument(
+        "--channels",
+        choices=CHANNEL_MODES,
+        default="mid",
+        help="How multichannel audio is analysed: the average of all channels, only the left or right one, "
+             "or every channel separately with their onset envelopes summed. [mid]",
+    )
+    parser.add_argument(
+        "--precision",
+        choices=PRECISIONS,
+        default="float64",
+        help="Floating point type of the analysis; float32 halves its memory traffic. [float64]",
+    )
+    parser.add_argument(
+        "--adaptive",
+        nargs="?",
+        type=float,
+        const=CONFIDENCE_THRESHOLD,
+        default=None,
+        metavar="THRESHOLD",
+        help=f"Stop decoding once {MIN_CONFIDENT_WINDOWS} or more windows agree on a clear tempo with this confidence "
+             f"(0-1), and print the confidence after the BPM. [{CONFIDENCE_THRESHOLD}]",
+    )
+    parser.add_argument(
+        "--curve",
+        default=None,
+        metavar="FILE",
+        help="Write the tempo over time (one BPM per window, from one shared onset envelope) to a .csv, .json or .npy file; '-' writes CSV to stdout.",
+    )
+    parser.add_argument(
+        "--envelope-cache",
+        nargs="?",
+        const="default",
+        default=None,
+        metavar="DIR",
+        help="Keep the onset envelope of the file in a store of float16 .npy files and estimate the tempo from it, "
+             "so later runs with another --window, --hop, --bpm-range or --octave-range skip decoding. "
+             "[~/.cache/bpm_detector/envelopes]",
+    )
+    parser.add_argument(
+        "--bpm-range",
+        nargs=2,
+        type=float,
+        default=BPM_RANGE,
+        metavar=("LOW", "HIGH"),
+        help=f"Tempo range searched, with --curve or --envelope-cache. [{BPM_RANGE[0]} {BPM_RANGE[1]}]",
+    )
+    parser.add_argument(
+        "--octave-range",
+        nargs=2,
+        type=float,
+        default=ENVELOPE_OCTAVE_RANGE,
+        metavar=("LOW", "HIGH"),
+        help="Double tempos below LOW and halve those above HIGH, with --curve or --envelope-cache. "
+             f"[{ENVELOPE_OCTAVE_RANGE[0]} {ENVELOPE_OCTAVE_RANGE[1]}]",
+    )
+    parser.add_argument(
+        "--no-octave",
+        action="store_true",
+        help="Report tempos as found, without octave correction (with --curve or --envelope-cache).",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="table",
+        choices=["table", "json"],
+        default=None,
+        help="Print the time spent in every stage (decode, trim, dwt, filter, acf, peak) to stderr, as a table or JSON.",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="With --profile, also record the peak memory allocated in every stage (slows the analysis down).",
+    )
     parser.add_argument(
         "--verbose",
         action="store_true",
@@ -264,41 +2077,76 @@ if __name__ == "__main__":
     )
 
     args = parser.parse_args()
-    samps, fs = read_audio(args.audio_file)
-    data = []
+    envelope_based = args.curve or args.envelope_cache
+    if not envelope_based and (tuple(args.bpm_range) != BPM_RANGE or tuple(args.octave_range) != ENVELOPE_OCTAVE_RANGE
+                               or args.no_octave):
+        parser.error("--bpm-range, --octave-range and --no-octave need --curve or --envelope-cache")
+    if envelope_based and args.adaptive is not None:
+        parser.error("--adaptive cannot be combined with --curve or --envelope-cache")
+    bpms = []
     correl = []
-    bpm = 0
-    n = 0
-    nsamps = len(samps)
-    window_samps = int(args.window * fs)
-    samps_ndx = 0  # First sample in window_ndx
-    max_window_ndx = math.floor(nsamps / window_samps)
-    bpms = numpy.zeros(max_window_ndx)
-
-    # Iterate through all windows
-    for window_ndx in range(0, max_window_ndx):
-
-        # Get a new set of samples
-        # print(n,":",len(bpms),":",max_window_ndx_int,":",fs,":",nsamps,":",samps_ndx)
-        data = samps[samps_ndx : samps_ndx + window_samps]
-        if not ((len(data) % window_samps) == 0):
-            raise AssertionError(str(len(data)))
-
-        bpm, correl_temp = bpm_detector(data, fs, verbose=args.verbose)
-        if bpm is None:
-            continue
-        # Convert bpm to scalar to avoid NumPy deprecation warning
-        if hasattr(bpm, 'item'):
-            bpms[window_ndx] = bpm.item()
+    profile = Profile(trace_allocations=args.profile_memory) if args.profile or args.profile_memory else None
+
+    if envelope_based:
+        # Tempo curve: every window evaluated over one shared onset envelope
+        section = dict(backend=args.backend, start=args.start, duration=args.duration, rate=args.rate,
+                       profile=profile, channels=args.channels, dtype=args.precision)
+        if args.envelope_cache:
+            try:
+                from .cache import DEFAULT_ENVELOPE_DIR, EnvelopeStore
+            except ImportError:
+                from cache import DEFAULT_ENVELOPE_DIR, EnvelopeStore
+            store = EnvelopeStore(DEFAULT_ENVELOPE_DIR if args.envelope_cache == "default" else args.envelope_cache)
+            envelope, fs, offset = store.envelope(args.audio_file, **section)
+            # The entry just used is the most recent, so only older ones go
+            store.evict()
         else:
-            bpms[window_ndx] = bpm
-        correl = correl_temp
+            envelope, fs, offset = track_envelope(args.audio_file, **section)
 
-        # Iterate at the end of the loop
-        samps_ndx = samps_ndx + window_samps
+        times, curve = numpy.empty(0), numpy.empty(0)
+        if envelope is not None:
+            times, curve = envelope_tempo_curve(envelope, fs, args.window, args.hop or args.window, offset,
+                                                profile=profile, dtype=args.precision, bpm_range=args.bpm_range,
+                                                octave_range=None if args.no_octave else args.octave_range)
+        curve_bpms = curve[~numpy.isnan(curve)]
+        if not len(curve_bpms):
+            no_audio_data()
+            raise SystemExit(1)
+        if args.curve:
+            write_tempo_curve(args.curve, times, curve)
+        if args.curve != "-":
+            print(f"{numpy.median(curve_bpms):.2f}")
+        if profile:
+            print_profile(profile, args.profile)
+        raise SystemExit(0)
 
-        # Counter for debug...
-        n = n + 1
+    if args.adaptive is not None:
+        # Windows are added until they agree on a clear peak
+        result = detect_adaptive(args.audio_file, args.window, args.hop, backend=args.backend, start=args.start,
+                                 duration=args.duration, rate=args.rate, profile=profile, channels=args.channels,
+                                 threshold=args.adaptive, dtype=args.precision)
+        if result is None or result.bpm is None:
+            no_audio_data()
+            raise SystemExit(1)
+        if args.verbose:
+            print("Completed!  Estimated Beats Per Minute:", result.bpm)
+            print(f"Confidence {result.confidence:.2f} after {result.windows} windows ({result.seconds:.1f} s)")
+        else:
+            print(f"{result.bpm:.2f}\t{result.confidence:.2f}")
+        if profile:
+            print_profile(profile, args.profile)
+        raise SystemExit(0)
+
+    # Windows are analysed as soon as enough audio has been decoded
+    for start_time, bpm, correl in iter_windows(args.audio_file, args.window, args.hop, verbose=args.verbose,
+                                                backend=args.backend, start=args.start, duration=args.duration,
+                                                rate=args.rate, profile=profile, channels=args.channels,
+                                                dtype=args.precision):
+        bpms.append(bpm)
+
+    if not bpms:
+        no_audio_data()
+        raise SystemExit(1)
 
     bpm = numpy.median(bpms)
     
@@ -306,9 +2154,14 @@ if __name__ == "__main__":
         # Verbose mode with full output
         print("Completed!  Estimated Beats Per Minute:", bpm)
 
-        n = range(0, len(correl))
-        plt.plot(n, abs(correl))
-        plt.show(block=True)
+        try:
+            from .plotting import plot_correlation
+        except ImportError:
+            from plotting import plot_correlation
+        plot_correlation(correl)
     else:
         # Silent mode - output 2 decimal places
         print(f"{bpm:.2f}")
+
+    if profile:
+        print_profile(profile, args.profile)
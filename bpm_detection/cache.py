@@ -0,0 +1,324 @@
+"""
+Persistent on-disk caches for BPM analysis results and onset envelopes
+
+Results are stored in a local SQLite file, keyed by a fast content hash of the
+audio file together with the analysis parameters. A second table remembers
+the hash for each path with its size and mtime, so an unchanged file is found
+with a single stat() call and an index lookup, without reading the file.
+The least recently used entries are evicted once the cache grows beyond
+max_entries, and all results are dropped when ALGORITHM_VERSION changes.
+
+Onset envelopes (the decoded, wavelet-transformed front end of the analysis)
+are kept in a directory of float16 .npy files by EnvelopeStore, keyed the same
+way by content hash and front-end parameters, so the tempo can be estimated
+again with other windows, BPM ranges or octave rules without decoding.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+import numpy
+
+try:
+    from .bpm_detection import (ALGORITHM_VERSION, BPM_RANGE, ENVELOPE_OCTAVE_RANGE, LEVELS, SMOOTHING_ALPHA,
+                                WAVELET, track_envelope)
+except ImportError:
+    from bpm_detection import (ALGORITHM_VERSION, BPM_RANGE, ENVELOPE_OCTAVE_RANGE, LEVELS, SMOOTHING_ALPHA,
+                               WAVELET, track_envelope)
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "bpm_detector", "results.sqlite")
+DEFAULT_ENVELOPE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bpm_detector", "envelopes")
+
+# Bytes read from the start, middle and end of a file for its content hash
+HASH_SAMPLE_BYTES = 65536
+
+# Pending writes are committed in batches of this size
+COMMIT_INTERVAL = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    content_hash TEXT NOT NULL,
+    params TEXT NOT NULL,
+    result TEXT NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (content_hash, params)
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+"""
+
+
+def content_hash(filename, size=None):
+    """
+    Fast content hash of a file
+
+    Hashes the file size plus fixed-size samples from the start, middle and
+    end, so the cost does not grow with the file length. Audio files that
+    differ only inside unsampled regions would collide, which is acceptable
+    for a cache that is also keyed by mtime and size.
+    """
+    if size is None:
+        size = os.path.getsize(filename)
+
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(filename, "rb") as f:
+        if size <= 3 * HASH_SAMPLE_BYTES:
+            digest.update(f.read())
+        else:
+            for offset in (0, (size - HASH_SAMPLE_BYTES) // 2, size - HASH_SAMPLE_BYTES):
+                f.seek(offset)
+                digest.update(f.read(HASH_SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+def analysis_params(window=3, hop=None, start=None, duration=None, rate=None, channels="mid", adaptive=None,
+                    precision="float64", method="windows", bpm_range=BPM_RANGE, octave_range=ENVELOPE_OCTAVE_RANGE):
+    """Every setting that influences a result, as stored alongside it"""
+    return {
+        "window": window,
+        "hop": hop,
+        "start": start,
+        "duration": duration,
+        "rate": rate,
+        "channels": channels,
+        "adaptive": adaptive,
+        "precision": precision,
+        "method": method,
+        "wavelet": WAVELET,
+        "levels": LEVELS,
+        "bpm_range": list(bpm_range),
+        "octave_range": None if octave_range is None else list(octave_range),
+        "version": ALGORITHM_VERSION,
+    }
+
+
+def envelope_params(start=None, duration=None, rate=None, channels="mid"):
+    """Every setting that influences an onset envelope, as part of its EnvelopeStore key"""
+    return {
+        "start": start,
+        "duration": duration,
+        "rate": rate,
+        "channels": channels,
+        "wavelet": WAVELET,
+        "levels": LEVELS,
+        "alpha": SMOOTHING_ALPHA,
+        "version": ALGORITHM_VERSION,
+    }
+
+
+class ResultCache:
+    """
+    SQLite-backed LRU cache of analysis results
+
+    Args:
+        path: SQLite file, created if missing
+        max_entries: Number of results kept before the least recently used
+            ones are evicted
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=500000):
+        self.path = path
+        self.max_entries = max_entries
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        # Callers that share the cache between threads (the server) serialise access themselves
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._pending = 0
+
+        # Results from another algorithm version are no longer valid
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != str(ALGORITHM_VERSION):
+            self._db.execute("DELETE FROM results")
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(ALGORITHM_VERSION),))
+            self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def file_hash(self, filename):
+        """Content hash of a file, reusing the stored hash while size and mtime are unchanged"""
+        path = os.path.abspath(filename)
+        st = os.stat(path)
+        row = self._db.execute("SELECT size, mtime_ns, content_hash FROM files WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+
+        digest = content_hash(path, st.st_size)
+        self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                         (path, st.st_size, st.st_mtime_ns, digest))
+        self._changed()
+        return digest
+
+    def get(self, filename, params):
+        """Cached result dict for a file and parameters, or None"""
+        key = (self.file_hash(filename), json.dumps(params, sort_keys=True))
+        row = self._db.execute("SELECT result FROM results WHERE content_hash = ? AND params = ?", key).fetchone()
+        if row is None:
+            return None
+
+        self._db.execute("UPDATE results SET last_used = ? WHERE content_hash = ? AND params = ?",
+                         (time.time(),) + key)
+        self._changed()
+        return json.loads(row[0])
+
+    def put(self, filename, params, result):
+        """Store the result dict for a file and parameters"""
+        key = (self.file_hash(filename), json.dumps(params, sort_keys=True))
+        self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                         key + (json.dumps(result), time.time()))
+        self._changed()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def evict(self):
+        """Drop the least recently used results beyond max_entries"""
+        excess = len(self) - self.max_entries
+        if excess > 0:
+            self._db.execute("DELETE FROM results WHERE rowid IN "
+                             "(SELECT rowid FROM results ORDER BY last_used LIMIT ?)", (excess,))
+
+    def commit(self):
+        self._db.commit()
+        self._pending = 0
+
+    def close(self):
+        self.evict()
+        # Forget paths whose content is no longer cached at all
+        self._db.execute("DELETE FROM files WHERE content_hash NOT IN (SELECT content_hash FROM results)")
+        self.commit()
+        self._db.close()
+
+    def _changed(self):
+        self._pending += 1
+        if self._pending >= COMMIT_INTERVAL:
+            self.evict()
+            self.commit()
+
+
+class EnvelopeStore:
+    """
+    Directory of onset envelopes, one memory-mappable float16 .npy per track
+
+    Envelopes are scaled to a peak of 1 (the tempo does not depend on their
+    scale) and stored as float16, a quarter of their float64 size: about
+    5.5 kB per second of 44.1 kHz audio, or 1.4 kB at --rate 11025. A .json
+    next to each holds the sample rate and start time of the analysed
+    audio. Entries are keyed by the content hash of the file and the
+    envelope_params, so a changed file or front end is never answered from
+    the store. Files are replaced atomically, so worker processes can share
+    a store, and the least recently used envelopes are deleted by evict()
+    once the store grows beyond max_bytes.
+
+    Args:
+        directory: Store directory, created if missing
+        max_bytes: Size evict() shrinks the store to
+    """
+
+    def __init__(self, directory=DEFAULT_ENVELOPE_DIR, max_bytes=2 ** 32):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, filename, params):
+        """Path of an entry without extension"""
+        digest = content_hash(filename)
+        params_digest = hashlib.blake2b(json.dumps(params, sort_keys=True).encode(), digest_size=8).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}-{params_digest}")
+
+    def get(self, filename, params):
+        """(read-only memory-mapped envelope, fs, offset) for a file and envelope_params, or None"""
+        path = self._path(filename, params)
+        try:
+            with open(path + ".json") as f:
+                meta = json.load(f)
+            envelope = numpy.load(path + ".npy", mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+
+        # The modification time orders entries for evict()
+        os.utime(path + ".json")
+        return envelope, meta["fs"], meta["offset"]
+
+    def put(self, filename, params, envelope, fs, offset=0):
+        """Store the envelope of a file, with the sample rate and start time of the audio it came from"""
+        path = self._path(filename, params)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        peak = float(numpy.abs(envelope).max()) if len(envelope) else 0.0
+        scaled = numpy.asarray(envelope, dtype=numpy.float32) / (peak or 1.0)
+        # The .npy goes first: an entry counts as present once its .json exists
+        self._write(path + ".npy", lambda f: numpy.save(f, scaled.astype(numpy.float16)))
+        meta = {"fs": fs, "offset": offset, "scale": peak, "params": params}
+        self._write(path + ".json", lambda f: f.write(json.dumps(meta).encode()))
+
+    def envelope(self, filename, backend=None, start=None, duration=None, rate=None, channels="mid", profile=None,
+                 dtype=numpy.float64):
+        """
+        Onset envelope of a file from the store, computed (in dtype) and
+        stored if missing
+
+        Returns:
+            (envelope, fs, offset) as from track_envelope; (None, None,
+            offset) if the file could not be decoded
+        """
+        params = envelope_params(start, duration, rate, channels)
+        stored = self.get(filename, params)
+        if stored is not None:
+            return stored
+
+        envelope, fs, offset = track_envelope(filename, backend=backend, start=start, duration=duration, rate=rate,
+                                              profile=profile, channels=channels, dtype=dtype)
+        if envelope is not None:
+            self.put(filename, params, envelope, fs, offset)
+        return envelope, fs, offset
+
+    def evict(self):
+        """Delete the least recently used envelopes beyond max_bytes"""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for name in filenames:
+                if name.endswith(".json"):
+                    base = os.path.join(dirpath, name[: -len(".json")])
+                    try:
+                        size = os.path.getsize(base + ".npy") + os.path.getsize(base + ".json")
+                        entries.append((os.path.getmtime(base + ".json"), size, base))
+                    except OSError:
+                        continue
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, base in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for ext in (".json", ".npy"):
+                try:
+                    os.remove(base + ext)
+                except OSError:
+                    pass
+            total -= size
+
+    @staticmethod
+    def _write(path, write):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
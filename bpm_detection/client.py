@@ -0,0 +1,170 @@
+"""
+Thin client for the BPM analysis server
+
+Sends audio files or raw PCM to a running `bpm_detection.py serve` process
+and prints the results. Only the standard library is imported, so the client
+starts in a few tens of milliseconds; run this file directly (rather than
+through bpm_detection.py, which imports NumPy) for the lowest latency.
+
+Usage:
+    python bpm_detection/client.py track.mp3 other.wav [--socket /tmp/bpm.sock]
+    some-audio-source | python bpm_detection/client.py - --fs 44100 --input-channels 2
+"""
+
+import argparse
+import csv
+import http.client
+import json
+import os
+import socket
+import sys
+import urllib.parse
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection to a server listening on a Unix domain socket"""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def request(method, url, body=None, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, timeout=None):
+    """
+    Send one request to the server
+
+    Returns:
+        Decoded JSON response
+
+    Raises:
+        ValueError: The server rejected the request
+        OSError: No server is listening at the address
+    """
+    if socket_path:
+        connection = UnixHTTPConnection(socket_path, timeout)
+    else:
+        connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request(method, url, body)
+        response = connection.getresponse()
+        payload = json.loads(response.read())
+    finally:
+        connection.close()
+
+    if response.status != 200:
+        raise ValueError(payload.get("error") or f"HTTP {response.status}")
+    return payload
+
+
+def analyse_files(paths, options=None, **address):
+    """
+    Result rows (as written by the batch command) for audio files
+
+    Args:
+        paths: Audio files; relative paths are resolved here, not in the
+            server's working directory
+        options: Analysis settings (window, hop, start, duration, rate,
+            backend, channels, adaptive, precision) [server defaults]
+        address: host and port, or socket_path, of the server, and timeout
+    """
+    body = json.dumps({"paths": [os.path.abspath(path) for path in paths], "options": options or {}})
+    return request("POST", "/analyse", body.encode(), **address)["results"]
+
+
+def analyse_pcm(data, fs, nchannels=1, sample_format="s16le", name="-", options=None, **address):
+    """
+    Result row for raw interleaved PCM
+
+    Args:
+        data: PCM bytes
+        fs: Sample rate
+        nchannels: Number of interleaved channels
+        sample_format: s16le, s24le, s32le or f32le
+        name: Reported as the row's path
+        options, address: As for analyse_files (without backend)
+    """
+    query = {"fs": fs, "nchannels": nchannels, "format": sample_format, "name": name}
+    query.update({key: value for key, value in (options or {}).items() if value is not None})
+    return request("POST", "/pcm?" + urllib.parse.urlencode(query), data, **address)["results"][0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="bpm_detection.py client",
+        description="Determine the Beats Per Minute of audio files (or raw PCM on stdin) with a running "
+                    "'bpm_detection.py serve' process.",
+    )
+    parser.add_argument("inputs", nargs="+", metavar="audio_file",
+                        help="Audio files (.wav or .mp3); '-' sends raw PCM read from stdin")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Server host [{DEFAULT_HOST}]")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Server port [{DEFAULT_PORT}]")
+    parser.add_argument("--socket", default=None, help="Unix socket of the server, instead of --host/--port")
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds to wait for the results [no limit]")
+    parser.add_argument("--format", choices=["text", "csv", "jsonl"], default="text",
+                        help="Output format; text prints the BPM, after the path when there are several inputs [text]")
+
+    analysis = parser.add_argument_group("analysis options", "Sent with the request [server defaults]")
+    analysis.add_argument("--window", type=float, help="Size of the analysis window in seconds")
+    analysis.add_argument("--hop", type=float, help="Distance between window starts in seconds")
+    analysis.add_argument("--start", help="Only analyse from this many seconds into the audio, or 'auto'")
+    analysis.add_argument("--duration", type=float, help="Only analyse this many seconds")
+    analysis.add_argument("--rate", type=int, help="Internal sample rate (Hz) the audio is resampled to")
+    analysis.add_argument("--backend", help="Decoder used to read the audio files")
+    analysis.add_argument("--channels", help="How multichannel audio is analysed: mid, left, right or per-channel")
+    analysis.add_argument("--adaptive", nargs="?", const="default", metavar="THRESHOLD",
+                          help="Stop once the windows agree on a tempo with this confidence (0-1)")
+    analysis.add_argument("--precision", help="Floating point type of the analysis: float64 or float32")
+
+    pcm = parser.add_argument_group("raw PCM input ('-')")
+    pcm.add_argument("--fs", type=int, default=44100, help="Sample rate of the input [44100]")
+    pcm.add_argument("--input-channels", type=int, default=2, help="Number of interleaved channels [2]")
+    pcm.add_argument("--sample-format", choices=["s16le", "s24le", "s32le", "f32le"], default="s16le",
+                     help="Sample format [s16le]")
+    pcm.add_argument("--name", default="-", help="Path reported for the PCM input [-]")
+    args = parser.parse_args(argv)
+
+    address = {"host": args.host, "port": args.port, "socket_path": args.socket, "timeout": args.timeout}
+    options = {key: getattr(args, key) for key in
+               ("window", "hop", "start", "duration", "rate", "backend", "channels", "adaptive", "precision")
+               if getattr(args, key) is not None}
+    paths = [path for path in args.inputs if path != "-"]
+
+    try:
+        rows = analyse_files(paths, options, **address) if paths else []
+        if "-" in args.inputs:
+            pcm_options = {key: value for key, value in options.items() if key != "backend"}
+            row = analyse_pcm(sys.stdin.buffer.read(), args.fs, args.input_channels, args.sample_format, args.name,
+                              pcm_options, **address)
+            rows.insert(args.inputs.index("-"), row)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    except OSError as e:
+        where = args.socket or f"{args.host}:{args.port}"
+        print(f"No BPM server at {where} ({e}); start one with 'bpm_detection.py serve'", file=sys.stderr)
+        return 1
+
+    if args.format == "csv":
+        writer = csv.DictWriter(sys.stdout, fieldnames=list(rows[0]), extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    for row in rows:
+        if args.format == "jsonl":
+            print(json.dumps(row))
+        elif args.format == "text" and row["bpm"] is not None:
+            print(f"{row['path']}\t{row['bpm']:.2f}" if len(rows) > 1 else f"{row['bpm']:.2f}")
+        if row["status"] != "ok":
+            print(f"{row['path']}: {row['error'] or 'no BPM found'}", file=sys.stderr)
+    return 0 if all(row["status"] == "ok" for row in rows) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+Real-time BPM tracking from a live audio stream
+
+StreamingBPMTracker takes PCM blocks as they arrive and keeps the wavelet
+envelope up to date incrementally with a WaveletEnvelope, so each sample is
+filtered exactly once. Only the envelope of the last window_s seconds is kept, in a
+ring buffer at fs / 2**LEVELS, and the autocorrelation over it runs once per
+hop. The work per block is therefore proportional to the block length, plus
+one small ACF whenever a hop boundary is crossed.
+
+Usage:
+    some-audio-source | python bpm_detection/bpm_detection.py live --fs 44100 --input-channels 2
+    python bpm_detection/bpm_detection.py live /tmp/booth.pipe --fs 48000 --format f32le
+"""
+
+import argparse
+import collections
+import math
+import sys
+
+import numpy
+
+try:
+    from .bpm_detection import LEVELS, WaveletEnvelope, downmix, envelope_bpm, pcm_to_array
+except ImportError:
+    from bpm_detection import LEVELS, WaveletEnvelope, downmix, envelope_bpm, pcm_to_array
+
+TempoEstimate = collections.namedtuple("TempoEstimate", ["time", "bpm"])
+
+# Raw sample formats accepted by the live command: (sample width, is float)
+PCM_FORMATS = {"s16le": (2, False), "s24le": (3, False), "s32le": (4, False), "f32le": (4, True)}
+
+
+class StreamingBPMTracker:
+    """
+    Incremental BPM estimation over a sliding window of a live stream
+
+    Args:
+        fs: Sample rate of the incoming audio
+        window_s: Length of the analysed history in seconds
+        hop_s: Seconds of audio between two estimates
+    """
+
+    def __init__(self, fs, window_s=10, hop_s=1):
+        if window_s <= 0 or hop_s <= 0:
+            raise ValueError("window and hop must be positive")
+
+        # Imported here rather than on the first block, so that block does
+        # not pay for it
+        import scipy.fft  # noqa: F401 (used by autocorrelate)
+
+        self.fs = fs
+        self.window_s = window_s
+        self.hop_s = hop_s
+
+        self._envelope = WaveletEnvelope()
+        self._ring = numpy.zeros(max(1, int(window_s * fs / 2 ** LEVELS)))
+        self._hop_samples = max(1, int(hop_s * fs))
+        self.reset()
+
+    def reset(self):
+        """Forget all audio seen so far"""
+        self._envelope.reset()
+        self._ring[:] = 0
+        self._ring_pos = 0
+        self._ring_filled = 0
+
+        self.samples_seen = 0
+        self._next_estimate = self._hop_samples
+        self.latest = None
+
+    @property
+    def time(self):
+        """Seconds of audio consumed so far"""
+        return self.samples_seen / self.fs
+
+    def feed(self, block):
+        """
+        Add a block of samples
+
+        Args:
+            block: Mono samples, or a (frames, channels) array that is
+                averaged to mono
+
+        Returns:
+            TempoEstimate when the block completes a hop (bpm is None while
+            the window is silent), otherwise None
+        """
+        block = numpy.asarray(block, dtype=numpy.float64)
+        if block.ndim == 2:
+            block = block.mean(axis=1)
+        if len(block) == 0:
+            return None
+
+        self._push(self._envelope.process(block))
+        self.samples_seen += len(block)
+        if self.samples_seen < self._next_estimate:
+            return None
+
+        # Long blocks may cross several hop boundaries; estimate once at the end
+        hops = (self.samples_seen - self._next_estimate) // self._hop_samples + 1
+        self._next_estimate += hops * self._hop_samples
+        self.latest = TempoEstimate(self.time, self.estimate())
+        return self.latest
+
+    def estimate(self):
+        """BPM of the envelope currently in the window, or None if there is none"""
+        bpm = envelope_bpm(self._window(), self.fs) if self._ring_filled else math.nan
+        return None if math.isnan(bpm) else bpm
+
+    def _push(self, samples):
+        """Append envelope samples to the ring buffer, overwriting the oldest"""
+        size = len(self._ring)
+        samples = samples[-size:]
+        end = self._ring_pos + len(samples)
+        if end <= size:
+            self._ring[self._ring_pos : end] = samples
+        else:
+            split = size - self._ring_pos
+            self._ring[self._ring_pos :] = samples[:split]
+            self._ring[: end - size] = samples[split:]
+        self._ring_pos = end % size
+        self._ring_filled = min(size, self._ring_filled + len(samples))
+
+    def _window(self):
+        """Envelope in the ring buffer in chronological order"""
+        if self._ring_filled < len(self._ring):
+            return self._ring[: self._ring_filled]
+        return numpy.concatenate((self._ring[self._ring_pos :], self._ring[: self._ring_pos]))
+
+
+def iter_pcm_blocks(stream, block_frames, channels, sampwidth, is_float=False):
+    """Mono float32 blocks of raw interleaved PCM read from a binary stream"""
+    frame_bytes = channels * sampwidth
+    leftover = b""
+    while True:
+        raw = stream.read(block_frames * frame_bytes - len(leftover))
+        if not raw:
+            break
+        raw = leftover + raw
+        usable = len(raw) // frame_bytes * frame_bytes
+        raw, leftover = raw[:usable], raw[usable:]
+        if raw:
+            yield downmix(pcm_to_array(raw, sampwidth, is_float), channels)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="bpm_detection.py live",
+        description="Track the BPM of raw PCM audio arriving on stdin, a named pipe or a file.",
+    )
+    parser.add_argument("input", nargs="?", default="-", help="Raw PCM source; '-' reads stdin [-]")
+    parser.add_argument("--fs", type=int, default=44100, help="Sample rate of the input [44100]")
+    parser.add_argument("--input-channels", type=int, default=2, help="Number of interleaved channels [2]")
+    parser.add_argument("--format", choices=list(PCM_FORMATS), default="s16le", help="Sample format [s16le]")
+    parser.add_argument("--block", type=int, default=1024, help="Frames read per block [1024]")
+    parser.add_argument("--window", type=float, default=10, help="Seconds of history the tempo is estimated from [10]")
+    parser.add_argument("--hop", type=float, default=1, help="Seconds between two estimates [1]")
+    args = parser.parse_args(argv)
+
+    sampwidth, is_float = PCM_FORMATS[args.format]
+    tracker = StreamingBPMTracker(args.fs, window_s=args.window, hop_s=args.hop)
+
+    stream = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+    try:
+        for block in iter_pcm_blocks(stream, args.block, args.input_channels, sampwidth, is_float):
+            estimate = tracker.feed(block)
+            if estimate is not None:
+                bpm = "-" if estimate.bpm is None else f"{estimate.bpm:.2f}"
+                print(f"{estimate.time:.2f} {bpm}", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
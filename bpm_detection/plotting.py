@@ -0,0 +1,15 @@
+"""
+Optional plots for verbose runs
+
+Kept separate from bpm_detection.py so matplotlib is only imported when a
+plot is actually shown.
+"""
+
+import matplotlib.pyplot as plt
+
+
+def plot_correlation(correl):
+    """Show the autocorrelation used for the last BPM estimate, indexed by lag"""
+    n = range(0, len(correl))
+    plt.plot(n, abs(correl))
+    plt.show(block=True)
@@ -0,0 +1,155 @@
+"""
+Opt-in per-stage profiling of the BPM analysis
+
+Pass a Profile as `profile=` to read_audio, stream_audio, bpm_detector,
+iter_windows, detect_windows or tempo_curve and it records, for every stage
+(decode, resample, trim, dwt, filter, acf, peak, ...), how often it ran, the
+time spent, the number of samples it processed and, with
+trace_allocations=True, the peak memory allocated inside it. Without a
+profile the stages run under a shared no-op context, so the cost when
+disabled is one attribute lookup per stage.
+"""
+
+import contextlib
+import json
+import sys
+import time
+import tracemalloc
+
+
+class _Record:
+    """Handle of a running stage, so the caller can fill in its sample count late"""
+
+    def __init__(self, samples):
+        self.samples = samples
+
+
+# Shared by every stage while profiling is off; writes to its record are ignored
+_DISABLED = contextlib.nullcontext(_Record(0))
+
+
+def stage(profile, name, samples=0):
+    """Context timing one stage into profile, or a no-op when profile is None"""
+    if profile is None:
+        return _DISABLED
+    return profile.stage(name, samples)
+
+
+def profiled_blocks(blocks, profile, name="decode"):
+    """Pass blocks through, counting the time spent producing them as a stage"""
+    if profile is None:
+        return blocks
+    return _profiled_blocks(blocks, profile, name)
+
+
+def _profiled_blocks(blocks, profile, name):
+    iterator = iter(blocks)
+    while True:
+        with profile.stage(name) as record:
+            try:
+                block = next(iterator)
+            except StopIteration:
+                return
+            record.samples = len(block)
+        yield block
+
+
+class Profile:
+    """
+    Per-stage counters collected while analysing audio
+
+    Args:
+        trace_allocations: Also record the peak memory allocated in each
+            stage with tracemalloc (slows the analysis down noticeably)
+    """
+
+    def __init__(self, trace_allocations=False):
+        self.trace_allocations = trace_allocations
+        self.stages = {}
+        # Time spent in nested stages of every running stage, innermost last
+        self._children = []
+        # Highest traced memory of every running stage before its latest
+        # tracemalloc.reset_peak(), which nested stages call when they start
+        self._peaks = []
+
+    @contextlib.contextmanager
+    def stage(self, name, samples=0):
+        """
+        Time a stage; time spent in stages nested inside it is only counted
+        for the nested stage
+        """
+        record = _Record(samples)
+        self._children.append(0.0)
+        tracing = self.trace_allocations and tracemalloc.is_tracing()
+        if self.trace_allocations and not tracing:
+            tracemalloc.start()
+        if self.trace_allocations:
+            before, peak = tracemalloc.get_traced_memory()
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            self._peaks.append(before)
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - start
+            peak = 0
+            if self.trace_allocations:
+                highest = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], highest)
+                peak = highest - before
+                if not tracing:
+                    tracemalloc.stop()
+
+            nested = self._children.pop()
+            if self._children:
+                self._children[-1] += seconds
+            self.add(name, seconds - nested, record.samples, peak)
+
+    def add(self, name, seconds, samples=0, peak_bytes=0, calls=1):
+        """Add one (or several merged) runs of a stage"""
+        entry = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "samples": 0, "peak_bytes": 0})
+        entry["calls"] += calls
+        entry["seconds"] += seconds
+        entry["samples"] += samples
+        entry["peak_bytes"] = max(entry["peak_bytes"], peak_bytes)
+
+    def merge(self, other):
+        """Add the counters of another Profile or of its as_dict() result"""
+        stages = other.stages if isinstance(other, Profile) else other["stages"]
+        for name, entry in stages.items():
+            self.add(name, entry["seconds"], entry["samples"], entry["peak_bytes"], entry["calls"])
+
+    @property
+    def total_seconds(self):
+        return sum(entry["seconds"] for entry in self.stages.values())
+
+    def as_dict(self):
+        return {
+            "total_seconds": round(self.total_seconds, 6),
+            "stages": {name: dict(entry, seconds=round(entry["seconds"], 6)) for name, entry in self.stages.items()},
+        }
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=2)
+
+    def table(self):
+        """Human readable summary, one line per stage in the order they first ran"""
+        total = self.total_seconds or 1e-9
+        lines = [f"{'stage':<10} {'calls':>7} {'seconds':>9} {'share':>6} {'Msamples/s':>11} {'peak MB':>8}"]
+        for name, entry in self.stages.items():
+            rate = entry["samples"] / entry["seconds"] / 1e6 if entry["seconds"] and entry["samples"] else 0
+            peak = f"{entry['peak_bytes'] / 2 ** 20:8.1f}" if self.trace_allocations else f"{'-':>8}"
+            lines.append(f"{name:<10} {entry['calls']:>7} {entry['seconds']:>9.4f} {entry['seconds'] / total:>6.1%} "
+                         f"{rate:>11.1f} {peak}")
+        lines.append(f"{'total':<10} {'':>7} {self.total_seconds:>9.4f}")
+        return "\n".join(lines)
+
+
+def print_profile(profile, fmt="table", stream=None):
+    """Write a Profile as a table or as JSON, to stderr by default"""
+    stream = stream or sys.stderr
+    print(profile.to_json() if fmt == "json" else profile.table(), file=stream)
@@ -0,0 +1,404 @@
+"""
+Long-running local BPM analysis server
+
+Every command line run pays for the interpreter start-up and the scipy/pywt
+and decoder imports before any audio is touched. The server pays for them
+once: it keeps a pool of worker processes that have imported the analysis
+libraries and run a detection at start-up, and answers HTTP requests on
+localhost or on a Unix socket. The requests of all connections are queued onto
+the one pool, so each request costs the decoding and analysis of its audio
+plus a local round trip. Results of unchanged files are answered from a
+ResultCache without reaching the pool. bpm_detection/client.py is the
+matching thin client.
+
+Endpoints:
+    GET  /status              Pool size, requests served, uptime
+    POST /analyse             {"paths": [...], "options": {...}} with absolute paths
+    POST /pcm?fs=44100&...    Raw interleaved PCM body; nchannels, format, name and
+                              the analysis options as query parameters
+Both POSTs answer {"fields": RESULT_FIELDS, "results": [row, ...]}; rejected
+requests get a 4xx status and {"error": message}.
+
+Usage:
+    python bpm_detection/bpm_detection.py serve [--port 8765 | --socket /tmp/bpm.sock] [--workers N]
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import http.server
+import json
+import os
+import signal
+import socketserver
+import stat
+import sys
+import threading
+import time
+import urllib.parse
+
+import numpy
+
+try:
+    from .batch import RESULT_FIELDS, adaptive_row, analyse_file, error_row, windows_row
+    from .bpm_detection import (ALGORITHM_VERSION, CHANNEL_MODES, CONFIDENCE_THRESHOLD, DECODERS, PRECISIONS,
+                                detect_adaptive, detect_windows, parse_start, pcm_to_array, source_blocks,
+                                warm_up)
+    from .cache import DEFAULT_CACHE_PATH, ResultCache, analysis_params
+    from .client import DEFAULT_HOST, DEFAULT_PORT
+    from .live import PCM_FORMATS
+except ImportError:
+    from batch import RESULT_FIELDS, adaptive_row, analyse_file, error_row, windows_row
+    from bpm_detection import (ALGORITHM_VERSION, CHANNEL_MODES, CONFIDENCE_THRESHOLD, DECODERS, PRECISIONS,
+                               detect_adaptive, detect_windows, parse_start, pcm_to_array, source_blocks,
+                               warm_up)
+    from cache import DEFAULT_CACHE_PATH, ResultCache, analysis_params
+    from client import DEFAULT_HOST, DEFAULT_PORT
+    from live import PCM_FORMATS
+
+
+def _choice(choices):
+    def convert(value):
+        if value not in choices:
+            raise ValueError(f"expected one of {', '.join(choices)}")
+        return value
+    return convert
+
+
+def _threshold(value):
+    return CONFIDENCE_THRESHOLD if value == "default" else float(value)
+
+
+# Analysis options a request may set, with the conversion of their JSON or
+# query string values
+OPTION_TYPES = {
+    "window": float,
+    "hop": float,
+    "start": parse_start,
+    "duration": float,
+    "rate": int,
+    "backend": _choice(list(DECODERS)),
+    "channels": _choice(CHANNEL_MODES),
+    "adaptive": _threshold,
+    "precision": _choice(PRECISIONS),
+}
+
+
+def parse_options(options):
+    """analyse_file keyword arguments from the options of a request; ValueError for invalid ones"""
+    unknown = sorted(set(options) - set(OPTION_TYPES))
+    if unknown:
+        raise ValueError(f"unknown option {', '.join(unknown)}")
+
+    kwargs = {}
+    for key, value in options.items():
+        if value is None:
+            continue
+        try:
+            kwargs[key] = OPTION_TYPES[key](value)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"invalid {key} {value!r}: {e}") from None
+    return kwargs
+
+
+def _warm_worker():
+    """Pool initializer: import the analysis and decoder libraries and run one detection"""
+    # Ctrl+C on the server's terminal reaches the workers too; the server
+    # shuts them down itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    warm_up()
+    noise = numpy.random.default_rng(0).standard_normal(6 * 11025).astype(numpy.float32)
+    for precision in PRECISIONS:
+        detect_windows(noise, 11025, dtype=precision)
+
+
+def _worker_ready():
+    return os.getpid()
+
+
+def analyse_pcm(data, fs, nchannels=1, sample_format="s16le", name="-", window=3, hop=None, start=None,
+                duration=None, rate=None, channels="mid", adaptive=None, precision="float64"):
+    """
+    Result row for raw interleaved PCM, as analyse_file gives for a file (runs in a worker process)
+
+    Args:
+        data: PCM bytes; a trailing partial frame is ignored
+        fs: Sample rate
+        nchannels: Number of interleaved channels
+        sample_format: One of live.PCM_FORMATS
+        name: Reported as the row's path
+        window, hop, start, duration, rate, channels, adaptive, precision:
+            As for analyse_file
+    """
+    sampwidth, is_float = PCM_FORMATS[sample_format]
+    frame_bytes = sampwidth * nchannels
+    frames = pcm_to_array(data[: len(data) // frame_bytes * frame_bytes], sampwidth, is_float)
+    frames = frames.reshape(-1, nchannels)
+
+    if adaptive is not None:
+        result = detect_adaptive(frames, window, hop, fs=fs, start=start, duration=duration, rate=rate,
+                                 channels=channels, threshold=adaptive, dtype=precision)
+        return adaptive_row(name, result)
+
+    blocks, fs, _ = source_blocks(frames, fs, start=start, duration=duration, rate=rate, channels=channels)
+    blocks = list(blocks)
+    samps = numpy.concatenate(blocks) if blocks else numpy.empty(0, numpy.float32)
+    _, bpms, ratios = detect_windows(samps, fs, window, hop, return_peak_ratios=True, dtype=precision)
+    return windows_row(name, bpms, ratios, len(samps) / fs)
+
+
+class BPMServer:
+    """
+    Warm worker pool shared by all requests, with an optional result cache
+
+    Args:
+        workers: Number of worker processes [os.cpu_count()]
+        cache: Optional ResultCache consulted before and updated after
+            analysing a file
+    """
+
+    def __init__(self, workers=None, cache=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.cache = cache
+        self.requests = 0
+        self.started = time.time()
+        # Guards the cache, the counters and replacing a broken pool
+        self._lock = threading.Lock()
+        self._executor = self._start_pool()
+
+    def _start_pool(self):
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker)
+        # The pool starts one process per submitted task up to max_workers;
+        # start (and warm up) all of them now instead of on the first requests
+        concurrent.futures.wait([executor.submit(_worker_ready) for _ in range(self.workers)])
+        return executor
+
+    def _submit(self, fn, *args, **kwargs):
+        # Under the lock, so that no task goes to a pool that is being replaced
+        with self._lock:
+            executor = self._executor
+            try:
+                return executor, executor.submit(fn, *args, **kwargs)
+            except concurrent.futures.process.BrokenProcessPool as e:
+                # A worker died while the pool was idle; _result replaces it
+                future = concurrent.futures.Future()
+                future.set_exception(e)
+                return executor, future
+
+    def _result(self, name, executor, future):
+        """Result of a _submit()ted task, or an error row named name if it raised"""
+        try:
+            return future.result()
+        except concurrent.futures.process.BrokenProcessPool as e:
+            # A crashed worker breaks the pool for every request in flight;
+            # the first to notice replaces it. The new pool warms up without
+            # the lock held, so other requests are not stalled meanwhile.
+            with self._lock:
+                replace = self._executor is executor
+            if replace:
+                fresh = self._start_pool()
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor, fresh = fresh, executor
+                fresh.shutdown(wait=False, cancel_futures=True)
+            return error_row(name, e)
+        except Exception as e:
+            return error_row(name, e)
+
+    def analyse_paths(self, paths, options):
+        """Result rows for files, analysed in parallel; options are parse_options keyword arguments"""
+        params = analysis_params(**{key: value for key, value in options.items() if key != "backend"})
+        rows = [self._cached(path, params) for path in paths]
+        tasks = {i: self._submit(analyse_file, path, **options) for i, path in enumerate(paths) if rows[i] is None}
+
+        for i, (executor, future) in tasks.items():
+            rows[i] = self._result(paths[i], executor, future)
+            if rows[i]["status"] != "error":
+                self._store(paths[i], params, rows[i])
+
+        self._served()
+        return [{key: row.get(key) for key in RESULT_FIELDS} for row in rows]
+
+    def analyse_pcm(self, data, fs, nchannels=1, sample_format="s16le", name="-", options=None):
+        """Result row for raw PCM (see analyse_pcm); options are parse_options keyword arguments"""
+        row = self._result(name, *self._submit(analyse_pcm, data, fs, nchannels, sample_format, name,
+                                               **(options or {})))
+        self._served()
+        return {key: row.get(key) for key in RESULT_FIELDS}
+
+    def _cached(self, path, params):
+        if self.cache is None:
+            return None
+        with self._lock:
+            try:
+                cached = self.cache.get(path, params)
+            except OSError:
+                # Missing files are reported by the analysis
+                return None
+        return None if cached is None else dict(cached, path=path)
+
+    def _store(self, path, params, row):
+        if self.cache is None:
+            return
+        with self._lock:
+            with contextlib.suppress(OSError):
+                self.cache.put(path, params, {key: value for key, value in row.items() if key != "path"})
+
+    def _served(self):
+        with self._lock:
+            self.requests += 1
+            if self.cache is not None:
+                self.cache.commit()
+
+    def status(self):
+        return {
+            "status": "ok",
+            "workers": self.workers,
+            "requests": self.requests,
+            "uptime": round(time.time() - self.started, 3),
+            "cache": None if self.cache is None else self.cache.path,
+            "algorithm_version": ALGORITHM_VERSION,
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        if self.cache is not None:
+            with self._lock:
+                self.cache.close()
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """HTTP front end of the BPMServer in self.server.bpm"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = f"bpm_detection/{ALGORITHM_VERSION}"
+
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path == "/status":
+            self._reply(200, self.server.bpm.status())
+        else:
+            self._reply(404, {"error": f"no such endpoint: {self.path}"})
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            if url.path == "/analyse":
+                rows = self._analyse(json.loads(body or b"{}"))
+            elif url.path == "/pcm":
+                rows = self._pcm(dict(urllib.parse.parse_qsl(url.query)), body)
+            else:
+                self._reply(404, {"error": f"no such endpoint: {url.path}"})
+                return
+        except ValueError as e:
+            self._reply(400, {"error": str(e)})
+            return
+        self._reply(200, {"fields": RESULT_FIELDS, "results": rows})
+
+    def _analyse(self, request):
+        paths = request.get("paths") if isinstance(request, dict) else None
+        if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+            raise ValueError("expected {\"paths\": [...], \"options\": {...}}")
+        if not all(os.path.isabs(path) for path in paths):
+            raise ValueError("paths must be absolute")
+        return self.server.bpm.analyse_paths(paths, parse_options(request.get("options") or {}))
+
+    def _pcm(self, query, body):
+        try:
+            fs = int(query.pop("fs"))
+            nchannels = int(query.pop("nchannels", 1))
+        except KeyError:
+            raise ValueError("fs is required for PCM") from None
+        sample_format = query.pop("format", "s16le")
+        name = query.pop("name", "-")
+        if fs <= 0 or nchannels <= 0:
+            raise ValueError("fs and nchannels must be positive")
+        if sample_format not in PCM_FORMATS:
+            raise ValueError(f"unknown format {sample_format}, expected one of {', '.join(PCM_FORMATS)}")
+        if "backend" in query:
+            raise ValueError("backend does not apply to PCM")
+        return [self.server.bpm.analyse_pcm(body, fs, nchannels, sample_format, name, parse_options(query))]
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket peers have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(bpm, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, verbose=False):
+    """
+    HTTP server for a BPMServer on host:port, or on a Unix socket
+
+    A stale socket file left behind by a server that was killed is replaced.
+    Call serve_forever() to handle requests, one thread per connection.
+    """
+    if socket_path:
+        with contextlib.suppress(FileNotFoundError):
+            if stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                os.unlink(socket_path)
+        server = UnixHTTPServer(socket_path, RequestHandler)
+    else:
+        server = http.server.ThreadingHTTPServer((host, port), RequestHandler)
+    server.bpm = bpm
+    server.verbose = verbose
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="bpm_detection.py serve",
+        description="Answer BPM requests from 'bpm_detection.py client' with a pool of warm worker processes.",
+    )
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Address to listen on [{DEFAULT_HOST}]")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on [{DEFAULT_PORT}]")
+    parser.add_argument("--socket", default=None, help="Listen on this Unix socket instead of --host/--port")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes [CPU count]")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH,
+                        help=f"SQLite file caching results of unchanged files [{DEFAULT_CACHE_PATH}]")
+    parser.add_argument("--no-cache", action="store_true", help="Analyse every file even if a cached result exists")
+    parser.add_argument("--verbose", action="store_true", help="Log every request to stderr")
+    args = parser.parse_args(argv)
+
+    bpm = BPMServer(args.workers, None if args.no_cache else ResultCache(args.cache))
+    try:
+        server = make_server(bpm, args.host, args.port, args.socket, args.verbose)
+    except OSError as e:
+        bpm.close()
+        print(f"Cannot listen on {args.socket or f'{args.host}:{args.port}'}: {e}", file=sys.stderr)
+        return 1
+
+    # serve_forever() returns once shutdown() is called from another thread
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    print(f"Listening on {args.socket or f'{args.host}:{args.port}'} with {bpm.workers} workers",
+          file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        bpm.close()
+        if args.socket:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(args.socket)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
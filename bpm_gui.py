@@ -3,205 +3,551 @@
 """
 BPM Detector GUI Application
 Ein einfaches GUI zur Erkennung von BPM aus WAV-Dateien
+
+Dateien und Ordner werden in eine Warteschlange gelegt und von einem Pool
+aus Worker-Prozessen analysiert; die Ergebnisse erscheinen sofort in einer
+sortierbaren Tabelle und können als CSV exportiert werden.
 """
 
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import threading
+import collections
+import concurrent.futures
+import importlib.util
+import multiprocessing
 import os
+import queue
 import sys
 from pathlib import Path
 
 # Import the BPM detection functions from the existing module
-from bpm_detection.bpm_detection import read_audio, bpm_detector
+from bpm_detection.bpm_detection import audio_length, bpm_detector, stream_audio, warm_up, window_detections
+from bpm_detection.batch import ResultWriter, find_audio_files
 import numpy as np
 
+# Drag and drop needs the optional tkinterdnd2 package; without it files are
+# added with the buttons only
+TKDND_AVAILABLE = importlib.util.find_spec("tkinterdnd2") is not None
+
+# How often (ms) the UI thread collects progress and finished analyses
+POLL_MS = 100
+
+# Chunks with a BPM needed before a provisional BPM is shown
+PROVISIONAL_CHUNKS = 3
+
+# Treeview columns as (key, heading, width)
+COLUMNS = [
+    ("file", "Datei", 300),
+    ("bpm", "BPM", 80),
+    ("duration", "Dauer", 80),
+    ("status", "Status", 200),
+]
+
+STATUS_TEXT = {
+    "queued": "Wartend",
+    "running": "Analysiere...",
+    "ok": "Fertig",
+    "no_bpm": "Keine BPM erkannt",
+    "error": "Fehler",
+    "cancelled": "Abgebrochen",
+}
+
+FINISHED = ("ok", "no_bpm", "error")
+
+
+def analyse_file(path, chunk_duration=3.0, progress=None, cancelled=None):
+    """
+    Result row of one file (runs in a worker process)
+
+    The file is decoded block by block and each chunk is analysed as soon as
+    it has been decoded, so the analysis reports how far it has got and can
+    be stopped between two chunks.
+
+    Args:
+        progress: Optional callable receiving (fraction of the file decoded,
+            or None if its length is unknown; median BPM of the chunks so
+            far, or None before PROVISIONAL_CHUNKS had one) after every chunk
+        cancelled: Optional callable; once it returns True the decoding
+            stops and the row gets status "cancelled"
+
+    Returns:
+        Dict with the batch mode's RESULT_FIELDS keys
+    """
+    row = {"path": path, "bpm": None, "duration": None, "windows": 0, "status": "error", "error": None}
+    try:
+        length = audio_length(path)
+        blocks, fs = stream_audio(path)
+        if blocks is None or fs is None:
+            row["error"] = "Fehler beim Lesen der Audio-Datei"
+            return row
+
+        chunk_samples = int(chunk_duration * fs)
+        decoded = 0
+        tail = np.empty(0, dtype=np.float32)  # The last chunk_samples decoded samples
+
+        def tracked(blocks):
+            nonlocal decoded, tail
+            for block in blocks:
+                decoded += len(block)
+                tail = np.concatenate((tail, block))[-chunk_samples:]
+                yield block
+
+        bpms = []
+        chunks = 0
+        detections = window_detections(tracked(blocks), fs, window_s=chunk_duration)
+        try:
+            for _, bpm, _ in detections:
+                if cancelled is not None and cancelled():
+                    row.update(status="cancelled")
+                    return row
+                chunks += 1
+                if bpm is not None and 60 <= bpm <= 200:  # Reasonable BPM range
+                    bpms.append(bpm)
+                if progress is not None:
+                    progress(min(decoded / fs / length, 1.0) if length else None,
+                             float(np.median(bpms)) if len(bpms) >= PROVISIONAL_CHUNKS else None)
+        finally:
+            # Stops the decoder as well
+            detections.close()
+
+        # The remaining partial chunk is only used if it is long enough
+        rest = decoded - chunks * chunk_samples
+        if rest >= chunk_samples // 2:
+            try:
+                bpm, _ = bpm_detector(tail[-rest:], fs, verbose=False)
+                if bpm is not None and 60 <= bpm <= 200:
+                    bpms.append(bpm)
+            except Exception:
+                pass  # Skip chunks that can't be processed
+
+        row.update(duration=round(decoded / fs, 3), windows=len(bpms))
+        if not bpms:
+            row.update(status="no_bpm", error="BPM konnte nicht erkannt werden")
+        else:
+            # Median BPM for stability
+            row.update(status="ok", bpm=round(float(np.median(bpms)), 2))
+    except Exception as e:
+        row["error"] = f"Fehler bei der Verarbeitung: {str(e)}"
+    return row
+
+
+# Progress queue and cancel counter of the GUI, set in every worker process
+_progress_queue = None
+_cancel_generation = None
+
+
+def _init_worker(progress_queue, cancel_generation):
+    global _progress_queue, _cancel_generation
+    _progress_queue = progress_queue
+    _cancel_generation = cancel_generation
+
+    # Done now rather than during the first file, whose first BPM would
+    # otherwise take a second longer to appear
+    warm_up()
+
+
+def _worker_ready():
+    return os.getpid()
+
+
+def _analyse_queued(item, path, generation):
+    """
+    analyse_file for a Treeview item (runs in a worker process)
+
+    Progress goes to the GUI's queue as (item, fraction, provisional BPM);
+    the analysis stops once the GUI's cancel counter has moved past
+    generation.
+    """
+    return analyse_file(path, progress=lambda fraction, bpm: _progress_queue.put((item, fraction, bpm)),
+                        cancelled=lambda: _cancel_generation.value != generation)
+
+
+def sort_rows(rows, column, reverse=False):
+    """Rows ordered by a table column; rows without a value for it always come last"""
+    if column == "file":
+        key = lambda row: os.path.basename(row["path"]).lower()
+    elif column == "status":
+        key = lambda row: list(STATUS_TEXT).index(row["status"])
+    else:
+        key = lambda row: row[column]
+
+    present = [row for row in rows if column in ("file", "status") or row[column] is not None]
+    missing = [row for row in rows if not (column in ("file", "status") or row[column] is not None)]
+    return sorted(present, key=key, reverse=reverse) + missing
+
+
+def format_row(row):
+    """Treeview values of a result row"""
+    duration = row["duration"]
+    status = STATUS_TEXT[row["status"]]
+    if row["status"] == "error" and row["error"]:
+        status = row["error"]
+    bpm = "--"
+    if row["bpm"] is not None:
+        bpm = f"{row['bpm']:.2f}"
+    elif row["status"] == "running" and row.get("provisional") is not None:
+        # Provisional median of the chunks analysed so far
+        bpm = f"~{row['provisional']:.2f}"
+    if row["status"] == "running" and row.get("progress") is not None:
+        status = f"{status} {row['progress'] * 100:.0f} %"
+    return (
+        os.path.basename(row["path"]),
+        bpm,
+        f"{int(duration // 60)}:{int(duration % 60):02d}" if duration is not None else "--",
+        status,
+    )
+
 
 class BPMDetectorGUI:
-    def __init__(self, root):
+    def __init__(self, root, workers=None):
         self.root = root
         self.root.title("BPM Detector")
-        self.root.geometry("500x280")
-        self.root.resizable(False, False)
-        
+        self.root.geometry("760x480")
+        self.root.minsize(560, 360)
+
         # Configure style
         style = ttk.Style()
         style.theme_use('clam')
-        
+
         # Store last used directory
         self.last_directory = str(Path.home())
-        
+
+        # Leave one core to the UI and the decoder of the OS
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.executor = None
+
+        # Workers report (item, fraction, provisional BPM) through the queue
+        # and stop once the cancel counter no longer matches the one their
+        # file was submitted with
+        self.progress_queue = multiprocessing.Queue()
+        self.cancel_generation = multiprocessing.Value("i", 0)
+
+        # Result row of every Treeview item, files waiting for a worker and
+        # the futures of the files being analysed
+        self.rows = {}
+        self.pending = collections.deque()
+        self.running = {}
+        self.polling = False
+
+        # Progress of the current run: files added since the queue was last empty
+        self.run_total = 0
+        self.run_done = 0
+
+        self.sort_column = None
+        self.sort_reverse = False
+
         self.create_widgets()
-        self.selected_file = None
-        
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+        # Workers start in the background while the window is idle
+        self.root.after_idle(self._start_pool)
+
+    def _start_pool(self):
+        if self.executor is not None:
+            return
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker,
+            initargs=(self.progress_queue, self.cancel_generation))
+        # The pool starts one process per submitted task up to max_workers
+        for _ in range(self.workers):
+            self.executor.submit(_worker_ready)
+
     def create_widgets(self):
         # Main frame
         main_frame = ttk.Frame(self.root, padding="20")
         main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-        
+
         # Title
         title_label = ttk.Label(main_frame, text="BPM Detector", font=("Arial", 16, "bold"))
-        title_label.grid(row=0, column=0, columnspan=2, pady=(0, 20))
-        
-        # File selection frame
-        file_frame = ttk.LabelFrame(main_frame, text="Audio Datei auswählen", padding="10")
-        file_frame.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 15))
-        
-        # File path display
-        self.file_path_var = tk.StringVar()
-        self.file_path_var.set("Keine Datei ausgewählt")
-        self.file_path_label = ttk.Label(file_frame, textvariable=self.file_path_var, 
-                                       font=("Arial", 10), foreground="gray")
-        self.file_path_label.grid(row=0, column=0, sticky=(tk.W, tk.E), padx=(0, 10))
-        
-        # Browse button
-        self.browse_btn = ttk.Button(file_frame, text="Durchsuchen...", command=self.browse_file)
-        self.browse_btn.grid(row=0, column=1)
-        
-        # Results frame
-        results_frame = ttk.LabelFrame(main_frame, text="Ergebnisse", padding="10")
-        results_frame.grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S))
-        
-        # BPM display
-        bpm_frame = ttk.Frame(results_frame)
-        bpm_frame.grid(row=0, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
-        
+        title_label.grid(row=0, column=0, pady=(0, 15))
+
+        # Buttons to fill and control the queue
+        button_frame = ttk.Frame(main_frame)
+        button_frame.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
+
+        ttk.Button(button_frame, text="Dateien hinzufügen...", command=self.browse_files).pack(side=tk.LEFT)
+        ttk.Button(button_frame, text="Ordner hinzufügen...", command=self.browse_folder).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Button(button_frame, text="Entfernen", command=self.remove_selected).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Button(button_frame, text="Abbrechen", command=self.cancel).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Button(button_frame, text="CSV exportieren...", command=self.export_csv).pack(side=tk.RIGHT)
+
+        # Queue and results table
+        queue_frame = ttk.LabelFrame(main_frame, text="Warteschlange und Ergebnisse", padding="10")
+        queue_frame.grid(row=2, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+
+        self.tree = ttk.Treeview(queue_frame, columns=[key for key, _, _ in COLUMNS], show="headings",
+                                 selectmode="extended")
+        for key, heading, width in COLUMNS:
+            self.tree.heading(key, text=heading, command=lambda column=key: self.sort_by(column))
+            self.tree.column(key, width=width, anchor=tk.W if key in ("file", "status") else tk.E)
+        self.tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.tree.bind("<<TreeviewSelect>>", self._show_selected)
+
+        scrollbar = ttk.Scrollbar(queue_frame, orient=tk.VERTICAL, command=self.tree.yview)
+        scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.tree.configure(yscrollcommand=scrollbar.set)
+
+        if TKDND_AVAILABLE and hasattr(self.tree, "drop_target_register"):
+            from tkinterdnd2 import DND_FILES
+
+            self.tree.drop_target_register(DND_FILES)
+            self.tree.dnd_bind("<<Drop>>", self._on_drop)
+
+        # BPM display of the selected (or last finished) file
+        bpm_frame = ttk.Frame(main_frame)
+        bpm_frame.grid(row=3, column=0, sticky=(tk.W, tk.E), pady=(10, 0))
+
         ttk.Label(bpm_frame, text="Erkannte BPM:", font=("Arial", 12, "bold")).pack(side=tk.LEFT)
-        
+
         self.bpm_var = tk.StringVar()
         self.bpm_var.set("--")
-        self.bpm_label = ttk.Label(bpm_frame, textvariable=self.bpm_var, 
-                                  font=("Arial", 14, "bold"), foreground="blue")
+        self.bpm_label = ttk.Label(bpm_frame, textvariable=self.bpm_var,
+                                   font=("Arial", 14, "bold"), foreground="blue")
         self.bpm_label.pack(side=tk.LEFT, padx=(10, 0))
-        
-        # Progress bar
+
+        # Progress bar over all queued files
         self.progress_var = tk.DoubleVar()
-        self.progress_bar = ttk.Progressbar(results_frame, variable=self.progress_var, 
-                                          mode='indeterminate')
-        self.progress_bar.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(5, 0))
-        
+        self.progress_bar = ttk.Progressbar(main_frame, variable=self.progress_var, mode='determinate')
+        self.progress_bar.grid(row=4, column=0, sticky=(tk.W, tk.E), pady=(10, 0))
+
         # Status label
         self.status_var = tk.StringVar()
-        self.status_var.set("Bereit zur Verarbeitung")
-        self.status_label = ttk.Label(results_frame, textvariable=self.status_var, 
-                                    font=("Arial", 9), foreground="gray")
-        self.status_label.grid(row=2, column=0, sticky=(tk.W, tk.E), pady=(5, 0))
-        
+        if TKDND_AVAILABLE:
+            self.status_var.set("Dateien oder Ordner hinzufügen oder hierher ziehen")
+        else:
+            self.status_var.set("Dateien oder Ordner hinzufügen")
+        self.status_label = ttk.Label(main_frame, textvariable=self.status_var,
+                                      font=("Arial", 9), foreground="gray")
+        self.status_label.grid(row=5, column=0, sticky=(tk.W, tk.E), pady=(5, 0))
+
         # Configure grid weights
+        self.root.columnconfigure(0, weight=1)
+        self.root.rowconfigure(0, weight=1)
         main_frame.columnconfigure(0, weight=1)
-        file_frame.columnconfigure(0, weight=1)
-        results_frame.columnconfigure(0, weight=1)
-        
-        # Configure row weights for expansion
         main_frame.rowconfigure(2, weight=1)
-        
-    def browse_file(self):
-        """Open file dialog to select audio file"""
+        queue_frame.columnconfigure(0, weight=1)
+        queue_frame.rowconfigure(0, weight=1)
+
+    def browse_files(self):
+        """Open file dialog to add audio files to the queue"""
         file_types = [
             ("Audio Files", "*.wav *.mp3"),
             ("WAV Files", "*.wav"),
             ("MP3 Files", "*.mp3"),
             ("All Files", "*.*")
         ]
-        
-        filename = filedialog.askopenfilename(
-            title="Audio-Datei auswählen",
+
+        filenames = filedialog.askopenfilenames(
+            title="Audio-Dateien auswählen",
             filetypes=file_types,
             initialdir=self.last_directory
         )
-        
-        if filename:
+
+        if filenames:
             # Remember the directory for next time
-            self.last_directory = os.path.dirname(filename)
-            
-            self.selected_file = filename
-            file_name = os.path.basename(filename)
-            if len(file_name) > 30:
-                display_name = "..." + file_name[-27:]
-            else:
-                display_name = file_name
-            self.file_path_var.set(f"Ausgewählt: {display_name}")
-            self.status_var.set("Datei geladen. Starte automatische Analyse...")
-            
-            # Automatically start BPM analysis after file selection
-            self.root.after(500, self.process_file)
-            
-    def process_file(self):
-        """Process the selected audio file in a separate thread"""
-        if not self.selected_file:
-            messagebox.showerror("Fehler", "Bitte wählen Sie zuerst eine Audio-Datei aus.")
+            self.last_directory = os.path.dirname(filenames[0])
+            self.add_paths(filenames)
+
+    def browse_folder(self):
+        """Add every audio file below a folder to the queue"""
+        folder = filedialog.askdirectory(title="Ordner auswählen", initialdir=self.last_directory)
+        if folder:
+            self.last_directory = folder
+            self.add_paths([folder])
+
+    def _on_drop(self, event):
+        self.add_paths(self.root.tk.splitlist(event.data))
+
+    def add_paths(self, paths):
+        """Queue files (folders are scanned recursively) and start analysing them"""
+        queued = {row["path"] for row in self.rows.values() if row["status"] in ("queued", "running")}
+        files = []
+        for path in paths:
+            files.extend(find_audio_files(path) if os.path.isdir(path) else [path])
+        files = [path for path in dict.fromkeys(files) if path not in queued]
+        if not files:
+            self.status_var.set("Keine neuen Audio-Dateien gefunden")
             return
-            
-        # Start processing
-        self.progress_bar.start()
-        self.status_var.set("Analysiere BPM...")
-        
-        # Start processing in a separate thread
-        thread = threading.Thread(target=self._process_audio, daemon=True)
-        thread.start()
-        
-    def _process_audio(self):
-        """Process audio file in background thread"""
-        try:
-            # Read audio file
-            samps, fs = read_audio(self.selected_file)
-            
-            if samps is None or fs is None:
-                self.root.after(0, self._show_error, "Fehler beim Lesen der Audio-Datei")
-                return
-            
-            # Process audio for BPM detection
-            bpm, _ = self._detect_bpm_in_chunks(samps, fs)
-            
-            if bpm is None or bpm <= 0:
-                self.root.after(0, self._show_error, "BPM konnte nicht erkannt werden. Versuchen Sie eine andere Datei.")
-                return
-            
-            # Update UI in main thread with BPM rounded to 2 decimal places
-            self.root.after(0, self._show_result, round(bpm, 2))
-            
-        except Exception as e:
-            self.root.after(0, self._show_error, f"Fehler bei der Verarbeitung: {str(e)}")
-            
-    def _detect_bpm_in_chunks(self, samps, fs, chunk_duration=3.0):
-        """Detect BPM by processing audio in chunks"""
+
+        if not self.pending and not self.running:
+            self.run_total = self.run_done = 0
+        self.run_total += len(files)
+
+        for path in files:
+            row = {"path": path, "bpm": None, "duration": None, "windows": 0, "status": "queued", "error": None,
+                   "progress": None, "provisional": None}
+            item = self.tree.insert("", tk.END, values=format_row(row))
+            self.rows[item] = row
+            self.pending.append(item)
+
+        self._schedule()
+        self._update_progress()
+
+    def _schedule(self):
+        """Hand queued files to idle workers; at most one file per worker is in flight"""
+        while self.pending and len(self.running) < self.workers:
+            if self.executor is None:
+                self._start_pool()
+            item = self.pending.popleft()
+            future = self.executor.submit(_analyse_queued, item, self.rows[item]["path"],
+                                          self.cancel_generation.value)
+            self.running[future] = item
+            self._set_row(item, status="running", progress=0.0, provisional=None)
+
+        if self.running and not self.polling:
+            self.polling = True
+            self.root.after(POLL_MS, self._poll)
+
+    def _poll(self):
+        """Collect progress and finished analyses in the UI thread"""
+        updates = {}
+        while True:
+            try:
+                item, fraction, bpm = self.progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            updates[item] = (fraction, bpm)
+        for item, (fraction, bpm) in updates.items():
+            if item in self.rows and self.rows[item]["status"] == "running":
+                self._set_row(item, progress=fraction, provisional=bpm)
+                self._show_provisional(item)
+
+        pool_broken = False
+        for future in [future for future in self.running if future.done()]:
+            item = self.running.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                # A crashed worker breaks the whole pool; it is replaced below
+                pool_broken = pool_broken or isinstance(e, concurrent.futures.process.BrokenProcessPool)
+                result = {"status": "error", "error": f"Fehler bei der Verarbeitung: {str(e) or type(e).__name__}"}
+
+            if item in self.rows and self.rows[item]["status"] == "cancelled":
+                continue  # Already taken out of the run by cancel()
+            self.run_done += 1
+            if item in self.rows:  # Not removed while it was analysed
+                self._set_row(item, **{key: value for key, value in result.items() if key != "path"})
+                if result["status"] == "ok":
+                    self.bpm_var.set(f"{result['bpm']:.2f} BPM")
+
+        if pool_broken:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+            for future, item in list(self.running.items()):
+                self.running.pop(future)
+                if item in self.rows and self.rows[item]["status"] != "cancelled":
+                    self.pending.appendleft(item)
+                    self._set_row(item, status="queued", progress=None, provisional=None)
+
+        self.polling = False
+        self._schedule()
+        self._update_progress()
+
+    def _set_row(self, item, **changes):
+        self.rows[item].update(changes)
+        self.tree.item(item, values=format_row(self.rows[item]))
+
+    def _show_provisional(self, item):
+        """Show the provisional BPM of a running file if it is selected, or the only one running"""
+        selection = self.tree.selection()
+        if selection == (item,) or (not selection and len(self.running) == 1):
+            bpm = self.rows[item]["provisional"]
+            self.bpm_var.set(f"~{bpm:.2f} BPM (vorläufig)" if bpm is not None else "--")
+
+    def _update_progress(self):
+        # Files being analysed count with the fraction they have decoded
+        done = self.run_done + sum(self.rows[item].get("progress") or 0.0 for item in self.running.values()
+                                   if item in self.rows and self.rows[item]["status"] == "running")
+        percent = 100.0 * done / self.run_total if self.run_total else 0
+        self.progress_var.set(percent)
+        if self.pending or self.running:
+            self.status_var.set(f"Analysiere... {self.run_done} von {self.run_total} Dateien fertig ({percent:.0f} %)")
+        elif self.run_total:
+            self.status_var.set(f"Analyse abgeschlossen: {self.run_done} Dateien")
+
+    def cancel(self):
+        """Drop all waiting files and stop the running analyses after their current chunk"""
+        with self.cancel_generation.get_lock():
+            self.cancel_generation.value += 1
+
+        running = [item for item in self.running.values() if item in self.rows]
+        for item in list(self.pending) + running:
+            self._set_row(item, status="cancelled")
+        self.run_total -= len(self.pending) + len(running)
+        self.pending.clear()
+        self._update_progress()
+        # The workers' futures stay in self.running until they have stopped,
+        # so no new file is started on a busy worker
+        if running:
+            self.status_var.set("Analyse abgebrochen")
+
+    def remove_selected(self):
+        """Remove the selected files from the table (and from the queue)"""
+        for item in self.tree.selection():
+            if item in self.pending:
+                self.pending.remove(item)
+                self.run_total -= 1
+            self.tree.delete(item)
+            del self.rows[item]
+        self._update_progress()
+
+    def sort_by(self, column):
+        """Sort the table by a column; clicking it again reverses the order"""
+        self.sort_reverse = not self.sort_reverse if column == self.sort_column else False
+        self.sort_column = column
+
+        order = {id(row): item for item, row in self.rows.items()}
+        rows = sort_rows([self.rows[item] for item in self.tree.get_children()], column, self.sort_reverse)
+        for index, row in enumerate(rows):
+            self.tree.move(order[id(row)], "", index)
+
+        for key, heading, _ in COLUMNS:
+            arrow = (" ▼" if self.sort_reverse else " ▲") if key == column else ""
+            self.tree.heading(key, text=heading + arrow)
+
+    def export_csv(self):
+        """Write the finished results, in table order, to a CSV file"""
+        rows = [self.rows[item] for item in self.tree.get_children() if self.rows[item]["status"] in FINISHED]
+        if not rows:
+            messagebox.showinfo("Export", "Es gibt noch keine Ergebnisse zum Exportieren.")
+            return
+
+        filename = filedialog.asksaveasfilename(
+            title="Ergebnisse exportieren",
+            defaultextension=".csv",
+            filetypes=[("CSV Files", "*.csv"), ("All Files", "*.*")],
+            initialdir=self.last_directory,
+            initialfile="bpm_ergebnisse.csv"
+        )
+        if not filename:
+            return
+
         try:
-            chunk_samples = int(chunk_duration * fs)
-            bpms = []
-            
-            for start_idx in range(0, len(samps), chunk_samples):
-                chunk = samps[start_idx:start_idx + chunk_samples]
-                if len(chunk) < chunk_samples // 2:  # Skip too short chunks
-                    continue
-                    
-                try:
-                    # Use the existing BPM detector function with verbose=False for cleaner processing
-                    bpm, _ = bpm_detector(chunk, fs, verbose=False)
-                    if bpm is not None and 60 <= bpm <= 200:  # Reasonable BPM range
-                        bpms.append(bpm)
-                except:
-                    continue  # Skip chunks that can't be processed
-            
-            if not bpms:
-                return None, None
-                
-            # Return median BPM for stability
-            return np.median(bpms), None
-            
-        except Exception:
-            return None, None
-            
-    def _show_result(self, bpm):
-        """Display the BPM result without popup"""
-        self.progress_bar.stop()
-        self.bpm_var.set(f"{bpm:.2f} BPM")
-        self.status_var.set("Analyse abgeschlossen")
-        
-    def _show_error(self, message):
-        """Display error message"""
-        self.progress_bar.stop()
-        self.status_var.set("Fehler aufgetreten")
-        messagebox.showerror("Fehler", message)
+            with open(filename, "w", newline="", encoding="utf-8") as f:
+                writer = ResultWriter(f, "csv")
+                for row in rows:
+                    writer.write(row)
+        except OSError as e:
+            messagebox.showerror("Fehler", f"Export fehlgeschlagen: {str(e)}")
+            return
+        self.status_var.set(f"{len(rows)} Ergebnisse exportiert nach {os.path.basename(filename)}")
+
+    def _show_selected(self, event=None):
+        """Display the BPM of the selected file"""
+        selection = self.tree.selection()
+        if selection and self.rows[selection[0]]["status"] == "running":
+            self._show_provisional(selection[0])
+        elif selection:
+            bpm = self.rows[selection[0]]["bpm"]
+            self.bpm_var.set(f"{bpm:.2f} BPM" if bpm is not None else "--")
+
+    def close(self):
+        """Stop the workers (queued files are dropped) and close the window"""
+        self.pending.clear()
+        with self.cancel_generation.get_lock():
+            self.cancel_generation.value += 1
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.root.destroy()
 
 
 def main():
@@ -213,18 +559,25 @@ def main():
             windll.user32.ShowWindow(windll.kernel32.GetConsoleWindow(), 0)
         except:
             pass  # Ignore if not possible
-    
-    root = tk.Tk()
+
+    if TKDND_AVAILABLE:
+        from tkinterdnd2 import TkinterDnD
+
+        root = TkinterDnD.Tk()
+    else:
+        root = tk.Tk()
     app = BPMDetectorGUI(root)
-    
+
     # Center the window on screen
     root.update_idletasks()
     x = (root.winfo_screenwidth() // 2) - (root.winfo_width() // 2)
     y = (root.winfo_screenheight() // 2) - (root.winfo_height() // 2)
     root.geometry(f"+{x}+{y}")
-    
+
     root.mainloop()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Worker processes of the frozen exe must not start another GUI
+    multiprocessing.freeze_support()
+    main()
@@ -45,16 +45,20 @@ a = Analysis(
         'tkinter',
         'tkinter.ttk',
         'bpm_detection.bpm_detection',
+        'bpm_detection.profiling',
+        'bpm_detection.batch',
+        'bpm_detection.cache',
         'numpy',
         'scipy',
-        'PyWavelets',
-        'matplotlib',
+        'pywt',
+        'miniaudio',
         'pydub'
     ],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    # Plotting is only used by the command line --verbose mode
+    excludes=['matplotlib', 'bpm_detection.plotting'],
     win_no_prefer_redirects=False,
     win_private_assemblies=False,
     cipher=block_cipher,
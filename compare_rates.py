@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Accuracy vs. speed of analysing at a reduced internal sample rate
+
+Runs the windowed detector on synthetic click tracks at full rate and after
+resampling to lower internal rates, and prints for each rate the BPM error,
+the largest deviation from the full-rate result and the run time. Pass audio
+files to compare on real music instead; their full-rate result is then used
+as the reference.
+
+Usage:
+    python compare_rates.py [audio files...]
+"""
+
+import sys
+import time
+
+import numpy
+
+from bpm_detection.bpm_detection import detect_windows, read_audio, resample
+from synthetic import click_track
+
+RATES = [None, 22050, 16000, 11025, 8000]
+TEMPOS = [72, 90, 100, 120, 128, 140, 174]
+
+
+def median_bpm(samps, fs, rate):
+    """Median window BPM and seconds spent, including the resampling"""
+    start = time.perf_counter()
+    if rate and rate < fs:
+        samps, fs = resample(samps, fs, rate), rate
+    _, bpms = detect_windows(samps, fs)
+    elapsed = time.perf_counter() - start
+    return float(numpy.nanmedian(bpms)), elapsed
+
+
+def compare_rates(tracks):
+    """Table of mean/max BPM error, deviation from full rate and total time per rate"""
+    samps, fs, _ = tracks[0]
+    median_bpm(samps, fs, min(RATES[1:]))  # Warm-up, so imports are not timed
+
+    full = [median_bpm(samps, fs, None)[0] for samps, fs, _ in tracks]
+    expected = [bpm if bpm is not None else ref for (_, _, bpm), ref in zip(tracks, full)]
+
+    print(f"{'rate':>8} {'mean err':>9} {'max err':>8} {'max vs full':>12} {'time':>8} {'speed-up':>9}")
+    baseline = None
+    for rate in RATES:
+        bpms = []
+        total = 0.0
+        for samps, fs, _ in tracks:
+            bpm, elapsed = median_bpm(samps, fs, rate)
+            bpms.append(bpm)
+            total += elapsed
+
+        errors = numpy.abs(numpy.subtract(bpms, expected))
+        baseline = baseline or total
+        print(f"{rate or 'full':>8} {errors.mean():>9.3f} {errors.max():>8.3f} "
+              f"{numpy.abs(numpy.subtract(bpms, full)).max():>12.3f} {total:>7.2f}s {baseline / total:>8.1f}x")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        tracks = [read_audio(filename) + (None,) for filename in sys.argv[1:]]
+    else:
+        fs = 44100
+        tracks = [(click_track(bpm, 30, fs, seed=bpm), fs, bpm) for bpm in TEMPOS]
+    compare_rates(tracks)
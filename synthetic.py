@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Synthetic test audio with a known tempo
+
+Click tracks and a small PCM WAV writer, shared by the tests and by
+compare_rates.py. benchmark.py has its own, longer drum-pattern tracks that
+are written chunk by chunk.
+"""
+
+import wave
+
+import numpy
+
+
+def click_track(bpm, duration, fs=44100, seed=0):
+    """Noise bursts on every beat plus a little background noise"""
+    rng = numpy.random.default_rng(seed)
+    samps = 0.02 * rng.standard_normal(int(duration * fs))
+
+    burst_len = int(0.03 * fs)
+    decay = numpy.exp(-numpy.arange(burst_len) / (0.005 * fs))
+    for beat_time in numpy.arange(0, duration, 60.0 / bpm):
+        start = int(beat_time * fs)
+        burst = samps[start : start + burst_len]
+        burst += rng.standard_normal(len(burst)) * decay[: len(burst)]
+
+    return (samps / numpy.abs(samps).max() * 20000).astype(numpy.int16)
+
+
+def write_wav(filename, frames, fs, sampwidth):
+    """Write interleaved integer frames (shape: nframes x nchannels) as PCM WAV"""
+    frames = numpy.asarray(frames, dtype=numpy.int64)
+    if sampwidth == 1:
+        raw = (frames + 128).astype(numpy.uint8).tobytes()
+    elif sampwidth == 3:
+        raw = frames.astype("<i4").view(numpy.uint8).reshape(-1, 4)[:, :3].tobytes()
+    else:
+        raw = frames.astype(f"<i{sampwidth}").tobytes()
+
+    with wave.open(filename, "wb") as wf:
+        wf.setnchannels(frames.shape[1])
+        wf.setsampwidth(sampwidth)
+        wf.setframerate(fs)
+        wf.writeframes(raw)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Tests for reading WAV files into NumPy sample buffers
+"""
+
+import os
+import struct
+import tempfile
+
+import numpy
+
+from bpm_detection.bpm_detection import BLOCK_FRAMES, DECODERS, WavFile, read_audio, register_decoder, stream_audio
+from synthetic import write_wav
+
+
+def test_read_wav_sample_widths():
+    """Mono WAVs of every PCM width come back with their exact sample values"""
+    ramps = {
+        1: numpy.array([-128, -1, 0, 1, 127]),
+        2: numpy.array([-32768, -1, 0, 1, 32767]),
+        3: numpy.array([-8388608, -1, 0, 1, 8388607]),
+        4: numpy.array([-2147483648, -1, 0, 1, 2147483647]),
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for sampwidth, values in ramps.items():
+            filename = os.path.join(tmp, f"mono{sampwidth}.wav")
+            write_wav(filename, values[:, None], 22050, sampwidth)
+
+            samps, fs = read_audio(filename)
+            assert fs == 22050
+            assert isinstance(samps, numpy.ndarray)
+            assert samps.tolist() == values.tolist()
+
+
+def test_read_wav_stereo_downmix():
+    """Interleaved stereo is averaged to mono instead of read as double length"""
+    frames = numpy.array([[100, 300], [-200, -400], [0, 10]])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "stereo.wav")
+        write_wav(filename, frames, 44100, 2)
+
+        samps, fs = read_audio(filename)
+        assert fs == 44100
+        assert len(samps) == len(frames)
+        assert numpy.allclose(samps, [200, -300, 5])
+
+
+def test_read_rf64_float():
+    """RF64 headers with a ds64 chunk and IEEE float data are parsed"""
+    samples = numpy.array([[0.5, -0.5], [0.25, 0.75], [-1.0, 1.0]], dtype="<f4")
+    data = samples.tobytes()
+    fmt = struct.pack("<HHIIHH", 3, 2, 48000, 48000 * 8, 8, 32)
+    ds64 = struct.pack("<QQQI", 0xFFFFFFFF, len(data), len(samples), 0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "float.wav")
+        with open(filename, "wb") as f:
+            f.write(b"RF64" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE")
+            f.write(b"ds64" + struct.pack("<I", len(ds64)) + ds64)
+            f.write(b"fmt " + struct.pack("<I", len(fmt)) + fmt)
+            f.write(b"data" + struct.pack("<I", 0xFFFFFFFF) + data)
+
+        samps, fs = read_audio(filename)
+        assert fs == 48000
+        assert numpy.allclose(samps, [0.0, 0.5, 0.0])
+
+
+def test_lazy_wav_slicing():
+    """A lazily opened WAV decodes only the requested frame range"""
+    frames = numpy.arange(-500, 500).reshape(-1, 1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "lazy.wav")
+        write_wav(filename, frames, 8000, 2)
+
+        wav, fs = read_audio(filename, lazy=True)
+        assert isinstance(wav, WavFile)
+        assert fs == 8000
+        assert len(wav) == len(frames)
+        assert wav[100:110].tolist() == list(range(-400, -390))
+        assert len(wav[990:2000]) == 10
+        del wav
+
+
+def test_read_wav_section():
+    """Only the requested section is decoded, and "auto" skips the intro"""
+    fs = 100
+    frames = numpy.arange(200 * fs).reshape(-1, 1) % 30000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "long.wav")
+        write_wav(filename, frames, fs, 2)
+
+        samps, _ = read_audio(filename, start=10, duration=2)
+        assert samps.tolist() == frames[10 * fs : 12 * fs, 0].tolist()
+
+        blocks, _ = stream_audio(filename, block_frames=64, start=199)
+        assert numpy.concatenate(list(blocks)).tolist() == frames[199 * fs :, 0].tolist()
+
+        # 20% into the 200 s file, analysing the default 45 s
+        samps, _ = read_audio(filename, start="auto")
+        assert samps[0] == frames[40 * fs, 0]
+        assert len(samps) == 45 * fs
+
+
+def test_channel_modes():
+    """Each channel mode selects, averages or keeps the channels, for full, lazy and streamed reads"""
+    rng = numpy.random.default_rng(0)
+    frames = rng.integers(-30000, 30000, size=(3 * BLOCK_FRAMES + 5, 3))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "surround.wav")
+        write_wav(filename, frames, 8000, 2)
+
+        expected = {"mid": frames.mean(axis=1), "left": frames[:, 0], "right": frames[:, 1], "per-channel": frames}
+        for channels, values in expected.items():
+            samps, _ = read_audio(filename, channels=channels)
+            assert numpy.array_equal(samps, values.astype(numpy.float32))
+
+            wav, _ = read_audio(filename, lazy=True, channels=channels)
+            assert numpy.array_equal(wav[10 : 2 * BLOCK_FRAMES], samps[10 : 2 * BLOCK_FRAMES])
+            del wav
+
+            blocks, _ = stream_audio(filename, block_frames=1000, channels=channels)
+            assert numpy.array_equal(numpy.concatenate(list(blocks)), samps)
+
+        try:
+            read_audio(filename, channels="side")
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("unknown channel mode accepted")
+
+
+def test_decoder_fallback_and_selection():
+    """Failing backends fall through to the next one; a named backend is used alone"""
+    def broken(filename, *args, **section):
+        raise RuntimeError("cannot decode")
+
+    def working_read(filename, start=0, duration=None):
+        return numpy.ones(4, dtype=numpy.float32), 8000
+
+    def working_stream(filename, block_frames, start=0, duration=None):
+        return iter([numpy.ones(2, dtype=numpy.float32)] * 2), 8000
+
+    register_decoder("test-broken", [".fake"], broken, broken)
+    register_decoder("test-working", [".fake"], working_read, working_stream)
+    try:
+        samps, fs = read_audio("track.fake")
+        assert fs == 8000
+        assert samps.tolist() == [1, 1, 1, 1]
+
+        blocks, fs = stream_audio("track.fake")
+        assert sum(len(block) for block in blocks) == 4
+
+        assert read_audio("track.fake", backend="test-broken") == (None, None)
+        assert read_audio("track.fake", backend="no-such-backend") == (None, None)
+    finally:
+        del DECODERS["test-broken"]
+        del DECODERS["test-working"]
+
+
+if __name__ == "__main__":
+    test_read_wav_sample_widths()
+    test_read_wav_stereo_downmix()
+    test_read_rf64_float()
+    test_lazy_wav_slicing()
+    test_read_wav_section()
+    test_channel_modes()
+    test_decoder_fallback_and_selection()
+    print("All audio I/O tests passed")
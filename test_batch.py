@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Tests for batch library analysis and the persistent result cache
+"""
+
+import io
+import json
+import os
+import tempfile
+
+import numpy
+
+from bpm_detection.batch import ResultWriter, analyse_file, find_audio_files, run_batch
+from bpm_detection.bpm_detection import envelope_tempo_curve, tempo_curve
+from bpm_detection.cache import EnvelopeStore, ResultCache, analysis_params, envelope_params
+from bpm_detection.profiling import Profile
+from synthetic import click_track, write_wav
+
+
+def test_run_batch_rows_and_retries():
+    """Glob targets are matched, results are streamed as JSONL, and failing files end as error rows"""
+    fs = 22050
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, "a", "b"))
+        write_wav(os.path.join(tmp, "a", "b", "128.wav"), click_track(128, 9, fs)[:, None], fs, 2)
+        with open(os.path.join(tmp, "a", "broken.wav"), "wb") as f:
+            f.write(b"not audio")
+        with open(os.path.join(tmp, "a", "cover.jpg"), "wb") as f:
+            f.write(b"not audio either")
+
+        paths = find_audio_files(os.path.join(tmp, "**", "*.wav"))
+        assert [os.path.relpath(path, tmp) for path in paths] == [os.path.join("a", "b", "128.wav"),
+                                                                  os.path.join("a", "broken.wav")]
+
+        out = io.StringIO()
+        seen = []
+        stats = run_batch(paths, ResultWriter(out, "jsonl"), workers=2, retries=2,
+                          progress=lambda stats: seen.append(stats.done))
+        assert (stats.done, stats.failed, seen) == (2, 1, [1, 2])
+
+        rows = {os.path.basename(row["path"]): row for row in map(json.loads, out.getvalue().splitlines())}
+        assert list(rows["128.wav"]) == ["path", "bpm", "confidence", "duration", "windows", "status", "error"]
+        assert rows["128.wav"]["status"] == "ok" and abs(rows["128.wav"]["bpm"] - 128) < 1
+        assert rows["128.wav"]["windows"] == 3 and rows["128.wav"]["duration"] == 9.0
+        assert rows["broken.wav"]["status"] == "error" and rows["broken.wav"]["bpm"] is None
+        assert "broken.wav" in rows["broken.wav"]["error"]
+
+        # With a cache, a missing file is an error row like any other failure
+        out = io.StringIO()
+        missing = os.path.join(tmp, "a", "gone.wav")
+        stats = run_batch(paths[:1] + [missing], ResultWriter(out, "jsonl"), workers=1, cache=ResultCache(":memory:"))
+        assert (stats.done, stats.failed) == (2, 1)
+        rows = {row["path"]: row for row in map(json.loads, out.getvalue().splitlines())}
+        assert rows[missing]["status"] == "error" and rows[paths[0]]["status"] == "ok"
+
+
+def test_cache_hit_and_invalidation():
+    """Results are found again until the file content changes"""
+    params = analysis_params(window=3)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "track.wav")
+        with open(filename, "wb") as f:
+            f.write(b"first version")
+
+        with ResultCache(os.path.join(tmp, "cache.sqlite")) as cache:
+            assert cache.get(filename, params) is None
+            cache.put(filename, params, {"bpm": 120.0})
+            assert cache.get(filename, params) == {"bpm": 120.0}
+            assert cache.get(filename, analysis_params(window=5)) is None
+
+        with ResultCache(os.path.join(tmp, "cache.sqlite")) as cache:
+            assert cache.get(filename, params) == {"bpm": 120.0}
+
+            with open(filename, "wb") as f:
+                f.write(b"second version, longer")
+            assert cache.get(filename, params) is None
+
+
+def test_cache_lru_eviction():
+    """Only the most recently used entries survive beyond max_entries"""
+    params = analysis_params()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filenames = []
+        for i in range(3):
+            filenames.append(os.path.join(tmp, f"{i}.wav"))
+            with open(filenames[-1], "wb") as f:
+                f.write(b"track %d" % i)
+
+        with ResultCache(":memory:", max_entries=2) as cache:
+            for filename in filenames:
+                cache.put(filename, params, {"bpm": 100.0})
+            cache.get(filenames[0], params)
+            cache.evict()
+
+            assert len(cache) == 2
+            assert cache.get(filenames[0], params) is not None
+            assert cache.get(filenames[1], params) is None
+
+
+def test_run_batch_with_cache():
+    """A second scan answers every file from the cache"""
+    fs = 22050
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, "crate"))
+        for bpm in (100, 128):
+            write_wav(os.path.join(tmp, "crate", f"{bpm}.wav"), click_track(bpm, 9, fs)[:, None], fs, 2)
+        with open(os.path.join(tmp, "notes.txt"), "w") as f:
+            f.write("not audio")
+
+        paths = find_audio_files(tmp)
+        assert [os.path.basename(path) for path in paths] == ["100.wav", "128.wav"]
+
+        with ResultCache(os.path.join(tmp, "cache.sqlite")) as cache:
+            for expected_cached in (0, 2):
+                out = io.StringIO()
+                stats = run_batch(paths, ResultWriter(out, "csv"), workers=1, cache=cache)
+                assert stats.done == 2
+                assert stats.failed == 0
+                assert stats.cached == expected_cached
+
+                rows = out.getvalue().splitlines()[1:]
+                bpms = sorted(float(row.split(",")[1]) for row in rows)
+                assert abs(bpms[0] - 100) < 1
+                assert abs(bpms[1] - 128) < 1
+
+
+def test_envelope_store_reanalysis():
+    """Stored float16 envelopes give the tempo of a fresh analysis, and new tempo settings skip decoding"""
+    fs = 22050
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "track.wav")
+        write_wav(filename, click_track(128, 12, fs)[:, None], fs, 2)
+        store = EnvelopeStore(os.path.join(tmp, "envelopes"))
+
+        envelope, env_fs, offset = store.envelope(filename)
+        assert store.get(filename, envelope_params()) is not None
+        assert store.get(filename, envelope_params(rate=11025)) is None
+
+        profile = Profile()
+        stored, stored_fs, _ = store.envelope(filename, profile=profile)
+        assert stored.dtype == numpy.float16
+        assert isinstance(stored, numpy.memmap)
+        assert "decode" not in profile.stages
+        assert stored_fs == env_fs == fs
+        assert numpy.array_equal(envelope_tempo_curve(stored, fs, 3, 3)[1], tempo_curve(filename, 3, 3)[1])
+
+        # Another octave rule and window on the same envelope
+        _, bpms = envelope_tempo_curve(stored, fs, 6, 2, octave_range=(50, 120))
+        assert len(bpms) == 4 and all(abs(bpm - 64) < 1 for bpm in bpms)
+
+        # Tempo ranges are real tempos, also without octave correction
+        slow = os.path.join(tmp, "slow.wav")
+        write_wav(slow, click_track(90, 12, fs)[:, None], fs, 2)
+        envelope, _, _ = store.envelope(slow)
+        for bpm_range in ((40, 200), (60, 180), (80, 100)):
+            _, bpms = envelope_tempo_curve(envelope, fs, 6, 2, bpm_range=bpm_range, octave_range=None)
+            assert all(abs(bpm - 90) < 1 for bpm in bpms)
+
+        row = analyse_file(filename, envelope_cache=store.directory)
+        assert abs(row["bpm"] - 128) < 1 and row["windows"] == 3
+
+        # A changed file is analysed again
+        write_wav(filename, click_track(100, 12, fs)[:, None], fs, 2)
+        assert store.get(filename, envelope_params()) is None
+        assert abs(analyse_file(filename, envelope_cache=store.directory)["bpm"] - 100) < 1
+
+        store.max_bytes = 0
+        store.evict()
+        assert store.get(filename, envelope_params()) is None
+
+
+if __name__ == "__main__":
+    test_run_batch_rows_and_retries()
+    test_cache_hit_and_invalidation()
+    test_cache_lru_eviction()
+    test_run_batch_with_cache()
+    test_envelope_store_reanalysis()
+    print("All batch tests passed")
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Tests for the benchmark harness on a short synthetic track
+"""
+
+import copy
+import os
+import tempfile
+
+from benchmark import STAGES, compare, run_case, write_track
+from bpm_detection.bpm_detection import read_audio
+
+
+def test_run_case():
+    """A generated track has the requested format and its tempo is found, with every stage timed"""
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "drum.wav")
+        write_track(filename, "drum", 120, 12, 22050, 24)
+
+        samps, fs = read_audio(filename)
+        assert fs == 22050
+        assert len(samps) == 12 * 22050
+
+        case = run_case(filename, "drum", 120, 12, 22050, 24)
+        assert case["ok"]
+        assert set(case["stages_s"]) == set(STAGES)
+        assert all(seconds > 0 for seconds in case["stages_s"].values())
+        assert case["peak_mb"] > 0
+
+
+def test_compare_flags_regressions():
+    """Slower runs and newly wrong tempos are reported, unchanged runs are not"""
+    case = {"name": "drum", "bpm": 120, "total_s": 1.0, "peak_mb": 10.0, "error_bpm": 0.1,
+            "detected_bpm": 120.1, "ok": True, "stages_s": dict.fromkeys(STAGES, 0.1)}
+    baseline = {"cases": [case]}
+    assert compare(baseline, baseline)[1] == []
+
+    current = copy.deepcopy(baseline)
+    current["cases"][0].update(total_s=1.5, detected_bpm=180.0, error_bpm=60.0, ok=False)
+    current["cases"][0]["stages_s"]["acf"] = 0.6
+    regressions = compare(baseline, current, tolerance=0.1)[1]
+    assert len(regressions) == 2
+    assert "mostly acf" in regressions[0]
+
+    # A float32 run that is still within tolerance of the truth but drifted from the float64 baseline
+    current = copy.deepcopy(baseline)
+    current["meta"] = {"precision": "float32"}
+    current["cases"][0].update(detected_bpm=120.3, error_bpm=0.3)
+    regressions = compare(baseline, current)[1]
+    assert regressions == ["drum: detected 120.3 instead of 120.1 BPM of the baseline"]
+
+
+if __name__ == "__main__":
+    test_run_case()
+    test_compare_flags_regressions()
+    print("All benchmark tests passed")
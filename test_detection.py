@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Tests for BPM detection on synthetic click tracks with a known tempo
+"""
+
+import json
+import os
+import tempfile
+
+import numpy
+
+from bpm_detection.bpm_detection import (RESAMPLE_HALF_LEN, BPMDetector, WaveletEnvelope, autocorrelate, bpm_detector,
+                                         bpm_detector_batch, detect_adaptive, iter_windows, peak_detect, read_audio,
+                                         resample_blocks, detect_windows, tempo_confidence, tempo_curve,
+                                         trim_initial_silence, write_tempo_curve)
+from bpm_detection.profiling import Profile
+from synthetic import click_track, write_wav
+
+
+def test_iter_windows_overlapping_hop():
+    """Overlapping windows are yielded with their start times and the right tempo"""
+    fs = 22050
+    samps = click_track(128, 12, fs)
+
+    results = list(iter_windows(samps, window_s=4, hop_s=2, fs=fs, verbose=False))
+
+    assert [start for start, _, _ in results] == [0.0, 2.0, 4.0, 6.0, 8.0]
+    for _, bpm, _ in results:
+        assert abs(bpm - 128) < 1
+
+
+def test_batch_matches_scalar():
+    """The vectorized batch path gives the scalar BPM for every window"""
+    fs = 22050
+    samps = click_track(100, 15, fs).astype(numpy.float64)
+    samps[: fs // 2] = 0  # Leading silence gets trimmed from the first window
+    samps[6 * fs : 9 * fs] = 0  # A fully silent window has no BPM
+    windows = samps.reshape(-1, 3 * fs)
+
+    bpms = bpm_detector_batch(windows, fs)
+
+    for window, bpm in zip(windows, bpms):
+        expected, _ = bpm_detector(window, fs, verbose=False)
+        if expected is None:
+            assert numpy.isnan(bpm)
+        else:
+            assert numpy.isclose(bpm, expected)
+
+
+def test_autocorrelate_matches_numpy():
+    """Both autocorrelation strategies agree with numpy.correlate on the wanted lags"""
+    rng = numpy.random.default_rng(1)
+    signals = rng.standard_normal((3, 500))
+    expected = numpy.array([numpy.correlate(x, x, "full")[len(x) - 1 :] for x in signals])
+
+    # A wide lag range is cheaper by FFT, a narrow one by direct dot products
+    for min_lag, max_lag in ((20, 300), (2, 5)):
+        correl = autocorrelate(signals, max_lag, min_lag)
+        assert correl.shape == (3, max_lag)
+        assert numpy.allclose(correl[:, min_lag:], expected[:, min_lag:max_lag])
+
+        correl = autocorrelate(signals[0], max_lag, min_lag)
+        assert numpy.allclose(correl[min_lag:], expected[0, min_lag:max_lag])
+
+
+def test_resample_blocks_matches_resample_poly():
+    """Streaming resampling gives the whole-signal result, and the tempo survives it"""
+    from scipy import signal
+
+    fs = 44100
+    samps = click_track(128, 12, fs).astype(numpy.float32)
+    fir = signal.firwin(2 * RESAMPLE_HALF_LEN * 4 + 1, 0.25, window=("kaiser", 5.0)).astype(numpy.float32)
+    expected = signal.resample_poly(samps, 1, 4, window=fir)
+
+    for block_frames in (1000, 65536):
+        blocks = (samps[pos : pos + block_frames] for pos in range(0, len(samps), block_frames))
+        resampled = numpy.concatenate(list(resample_blocks(blocks, fs, 11025)))
+        assert len(resampled) == len(expected)
+        assert numpy.allclose(resampled, expected, atol=1e-5)
+
+    results = list(iter_windows(samps, window_s=4, fs=fs, rate=11025))
+    assert len(results) == 3
+    for _, bpm, _ in results:
+        assert abs(bpm - 128) < 1
+
+
+def test_trim_silence_offset_and_trailing():
+    """Leading (and optionally trailing) silence is cut, keeping half the minimum silence as margin"""
+    fs = 1000
+    data = numpy.zeros(3000)
+    data[1000:2000] = numpy.sin(numpy.arange(1000))
+    data[1000] = 1.0
+
+    trimmed, offset = trim_initial_silence(data, fs, return_offset=True)
+    assert offset == 950
+    assert len(trimmed) == 2050
+
+    trimmed, offset = trim_initial_silence(data, fs, trailing=True, return_offset=True)
+    assert offset == 950
+    assert trimmed[0] == data[950]
+    assert len(trimmed) == numpy.flatnonzero(numpy.abs(data) > 0.01)[-1] + 51 - 950
+
+    silent = numpy.zeros(500)
+    assert len(trim_initial_silence(silent, fs, trailing=True)) == 500
+
+
+def test_full_scale_negative_samples():
+    """-32768 counts as the loudest int16 sample, although its abs() wraps around in int16"""
+    fs = 1000
+    data = numpy.zeros(3000, dtype=numpy.int16)
+    data[1000] = -32768
+    data[2000] = 100
+
+    assert trim_initial_silence(data, fs, return_offset=True)[1] == 950
+    frames = numpy.stack((numpy.zeros_like(data), data), axis=1)
+    assert trim_initial_silence(frames, fs, return_offset=True)[1] == 950
+    assert peak_detect(data)[0].tolist() == [1000]
+
+
+def test_tempo_curve_follows_tempo_change():
+    """The curve from the shared envelope shows a mix going from 100 to 128 BPM"""
+    fs = 22050
+    samps = numpy.concatenate((click_track(100, 20, fs, seed=1), click_track(128, 20, fs, seed=2)))
+
+    times, bpms = tempo_curve(samps, window_s=6, hop_s=2, fs=fs)
+
+    assert times.tolist() == list(range(0, 35, 2))
+    assert all(abs(bpm - 100) < 1 for time, bpm in zip(times, bpms) if time + 6 <= 20)
+    assert all(abs(bpm - 128) < 1 for time, bpm in zip(times, bpms) if time >= 20)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        write_tempo_curve(os.path.join(tmp, "curve.json"), times, bpms)
+        with open(os.path.join(tmp, "curve.json")) as f:
+            assert [row["time"] for row in json.load(f)] == times.tolist()
+
+        write_tempo_curve(os.path.join(tmp, "curve.npy"), times, bpms)
+        assert numpy.load(os.path.join(tmp, "curve.npy")).shape == (len(times), 2)
+
+
+def test_lazy_wav_source():
+    """A stereo WavFile is analysed like the file it was opened from"""
+    fs = 22050
+    samps = click_track(128, 9, fs)
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "stereo.wav")
+        write_wav(filename, numpy.column_stack((samps, samps * 0.5)), fs, 2)
+        wav, _ = read_audio(filename, lazy=True)
+
+        windows = [(time, bpm) for time, bpm, _ in iter_windows(filename)]
+        assert [(time, bpm) for time, bpm, _ in iter_windows(wav, fs=fs)] == windows
+        assert len(windows) == 3 and abs(windows[0][1] - 128) < 1.5
+        assert numpy.array_equal(tempo_curve(wav, fs=fs)[1], tempo_curve(filename)[1], equal_nan=True)
+        assert detect_adaptive(wav, fs=fs) == detect_adaptive(filename)
+
+
+def test_detector_object_matches_bpm_detector():
+    """Reused buffers give exactly the BPM and correlation of a fresh bpm_detector call, window after window"""
+    fs = 22050
+    samps = click_track(100, 12, fs)
+    samps[: fs // 3] = 0
+    detector = BPMDetector(fs, window=3)
+
+    # Regular, longer than planned, too short, silent, and a float32 window
+    windows = [samps[:3 * fs], samps[3 * fs : 6 * fs], samps, samps[:500], numpy.zeros(3 * fs),
+               samps[6 * fs : 9 * fs].astype(numpy.float32)]
+    for window in windows:
+        expected, correl = bpm_detector(window, fs, verbose=False)
+        bpm = detector.detect(window)
+        assert bpm == expected
+        if bpm is not None:
+            assert numpy.array_equal(detector.correl, correl)
+
+    # A float sample rate, as from a resampling ratio, gives the same BPM
+    assert BPMDetector(float(fs), window=3).detect(samps[:3 * fs]) == detector.detect(samps[:3 * fs])
+
+
+def unsmoothed_sum(data):
+    """The envelope sum of ALGORITHM_VERSION 1, with its per-band lfilter, abs and mean passes"""
+    import pywt
+    from scipy import signal
+
+    cA = numpy.asarray(data, dtype=numpy.float64)
+    for loop in range(4):
+        cA, cD = pywt.dwt(cA, "db4")
+        if loop == 0:
+            cD_sum = numpy.zeros(int(len(cD) / 8 + 1))
+        cD = abs(signal.lfilter([0.01], [1 - 0.99], cD)[:: 2 ** (3 - loop)])
+        cD_sum[: len(cD)] += (cD - numpy.mean(cD))[: len(cD_sum)]
+    cA = abs(signal.lfilter([0.01], [1 - 0.99], cA))
+    cD_sum[: len(cA)] += (cA - numpy.mean(cA))[: len(cD_sum)]
+    return cD_sum
+
+
+def test_envelope_smoothing():
+    """alpha=0 reproduces the version 1 envelope bit for bit; smoothing keeps the tempo and streams identically"""
+    fs = 22050
+    samps = click_track(128, 9, fs).astype(numpy.float64)
+
+    min_lag, max_lag = int(60.0 / 200 * fs / 8), int(60.0 / 40 * fs / 8)
+    _, correl = bpm_detector(samps, fs, verbose=False, alpha=0)
+    assert numpy.array_equal(correl, autocorrelate(unsmoothed_sum(samps), max_lag, min_lag))
+
+    bpm, _ = bpm_detector(samps, fs, verbose=False)
+    assert abs(bpm - 128) < 1
+    assert numpy.allclose(bpm_detector_batch(samps.reshape(3, -1), fs, alpha=0.99),
+                          [BPMDetector(fs, 3, alpha=0.99).detect(window) for window in samps.reshape(3, -1)])
+
+    # The smoothing state carries over between blocks like the wavelet filter state
+    whole = WaveletEnvelope().process(samps)
+    envelope = WaveletEnvelope()
+    blocks = numpy.concatenate([envelope.process(samps[pos : pos + 1000]) for pos in range(0, len(samps), 1000)])
+    assert numpy.allclose(blocks, whole[: len(blocks)])
+
+
+def test_per_channel_analysis():
+    """Out-of-phase channels cancel in the mid mix but keep their tempo when analysed separately"""
+    fs = 22050
+    left = click_track(128, 9, fs).astype(numpy.float32)
+    frames = numpy.stack((left, -left), axis=1)
+
+    assert list(iter_windows(frames, fs=fs)) == []
+    results = list(iter_windows(frames, fs=fs, channels="per-channel"))
+    assert len(results) == 3
+    for _, bpm, _ in results:
+        assert abs(bpm - 128) < 1
+
+    # The vectorized path sums the channel envelopes the same way
+    detector = BPMDetector(fs, window=3)
+    windows = frames.reshape(3, 3 * fs, 2)
+    assert numpy.allclose(bpm_detector_batch(windows, fs), [detector.detect(window) for window in windows])
+
+    times, bpms = tempo_curve(frames, window_s=3, hop_s=3, fs=fs, channels="per-channel")
+    assert len(times) == 3 and all(abs(bpm - 128) < 1 for bpm in bpms)
+
+
+def test_confidence_and_early_stop():
+    """A steady beat stops the analysis after a few windows; noise is analysed to the end with low confidence"""
+    fs = 22050
+    samps = click_track(128, 60, fs)
+
+    profile = Profile()
+    result = detect_adaptive(samps, fs=fs, profile=profile)
+    assert abs(result.bpm - 128) < 1
+    assert result.confidence > 0.7
+    assert (result.windows, result.seconds) == (3, 9)
+    assert profile.stages["decode"]["samples"] < len(samps) / 4
+
+    noise = numpy.random.default_rng(0).standard_normal(30 * fs)
+    result = detect_adaptive(noise, fs=fs)
+    assert result.windows == 10
+    assert result.confidence < 0.5
+
+    # Agreement: two of four windows near the median, with a peak 4x the typical lag
+    bpm, confidence = tempo_confidence([120, 120.5, 90, numpy.nan], [4, 4, 10, numpy.nan])
+    assert bpm == 120
+    assert numpy.isclose(confidence, 0.5 * 0.75)
+    assert tempo_confidence([numpy.nan], [numpy.nan]) == (None, 0.0)
+
+    # The vectorized path measures the same peaks
+    windows = samps[: 9 * fs].reshape(3, -1)
+    detector = BPMDetector(fs, window=3)
+    _, ratios = bpm_detector_batch(windows, fs, return_peak_ratios=True)
+    for window, ratio in zip(windows, ratios):
+        detector.detect(window)
+        assert numpy.isclose(ratio, detector.peak_ratio)
+
+
+def test_float32_matches_float64():
+    """The float32 signal path stays in float32 and finds the float64 tempo on every path"""
+    fs = 22050
+    samps = numpy.concatenate((click_track(100, 12, fs, seed=1), click_track(137, 12, fs, seed=2)))
+
+    for alpha in (0, 0.99):
+        bpm64, correl64 = bpm_detector(samps[: 12 * fs], fs, verbose=False, alpha=alpha)
+        bpm32, correl32 = bpm_detector(samps[: 12 * fs], fs, verbose=False, alpha=alpha, dtype=numpy.float32)
+        assert correl32.dtype == numpy.float32
+        assert bpm32 == bpm64
+        assert numpy.allclose(correl32, correl64, rtol=1e-3, atol=1e-4 * abs(correl64).max())
+
+    _, bpms64 = detect_windows(samps, fs)
+    _, bpms32 = detect_windows(samps, fs, dtype="float32")
+    assert numpy.array_equal(bpms32, bpms64)
+    assert [bpm for _, bpm, _ in iter_windows(samps, fs=fs, dtype="float32")] == bpms64.tolist()
+
+    assert numpy.array_equal(tempo_curve(samps, 6, 2, fs=fs, dtype="float32")[1], tempo_curve(samps, 6, 2, fs=fs)[1])
+    assert WaveletEnvelope(dtype="float32").process(samps[:5000]).dtype == numpy.float32
+
+    try:
+        BPMDetector(fs, dtype="float16")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("unsupported precision accepted")
+
+
+if __name__ == "__main__":
+    test_iter_windows_overlapping_hop()
+    test_batch_matches_scalar()
+    test_autocorrelate_matches_numpy()
+    test_resample_blocks_matches_resample_poly()
+    test_trim_silence_offset_and_trailing()
+    test_full_scale_negative_samples()
+    test_tempo_curve_follows_tempo_change()
+    test_lazy_wav_source()
+    test_detector_object_matches_bpm_detector()
+    test_envelope_smoothing()
+    test_per_channel_analysis()
+    test_confidence_and_early_stop()
+    test_float32_matches_float64()
+    print("All detection tests passed")
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Tests for the GUI's file queue that do not need a display
+"""
+
+import os
+import tempfile
+
+from bpm_gui import analyse_file, format_row, sort_rows
+from synthetic import click_track, write_wav
+
+
+def test_analyse_file_rows():
+    """Worker results are batch-style rows, with errors reported instead of raised"""
+    fs = 22050
+    with tempfile.TemporaryDirectory() as tmp:
+        good = os.path.join(tmp, "good.wav")
+        write_wav(good, click_track(128, 8, fs)[:, None], fs, 2)
+        bad = os.path.join(tmp, "bad.wav")
+        with open(bad, "wb") as f:
+            f.write(b"not audio")
+
+        row = analyse_file(good)
+        assert row["status"] == "ok"
+        assert abs(row["bpm"] - 128) < 1
+        assert row["duration"] == 8.0
+        assert row["windows"] == 3  # Two full chunks plus the tail
+
+        row = analyse_file(bad)
+        assert row["status"] == "error"
+        assert row["bpm"] is None and row["error"]
+
+
+def test_progress_and_cancel():
+    """Progress follows the decode position with a provisional BPM; cancelling stops the decoding"""
+    fs = 22050
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "long.wav")
+        write_wav(path, click_track(128, 30, fs)[:, None], fs, 2)
+
+        updates = []
+        row = analyse_file(path, progress=lambda fraction, bpm: updates.append((fraction, bpm)))
+        assert len(updates) == 10
+        assert [fraction for fraction, _ in updates] == sorted(fraction for fraction, _ in updates)
+        assert updates[-1][0] == 1.0
+        assert updates[1][1] is None and abs(updates[2][1] - 128) < 1
+        assert round(updates[-1][1], 2) == row["bpm"]
+
+        updates = []
+        row = analyse_file(path, progress=lambda fraction, bpm: updates.append(fraction),
+                           cancelled=lambda: len(updates) >= 2)
+        assert row["status"] == "cancelled" and row["bpm"] is None
+        assert len(updates) == 2
+
+
+def test_sort_rows_and_format():
+    """Sorting keeps rows without a value last in both directions"""
+    rows = [{"path": "/music/b.mp3", "bpm": 128.0, "duration": 200.0, "windows": 60, "status": "ok", "error": None},
+            {"path": "/music/A.wav", "bpm": None, "duration": None, "windows": 0, "status": "queued", "error": None},
+            {"path": "/music/c.wav", "bpm": 95.5, "duration": 61.0, "windows": 20, "status": "ok", "error": None}]
+
+    assert [row["bpm"] for row in sort_rows(rows, "bpm")] == [95.5, 128.0, None]
+    assert [row["bpm"] for row in sort_rows(rows, "bpm", reverse=True)] == [128.0, 95.5, None]
+    assert [row["path"] for row in sort_rows(rows, "file")] == ["/music/A.wav", "/music/b.mp3", "/music/c.wav"]
+    assert sort_rows(rows, "status")[0]["status"] == "queued"
+
+    assert format_row(rows[0]) == ("b.mp3", "128.00", "3:20", "Fertig")
+    assert format_row(rows[1]) == ("A.wav", "--", "--", "Wartend")
+
+    running = dict(rows[1], status="running", progress=0.25, provisional=127.96)
+    assert format_row(running) == ("A.wav", "~127.96", "--", "Analysiere... 25 %")
+
+
+if __name__ == "__main__":
+    test_analyse_file_rows()
+    test_progress_and_cancel()
+    test_sort_rows_and_format()
+    print("All GUI queue tests passed")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Tests for real-time BPM tracking of audio fed block by block
+"""
+
+import io
+
+import numpy
+
+from bpm_detection.bpm_detection import bpm_detector
+from bpm_detection.live import StreamingBPMTracker, iter_pcm_blocks
+from synthetic import click_track
+
+
+def test_tracker_follows_tempo():
+    """An estimate is emitted every hop and agrees with bpm_detector on the same window"""
+    fs = 22050
+    samps = click_track(128, 20, fs)
+    tracker = StreamingBPMTracker(fs, window_s=8, hop_s=2)
+
+    estimates = []
+    for pos in range(0, len(samps), 1024):
+        estimate = tracker.feed(samps[pos : pos + 1024])
+        if estimate is not None:
+            estimates.append(estimate)
+
+    assert len(estimates) == 10
+    assert all(abs(estimate.bpm - 128) < 1 for estimate in estimates)
+    assert abs(estimates[-1].time - 20) < 0.1
+
+    expected, _ = bpm_detector(samps[-8 * fs :], fs, verbose=False)
+    assert abs(estimates[-1].bpm - expected) < 0.5
+
+
+def test_tracker_block_size_independent():
+    """The envelope does not depend on how the stream is cut into blocks"""
+    fs = 8000
+    samps = click_track(100, 6, fs).astype(numpy.float64)
+
+    envelopes = []
+    for block_frames in (333, 4096):
+        tracker = StreamingBPMTracker(fs, window_s=10)
+        for pos in range(0, len(samps), block_frames):
+            tracker.feed(samps[pos : pos + block_frames])
+        envelopes.append(tracker._window())
+
+    size = min(len(envelope) for envelope in envelopes)
+    assert size > 0
+    assert numpy.allclose(envelopes[0][:size], envelopes[1][:size])
+
+
+def test_tracker_silence_and_pcm_blocks():
+    """Silence gives estimates without a BPM; raw PCM is split into whole frames"""
+    tracker = StreamingBPMTracker(8000, window_s=4, hop_s=1)
+    estimate = tracker.feed(numpy.zeros(8000))
+    assert estimate.time == 1.0
+    assert estimate.bpm is None
+
+    raw = numpy.array([[100, 300], [-200, -400], [0, 10]], dtype="<i2").tobytes()
+    blocks = list(iter_pcm_blocks(io.BytesIO(raw), 2, channels=2, sampwidth=2))
+    assert [block.tolist() for block in blocks] == [[200, -300], [5]]
+
+
+if __name__ == "__main__":
+    test_tracker_follows_tempo()
+    test_tracker_block_size_independent()
+    test_tracker_silence_and_pcm_blocks()
+    print("All live tracking tests passed")
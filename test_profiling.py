@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Tests for the opt-in per-stage profiling
+"""
+
+import io
+import os
+import tempfile
+import time
+
+from bpm_detection.batch import ResultWriter, run_batch
+from bpm_detection.bpm_detection import bpm_detector, iter_windows
+from bpm_detection.profiling import Profile
+from synthetic import click_track, write_wav
+
+
+def test_stages_recorded_without_changing_results():
+    """Every stage of the analysis shows up, and the BPMs are the same as without a profile"""
+    fs = 22050
+    samps = click_track(120, 9, fs)
+
+    profile = Profile()
+    profiled = [bpm for _, bpm, _ in iter_windows(samps, fs=fs, profile=profile)]
+    assert profiled == [bpm for _, bpm, _ in iter_windows(samps, fs=fs)]
+
+    assert list(profile.stages) == ["decode", "trim", "dwt", "filter", "acf", "peak"]
+    assert profile.stages["trim"]["calls"] == 3
+    assert profile.stages["dwt"]["calls"] == 12
+    assert profile.stages["decode"]["samples"] == len(samps)
+
+    profile = Profile(trace_allocations=True)
+    bpm_detector(samps, fs, verbose=False, profile=profile)
+    assert profile.stages["dwt"]["peak_bytes"] > 0
+
+
+def test_nested_stages_and_batch_aggregation():
+    """Nested stage time is not counted twice; batch runs sum the profiles of all files"""
+    profile = Profile()
+    with profile.stage("outer"):
+        with profile.stage("inner"):
+            time.sleep(0.02)
+    assert profile.stages["inner"]["seconds"] >= 0.02
+    assert profile.stages["outer"]["seconds"] < 0.01
+
+    fs = 22050
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for bpm in (100, 128):
+            paths.append(os.path.join(tmp, f"{bpm}.wav"))
+            write_wav(paths[-1], click_track(bpm, 6, fs)[:, None], fs, 2)
+
+        profile = Profile()
+        out = io.StringIO()
+        run_batch(paths, ResultWriter(out, "jsonl"), workers=1, profile=profile)
+
+        assert profile.stages["decode"]["samples"] == 2 * 6 * fs
+        assert profile.stages["peak"]["calls"] == 2
+        assert "profile" not in out.getvalue()
+
+
+def test_nested_stage_keeps_outer_peak():
+    """A nested stage starting does not erase the peak memory its outer stage reached before"""
+    profile = Profile(trace_allocations=True)
+    with profile.stage("outer"):
+        block = bytearray(4 * 2 ** 20)
+        del block
+        with profile.stage("inner"):
+            small = bytearray(2 ** 16)
+        del small
+    assert profile.stages["outer"]["peak_bytes"] >= 4 * 2 ** 20
+    assert 2 ** 16 <= profile.stages["inner"]["peak_bytes"] < 2 ** 20
+
+
+if __name__ == "__main__":
+    test_stages_recorded_without_changing_results()
+    test_nested_stages_and_batch_aggregation()
+    test_nested_stage_keeps_outer_peak()
+    print("All profiling tests passed")
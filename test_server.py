@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Tests for the analysis server and its thin client
+"""
+
+import contextlib
+import os
+import signal
+import socket
+import tempfile
+import threading
+import time
+
+from bpm_detection.batch import analyse_file
+from bpm_detection.cache import ResultCache
+from bpm_detection.client import analyse_files, analyse_pcm, request
+from bpm_detection.server import BPMServer, make_server
+from synthetic import click_track, write_wav
+
+
+@contextlib.contextmanager
+def running_server(bpm, **address):
+    """make_server(bpm, **address) serving in a background thread"""
+    server = make_server(bpm, **address)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_files_and_pcm_match_batch_rows():
+    """Files and raw PCM give the batch results; repeated files come from the cache"""
+    fs = 22050
+    bpm = BPMServer(workers=2, cache=ResultCache(":memory:"))
+    with tempfile.TemporaryDirectory() as tmp, running_server(bpm, port=0) as server:
+        address = {"port": server.server_address[1]}
+        paths = []
+        for tempo in (100, 128):
+            paths.append(os.path.join(tmp, f"{tempo}.wav"))
+            write_wav(paths[-1], click_track(tempo, 9, fs)[:, None], fs, 2)
+
+        expected = [analyse_file(path) for path in paths]
+        rows = analyse_files(paths + [os.path.join(tmp, "missing.wav")], **address)
+        assert [row["bpm"] for row in rows[:2]] == [row["bpm"] for row in expected]
+        assert rows[0]["windows"] == 3 and rows[0]["status"] == "ok"
+        assert rows[2]["status"] == "error" and "missing.wav" in rows[2]["error"]
+        assert analyse_files(paths[:1], **address) == rows[:1]
+        assert len(bpm.cache) == 2
+
+        stereo = click_track(128, 9, fs).repeat(2).tobytes()
+        row = analyse_pcm(stereo, fs, nchannels=2, name="stream", **address)
+        assert (row["path"], row["bpm"]) == ("stream", expected[1]["bpm"])
+
+        row = analyse_pcm(stereo, fs, nchannels=2, options={"adaptive": 0.5, "precision": "float32"}, **address)
+        assert row["bpm"] == expected[1]["bpm"] and row["windows"] == 3
+
+        for bad in ({"channels": "surround"}, {"window": "long"}, {"tempo": 120}):
+            try:
+                analyse_files(paths, bad, **address)
+            except ValueError as e:
+                assert list(bad)[0] in str(e)
+            else:
+                raise AssertionError(f"{bad} was accepted")
+
+        assert request("GET", "/status", **address)["requests"] == 4
+    bpm.close()
+
+
+def test_unix_socket():
+    """The server also listens on Unix sockets, replacing a stale socket file"""
+    if not hasattr(socket, "AF_UNIX"):
+        return
+
+    fs = 22050
+    bpm = BPMServer(workers=1)
+    with tempfile.TemporaryDirectory() as tmp:
+        socket_path = os.path.join(tmp, "bpm.sock")
+        stale = socket.socket(socket.AF_UNIX)
+        stale.bind(socket_path)
+        stale.close()
+
+        with running_server(bpm, socket_path=socket_path):
+            row = analyse_pcm(click_track(128, 9, fs).tobytes(), fs, socket_path=socket_path)
+            assert abs(row["bpm"] - 128) < 1.5
+    bpm.close()
+
+
+def test_broken_pool_is_replaced():
+    """A worker dying between requests costs one error row; the next request gets a fresh pool"""
+    if not hasattr(signal, "SIGKILL"):
+        return
+
+    fs = 22050
+    pcm = click_track(128, 9, fs).tobytes()
+    bpm = BPMServer(workers=1)
+    executor = bpm._executor
+    for pid in list(executor._processes):
+        os.kill(pid, signal.SIGKILL)
+    time.sleep(0.5)
+
+    assert bpm.analyse_pcm(pcm, fs)["status"] == "error"
+    assert bpm._executor is not executor
+    assert abs(bpm.analyse_pcm(pcm, fs)["bpm"] - 128) < 1.5
+    bpm.close()
+
+
+if __name__ == "__main__":
+    test_files_and_pcm_match_batch_rows()
+    test_unix_socket()
+    test_broken_pool_is_replaced()
+    print("All server tests passed")
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Start-up budget check: importing the detector must stay cheap
+
+Runs `python -X importtime` in a fresh interpreter and fails if importing
+bpm_detection pulls in the heavy analysis/plotting dependencies or exceeds the
+time budget.
+"""
+
+import subprocess
+import sys
+
+# Cumulative import time allowed for bpm_detection.bpm_detection (seconds).
+# numpy dominates; scipy.signal plus matplotlib alone used to cost over 2 s.
+IMPORT_BUDGET = 1.0
+
+HEAVY_MODULES = ["matplotlib", "scipy", "pywt", "pydub"]
+
+
+def import_times(statement):
+    """Cumulative import time in seconds for every module imported by statement"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def test_import_is_lazy():
+    """Heavy dependencies are deferred until audio is decoded or analysed"""
+    times = import_times("import bpm_detection.bpm_detection")
+
+    loaded = sorted(name for name in times if name.split(".")[0] in HEAVY_MODULES)
+    assert loaded == [], f"imported at start-up: {loaded}"
+    assert times["bpm_detection.bpm_detection"] < IMPORT_BUDGET
+
+
+if __name__ == "__main__":
+    times = import_times("import bpm_detection.bpm_detection")
+    print(f"bpm_detection.bpm_detection: {times['bpm_detection.bpm_detection'] * 1000:.0f} ms")
+    test_import_is_lazy()